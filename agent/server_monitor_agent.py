@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Reference push agent for Server Monitoring.
+
+Reads /proc on the host every --interval seconds and posts batches of samples
+to the backend's /api/ingest endpoint, so the backend never has to hold an
+SSH/WinRM session to this host. Standard library only (Python 3.6+).
+
+Usage:
+    # Issue a token for the server (shown once)
+    curl -X POST -H "X-Admin-Token: $ADMIN_TOKEN" -H "X-Data-Mode: live" \\
+        http://backend:5000/api/servers/<id>/ingest-token
+
+    SERVER_MONITOR_TOKEN=<token> python3 server_monitor_agent.py --url http://backend:5000
+
+Samples are buffered while the backend is unreachable (up to --max-buffer,
+oldest dropped first) and sent with the next successful batch.
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import socket
+import struct
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+GB = 1024.0 ** 3
+SECTOR_BYTES = 512
+
+# Whole disks only, like the backend's SSH collector
+DISK_DEVICE = re.compile(r"^(?:[shv]d[a-z]+|xvd[a-z]+|nvme\d+n\d+|mmcblk\d+)$")
+
+BINARY_CONTENT_TYPE = "application/vnd.server-monitoring.samples"
+
+# Same order as the backend's metrics/store.py FIELDS: a field's position is its id in binary batches
+FIELDS = [
+    "cpu_percent", "cpu_cores", "load_1", "load_5", "load_15",
+    "mem_total_gb", "mem_used_gb", "mem_available_gb", "mem_percent",
+    "disk_total_gb", "disk_used_gb", "disk_available_gb", "disk_percent",
+    "disk_read_bytes_per_sec", "disk_write_bytes_per_sec",
+    "net_bytes_sent", "net_bytes_recv", "net_bytes_sent_per_sec", "net_bytes_recv_per_sec",
+    "uptime_seconds",
+]
+
+
+def read(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return ""
+
+
+def counters():
+    """Cumulative CPU, network and disk counters plus the boot time"""
+    values = {"cpu_total": 0, "cpu_idle": 0, "net_sent": 0, "net_recv": 0, "disk_read": 0, "disk_write": 0}
+    btime = None
+    for line in read("/proc/stat").splitlines():
+        fields = line.split()
+        if fields and fields[0] == "cpu":
+            times = [int(x) for x in fields[1:9]]
+            values["cpu_total"] = sum(times)
+            values["cpu_idle"] = times[3] + times[4]
+        elif fields and fields[0] == "btime":
+            btime = int(fields[1])
+    for line in read("/proc/net/dev").splitlines()[2:]:
+        name, _, data = line.partition(":")
+        fields = data.split()
+        if name.strip() != "lo" and len(fields) >= 10:
+            values["net_recv"] += int(fields[0])
+            values["net_sent"] += int(fields[8])
+    for line in read("/proc/diskstats").splitlines():
+        fields = line.split()
+        if len(fields) >= 10 and DISK_DEVICE.match(fields[2]):
+            values["disk_read"] += int(fields[5]) * SECTOR_BYTES
+            values["disk_write"] += int(fields[9]) * SECTOR_BYTES
+    return values, btime
+
+
+def delta(previous, current):
+    """Increase of a summed counter; None if it went down (a reset or a removed interface or disk)"""
+    if current >= previous:
+        return current - previous
+    return None
+
+
+class Collector:
+    def __init__(self):
+        self.previous = None
+
+    def sample(self):
+        now = time.time()
+        values, btime = counters()
+        rates = {}
+        previous = self.previous
+        # A changed boot time means the counters restarted from zero
+        if previous is not None and previous[2] == btime and now > previous[0]:
+            elapsed = now - previous[0]
+            for name, value in values.items():
+                d = delta(previous[1][name], value)
+                rates[name] = d / elapsed if d is not None else None
+        self.previous = (now, values, btime)
+
+        if rates.get("cpu_total"):
+            cpu_percent = 100.0 * (1 - (rates["cpu_idle"] or 0) / rates["cpu_total"])
+        elif values["cpu_total"]:
+            cpu_percent = 100.0 * (1 - values["cpu_idle"] / values["cpu_total"])
+        else:
+            cpu_percent = None
+
+        meminfo = {}
+        for line in read("/proc/meminfo").splitlines():
+            name, _, rest = line.partition(":")
+            if rest.split():
+                meminfo[name] = int(rest.split()[0]) * 1024
+        mem_total = meminfo.get("MemTotal", 0)
+        mem_available = meminfo.get("MemAvailable", meminfo.get("MemFree", 0))
+
+        st = os.statvfs("/")
+        disk_total = st.f_blocks * st.f_frsize
+        disk_used = (st.f_blocks - st.f_bfree) * st.f_frsize
+        disk_available = st.f_bavail * st.f_frsize
+
+        load = (read("/proc/loadavg").split() + [None] * 3)[:3]
+        uptime = (read("/proc/uptime").split() or [None])[0]
+
+        row = {
+            "cpu_percent": round(max(0.0, min(100.0, cpu_percent)), 1) if cpu_percent is not None else None,
+            "cpu_cores": os.cpu_count(),
+            "load_1": float(load[0]) if load[0] else None,
+            "load_5": float(load[1]) if load[1] else None,
+            "load_15": float(load[2]) if load[2] else None,
+            "mem_total_gb": round(mem_total / GB, 2),
+            "mem_used_gb": round((mem_total - mem_available) / GB, 2),
+            "mem_available_gb": round(mem_available / GB, 2),
+            "mem_percent": round((mem_total - mem_available) * 100.0 / mem_total, 1) if mem_total else None,
+            "disk_total_gb": round(disk_total / GB, 2),
+            "disk_used_gb": round(disk_used / GB, 2),
+            "disk_available_gb": round(disk_available / GB, 2),
+            "disk_percent": round(disk_used * 100.0 / (disk_used + disk_available), 1) if disk_used + disk_available else None,
+            "disk_read_bytes_per_sec": rates.get("disk_read"),
+            "disk_write_bytes_per_sec": rates.get("disk_write"),
+            "net_bytes_sent": values["net_sent"],
+            "net_bytes_recv": values["net_recv"],
+            "net_bytes_sent_per_sec": rates.get("net_sent"),
+            "net_bytes_recv_per_sec": rates.get("net_recv"),
+            "uptime_seconds": float(uptime) if uptime else None,
+        }
+        return [round(now, 3)] + [row[name] for name in FIELDS], btime
+
+
+def host_info(btime):
+    os_name = ""
+    for line in read("/etc/os-release").splitlines():
+        if line.startswith("PRETTY_NAME="):
+            os_name = line.split("=", 1)[1].strip().strip('"')
+    return {
+        "hostname": socket.gethostname(),
+        "os": os_name or None,
+        "kernel": os.uname().release,
+        "boot_time": datetime.fromtimestamp(btime).strftime("%Y-%m-%d %H:%M:%S") if btime else None,
+    }
+
+
+def encode_binary(rows):
+    """Binary batch: header, field ids, then one little-endian double per value (NaN = missing)"""
+    row = struct.Struct("<{}d".format(len(FIELDS) + 1))
+    parts = [struct.pack("<4sHI", b"SMB1", len(FIELDS), len(rows)), struct.pack("<{}H".format(len(FIELDS)), *range(len(FIELDS)))]
+    for values in rows:
+        parts.append(row.pack(*(math.nan if value is None else value for value in values)))
+    return b"".join(parts)
+
+
+def post(url, token, body, timeout, binary=False):
+    request = urllib.request.Request(
+        url,
+        data=encode_binary(body) if binary else json.dumps(body).encode(),
+        headers={"Content-Type": BINARY_CONTENT_TYPE if binary else "application/json", "Authorization": "Bearer " + token},
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode() or "{}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Push host metrics to Server Monitoring")
+    parser.add_argument("--url", default=os.getenv("SERVER_MONITOR_URL", "http://localhost:5000"), help="backend base URL")
+    parser.add_argument("--token", default=os.getenv("SERVER_MONITOR_TOKEN"), help="ingest token (or SERVER_MONITOR_TOKEN)")
+    parser.add_argument("--interval", type=float, default=10.0, help="seconds between samples")
+    parser.add_argument("--batch-size", type=int, default=6, help="samples per POST")
+    parser.add_argument("--max-buffer", type=int, default=1000, help="samples kept while the backend is unreachable")
+    parser.add_argument("--timeout", type=float, default=10.0, help="HTTP timeout in seconds")
+    parser.add_argument("--format", choices=("json", "binary"), default="json", help="batch encoding (binary is cheaper for the backend to ingest)")
+    parser.add_argument("--once", action="store_true", help="send one sample and exit")
+    args = parser.parse_args()
+    if not args.token:
+        parser.error("an ingest token is required (--token or SERVER_MONITOR_TOKEN)")
+
+    url = args.url.rstrip("/") + "/api/ingest"
+    collector = Collector()
+    binary = args.format == "binary"
+    buffer = []
+    reported_btime = None
+    next_run = time.monotonic()
+    while True:
+        row, btime = collector.sample()
+        buffer.append(row)
+        del buffer[:-args.max_buffer]
+
+        if len(buffer) >= args.batch_size or args.once:
+            batch = buffer[:]
+            try:
+                if not binary:
+                    result = post(url, args.token, {"fields": FIELDS, "samples": batch, "host": host_info(btime)}, args.timeout)
+                else:
+                    # Binary batches carry no host inventory; report it as JSON after start-up and reboots
+                    if btime != reported_btime:
+                        post(url, args.token, {"fields": [], "samples": [], "host": host_info(btime)}, args.timeout)
+                        reported_btime = btime
+                    result = post(url, args.token, batch, args.timeout, binary=True)
+                del buffer[:len(batch)]
+                if result.get("rejected"):
+                    print("backend rejected {} samples".format(result["rejected"]), file=sys.stderr)
+            except urllib.error.HTTPError as e:
+                print("ingest failed: HTTP {} {}".format(e.code, e.read().decode(errors="replace")[:200]), file=sys.stderr)
+                if 400 <= e.code < 500 and e.code != 429:
+                    # A bad batch will not get better by retrying it
+                    del buffer[:len(batch)]
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                print("ingest failed, keeping {} samples: {}".format(len(buffer), e), file=sys.stderr)
+
+        if args.once:
+            return
+        next_run += args.interval
+        time.sleep(max(0.0, next_run - time.monotonic()))
+
+
+if __name__ == "__main__":
+    main()
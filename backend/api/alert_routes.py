@@ -0,0 +1,162 @@
+from datetime import datetime
+from urllib.parse import urlparse
+
+from flask import Blueprint, jsonify, request
+
+from ..db import db
+from ..metrics.alerts import COMPARATORS, RULE_KINDS, SEVERITIES, alert_engine
+from ..metrics.store import FIELDS
+from ..models import Alert, AlertRule, Server
+from .server_routes import _require_admin
+
+
+alert_bp = Blueprint("alert_bp", __name__)
+
+_ALERT_STATES = ("pending", "firing", "resolved")
+
+
+def _apply_rule_fields(rule: AlertRule, data: dict, partial: bool = False) -> None:
+    """Validate and copy rule fields from a request body; raises ValueError"""
+    def given(field):
+        return field in data or not partial
+    
+    if given("name"):
+        name = str(data.get("name") or "").strip()
+        if not name:
+            raise ValueError("name is required")
+        rule.name = name
+    if given("metric"):
+        if data.get("metric") not in FIELDS:
+            raise ValueError(f"metric must be one of: {', '.join(FIELDS)}")
+        rule.metric = data["metric"]
+    if given("kind"):
+        kind = data.get("kind") or "threshold"
+        if kind not in RULE_KINDS:
+            raise ValueError(f"kind must be one of: {', '.join(RULE_KINDS)}")
+        rule.kind = kind
+    if given("comparator"):
+        if data.get("comparator") not in COMPARATORS:
+            raise ValueError(f"comparator must be one of: {' '.join(COMPARATORS)}")
+        rule.comparator = data["comparator"]
+    if given("threshold"):
+        threshold = data.get("threshold")
+        if not isinstance(threshold, (int, float)) or isinstance(threshold, bool):
+            raise ValueError("threshold must be a number")
+        rule.threshold = float(threshold)
+    if given("duration"):
+        duration = data.get("duration") or 0
+        if not isinstance(duration, (int, float)) or isinstance(duration, bool) or duration < 0:
+            raise ValueError("duration must be a non-negative number of seconds")
+        rule.duration = float(duration)
+    if given("severity"):
+        severity = data.get("severity") or "warning"
+        if severity not in SEVERITIES:
+            raise ValueError(f"severity must be one of: {', '.join(SEVERITIES)}")
+        rule.severity = severity
+    if given("server_id"):
+        server_id = data.get("server_id")
+        if server_id is not None and Server.query.filter_by(id=server_id, is_demo=False).first() is None:
+            raise ValueError(f"Unknown server_id {server_id}")
+        rule.server_id = server_id
+    if given("tag"):
+        rule.tag = str(data.get("tag") or "").strip() or None
+    if given("webhook_url"):
+        url = data.get("webhook_url") or None
+        if url is not None and urlparse(url).scheme not in ("http", "https"):
+            raise ValueError("webhook_url must be an http(s) URL")
+        rule.webhook_url = url
+    if given("enabled"):
+        rule.enabled = bool(data.get("enabled", True))
+
+
+def _close_open_alerts(rule_id: int) -> None:
+    """Resolve a disabled rule's open alerts (no notification is sent)"""
+    now = datetime.utcnow()
+    for alert in Alert.query.filter(Alert.rule_id == rule_id, Alert.state.in_(("pending", "firing"))).all():
+        alert.state = "resolved"
+        alert.resolved_at = now
+
+
+@alert_bp.route("/alerts/rules", methods=["GET"])
+def list_alert_rules():
+    """All alert rules"""
+    rules = AlertRule.query.order_by(AlertRule.id).all()
+    return jsonify([rule.to_dict() for rule in rules])
+
+
+@alert_bp.route("/alerts/rules", methods=["POST"])  # admin-only
+def create_alert_rule():
+    """Create an alert rule, e.g. {"name": "High CPU", "metric": "cpu_percent", "comparator": ">", "threshold": 90, "duration": 300}"""
+    if not _require_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    
+    rule = AlertRule()
+    try:
+        _apply_rule_fields(rule, request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    db.session.add(rule)
+    db.session.commit()
+    alert_engine.reload()
+    
+    return jsonify(rule.to_dict()), 201
+
+
+@alert_bp.route("/alerts/rules/<int:rule_id>", methods=["PATCH"])  # admin-only
+def update_alert_rule(rule_id: int):
+    """Change some fields of an alert rule"""
+    if not _require_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    
+    rule = AlertRule.query.get_or_404(rule_id)
+    try:
+        _apply_rule_fields(rule, request.get_json(silent=True) or {}, partial=True)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    
+    if not rule.enabled:
+        _close_open_alerts(rule.id)
+    db.session.commit()
+    alert_engine.reload()
+    
+    return jsonify(rule.to_dict()), 200
+
+
+@alert_bp.route("/alerts/rules/<int:rule_id>", methods=["DELETE"])  # admin-only
+def delete_alert_rule(rule_id: int):
+    """Delete an alert rule and its alert history"""
+    if not _require_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    
+    rule = AlertRule.query.get_or_404(rule_id)
+    Alert.query.filter_by(rule_id=rule.id).delete()
+    db.session.delete(rule)
+    db.session.commit()
+    alert_engine.reload()
+    
+    return jsonify({"message": "Alert rule deleted", "id": rule_id}), 200
+
+
+@alert_bp.route("/alerts", methods=["GET"])
+def list_alerts():
+    """Alerts, newest first. Query params: state (pending/firing/resolved), server_id, limit (default 100)"""
+    query = Alert.query
+    
+    state = request.args.get("state")
+    if state:
+        if state not in _ALERT_STATES:
+            return jsonify({"error": f"state must be one of: {', '.join(_ALERT_STATES)}"}), 400
+        query = query.filter_by(state=state)
+    try:
+        if request.args.get("server_id"):
+            query = query.filter_by(server_id=int(request.args["server_id"]))
+        limit = int(request.args.get("limit", 100))
+    except ValueError:
+        return jsonify({"error": "server_id and limit must be integers"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+    
+    alerts = query.order_by(Alert.started_at.desc(), Alert.id.desc()).limit(limit).all()
+    return jsonify([alert.to_dict() for alert in alerts])
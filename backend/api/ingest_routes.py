@@ -0,0 +1,71 @@
+from datetime import datetime
+
+from flask import Blueprint, jsonify, request
+
+from ..db import db
+from ..handlers.inventory import inventory_changed, store_inventory
+from ..metrics.alerts import alert_engine
+from ..metrics.ingest import BINARY_CONTENT_TYPE, bearer_token, hash_token, parse_batch, parse_binary_batch
+from ..metrics.reports import daily_reports
+from ..metrics.store import metrics_store
+from ..metrics.writer import DURABLE_INGEST, WriteBufferFull
+from ..models import Server
+
+
+ingest_bp = Blueprint("ingest_bp", __name__)
+
+
+@ingest_bp.route("/ingest", methods=["POST"])  # agents authenticate with their server's ingest token
+def ingest():
+    """Accept a JSON or binary batch of metrics samples pushed by an agent (formats in metrics/ingest.py)"""
+    token = bearer_token(request.headers.get("Authorization"))
+    if not token:
+        return jsonify({"error": "Missing ingest token"}), 401
+    
+    server = Server.query.filter_by(ingest_token_hash=hash_token(token)).first()
+    if server is None or server.is_demo:
+        return jsonify({"error": "Invalid ingest token"}), 401
+    
+    payload = None
+    try:
+        if request.mimetype == BINARY_CONTENT_TYPE:
+            field_ids, rows, rejected = parse_binary_batch(request.get_data(cache=False))
+        else:
+            payload = request.get_json(silent=True)
+            field_ids, rows, rejected = parse_batch(payload)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        accepted = metrics_store.add_rows(server.id, field_ids, rows, source="push", durable=DURABLE_INGEST)
+    except WriteBufferFull as e:
+        # Back off: the agent keeps the batch and sends it again
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = str(int(e.retry_after))
+        return response, 503
+    alert_engine.observe(server, field_ids, rows)
+    if rows:
+        daily_reports.observe(server, max(row[0] for row in rows))
+    
+    if rows:
+        server.status = "online"
+        server.last_seen = datetime.utcnow()
+    # JSON agents report the host inventory with every batch; it only changes on reboot or upgrade
+    host = payload.get("host") if payload else None
+    if isinstance(host, dict) and host.get("kernel"):
+        info = {
+            "os": host.get("os"),
+            "kernel": host.get("kernel"),
+            "hostname": host.get("hostname"),
+            "uptime_since": host.get("boot_time"),
+        }
+        if inventory_changed(server, info):
+            store_inventory(server, info)
+    db.session.commit()
+    
+    return jsonify({
+        "server_id": server.id,
+        "accepted": accepted,
+        "duplicates": len(rows) - accepted,
+        "rejected": rejected,
+    })
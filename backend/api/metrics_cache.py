@@ -0,0 +1,102 @@
+"""
+Response cache for live metrics endpoints.
+
+Successful metrics responses are kept per (server_id, endpoint) in a small
+LRU with a per-endpoint TTL and served with ETag / Cache-Control headers, so
+the dashboard and any HTTP cache in front of it can reuse them instead of
+triggering a new SSH/WinRM probe on every click. Clients bypass the cache
+with ?fresh=1.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from flask import Response, request
+
+
+METRICS_TTL = float(os.getenv("METRICS_CACHE_TTL", "15"))
+DETAILED_METRICS_TTL = float(os.getenv("DETAILED_METRICS_CACHE_TTL", "120"))
+MAX_ENTRIES = int(os.getenv("METRICS_CACHE_SIZE", "512"))
+
+
+class _Entry:
+    __slots__ = ("body", "etag", "stored_at", "expires_at")
+
+    def __init__(self, body: bytes, ttl: float):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.stored_at = time.monotonic()
+        self.expires_at = self.stored_at + ttl
+
+
+class MetricsCache:
+    """LRU of serialized JSON responses with per-entry expiry"""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Optional[_Entry]:
+        """Return the live entry for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, payload, ttl: float) -> _Entry:
+        """Serialize payload once and cache it for ttl seconds (not at all if ttl <= 0)"""
+        entry = _Entry(json.dumps(payload, sort_keys=True).encode(), ttl)
+        if ttl <= 0:
+            return entry
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, server_id: int) -> None:
+        """Drop every cached response for a server"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == server_id]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+metrics_cache = MetricsCache()
+
+
+def wants_fresh() -> bool:
+    """True when the request asks to bypass the cache (?fresh=1)"""
+    return request.args.get("fresh", "").lower() in ("1", "true", "yes")
+
+
+def cached_response(entry: _Entry, hit: bool) -> Response:
+    """Build a 200 (or 304 for a matching If-None-Match) response for a cache entry"""
+    now = time.monotonic()
+    response = Response(entry.body, status=200, mimetype="application/json", headers={
+        "Cache-Control": f"private, max-age={max(0, int(entry.expires_at - now))}",
+        "Age": str(int(now - entry.stored_at)),
+        "X-Cache": "HIT" if hit else "MISS",
+        # Demo and live mode return different data for the same URL
+        "Vary": "X-Data-Mode",
+    })
+    response.set_etag(entry.etag)
+    return response.make_conditional(request)
@@ -0,0 +1,114 @@
+import hmac
+import os
+import time
+
+from flask import Blueprint, Response, jsonify, request
+
+from ..handlers.breaker import host_breaker
+from ..handlers.limits import host_limiter
+from ..handlers.probe import probe_pool
+from ..metrics.alerts import alert_engine
+from ..metrics.anomaly import anomaly_detector
+from ..metrics.ingest import bearer_token
+from ..metrics.prometheus import CONTENT_TYPE, SAMPLE_METRICS, Exposition
+from ..metrics.store import FIELDS, metrics_store
+from ..models import Server
+from .metrics_cache import metrics_cache
+
+
+prometheus_bp = Blueprint("prometheus_bp", __name__)
+
+# Samples older than this are left out, so Prometheus marks the series stale
+_MAX_AGE = float(os.getenv("PROMETHEUS_MAX_AGE", "600"))
+
+
+def _server_metrics(exposition: Exposition) -> None:
+    """Latest stored sample of every live server"""
+    servers = Server.query.with_entities(Server.id, Server.name, Server.hostname, Server.os_type, Server.status).filter(
+        Server.is_demo.isnot(True)).all()
+    latest = metrics_store.latest_rows(server.id for server in servers)
+    cutoff = time.time() - _MAX_AGE
+    for server in servers:
+        labels = {"server_id": server.id, "server": server.name or server.hostname, "os_type": server.os_type}
+        exposition.add("server_up", "gauge", "1 if the last poll or push reached the server", server.status == "online", labels)
+        sample = latest.get(server.id)
+        if sample is None:
+            continue
+        timestamp, row = sample
+        exposition.add("server_last_sample_timestamp_seconds", "gauge", "Unix time of the latest stored sample",
+                       timestamp, labels)
+        if timestamp < cutoff:
+            continue
+        for name, value in zip(FIELDS, row):
+            metric, kind, help_text = SAMPLE_METRICS[name]
+            # NaN marks a missing value in pushed batches
+            exposition.add(metric, kind, help_text, None if value is None or value != value else value, labels)
+
+
+def _backend_metrics(exposition: Exposition) -> None:
+    """Session limiter, breakers, probes, caches and the metrics pipeline"""
+    for host, slots in host_limiter.stats().items():
+        labels = {"host": host}
+        exposition.add("portal_host_session_limit", "gauge", "Concurrent remote sessions allowed per host", slots["limit"], labels)
+        exposition.add("portal_host_sessions_active", "gauge", "Remote sessions in use", slots["active"], labels)
+        exposition.add("portal_host_sessions_waiting", "gauge", "Requests queued for a session slot", slots["waiting"], labels)
+        exposition.add("portal_host_sessions_acquired_total", "counter", "Session slots handed out", slots["acquired"], labels)
+        exposition.add("portal_host_sessions_rejected_total", "counter", "Requests that gave up waiting for a slot", slots["rejected"], labels)
+        exposition.add("portal_host_session_wait_avg_seconds", "gauge", "Average wait for a session slot", slots["avg_wait_ms"] / 1000, labels)
+        exposition.add("portal_host_session_wait_max_seconds", "gauge", "Longest wait for a session slot", slots["max_wait_ms"] / 1000, labels)
+
+    for host, breaker in host_breaker.stats().items():
+        labels = {"host": host}
+        exposition.add("portal_breaker_open", "gauge", "1 while the host's circuit breaker is open or half open",
+                       breaker["state"] != "closed", labels)
+        exposition.add("portal_breaker_failures", "gauge", "Consecutive failed calls to the host", breaker["failures"], labels)
+        exposition.add("portal_breaker_opens_total", "counter", "Times the host's breaker opened", breaker["opens"], labels)
+
+    probes = probe_pool.stats()
+    exposition.add("portal_probes_running", "gauge", "Persistent SSH probes running", len(probes))
+    for probe, session in probes.items():
+        labels = {"probe": probe}
+        exposition.add("portal_probe_requests_total", "counter", "Requests answered by the probe", session["requests"], labels)
+        exposition.add("portal_probe_request_avg_seconds", "gauge", "Average probe request latency", session["avg_ms"] / 1000, labels)
+        exposition.add("portal_probe_request_max_seconds", "gauge", "Slowest probe request", session["max_ms"] / 1000, labels)
+
+    cache = metrics_cache.stats()
+    exposition.add("portal_metrics_cache_entries", "gauge", "Cached metrics responses", cache["entries"])
+    exposition.add("portal_metrics_cache_hits_total", "counter", "Metrics requests served from cache", cache["hits"])
+    exposition.add("portal_metrics_cache_misses_total", "counter", "Metrics requests that went to the host", cache["misses"])
+
+    # Not metrics_store.stats(): that walks the segment files on every scrape
+    store = metrics_store.memory_stats()
+    exposition.add("portal_metrics_store_servers", "gauge", "Servers with samples in memory", store["servers"])
+    exposition.add("portal_metrics_store_samples", "gauge", "Samples held in memory", store["samples"])
+    if metrics_store.writer is not None:
+        writer = metrics_store.writer.stats()
+        exposition.add("portal_segment_queue_rows", "gauge", "Rows waiting to be written to segment files", writer["queued_rows"])
+        exposition.add("portal_segment_queue_limit_rows", "gauge", "Queued rows at which ingest is refused", writer["max_rows"])
+        exposition.add("portal_segment_flushes_total", "counter", "Group commits to segment files", writer["flushes"])
+        exposition.add("portal_segment_rows_written_total", "counter", "Rows written to segment files", writer["rows_written"])
+        exposition.add("portal_segment_write_errors_total", "counter", "Failed segment flushes", writer["write_errors"])
+        exposition.add("portal_segment_rows_dropped_total", "counter", "Rows dropped because they could not be written", writer["rows_dropped"])
+        if writer["last_flush_ms"] is not None:
+            exposition.add("portal_segment_last_flush_seconds", "gauge", "Duration of the last flush", writer["last_flush_ms"] / 1000)
+
+    exposition.add("portal_anomaly_series", "gauge", "Metric series with an anomaly baseline", anomaly_detector.stats()["series"])
+    states = {"pending": 0, "firing": 0}
+    for state in alert_engine.states():
+        states[state["state"]] = states.get(state["state"], 0) + 1
+    for state, count in states.items():
+        exposition.add("portal_alerts", "gauge", "Open alerts by state", count, {"state": state})
+
+
+@prometheus_bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Latest stored samples and backend internals in Prometheus exposition format (no remote calls)"""
+    expected = os.getenv("METRICS_SCRAPE_TOKEN")
+    presented = bearer_token(request.headers.get("Authorization")) or ""
+    if expected and not hmac.compare_digest(presented.encode(), expected.encode()):
+        return jsonify({"error": "unauthorized"}), 401
+
+    exposition = Exposition()
+    _server_metrics(exposition)
+    _backend_metrics(exposition)
+    return Response(exposition.render(), content_type=CONTENT_TYPE)
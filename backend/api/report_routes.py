@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+
+from flask import Blueprint, jsonify, request
+
+from ..metrics.reports import combine
+from ..models import DailySummary, Server
+from .server_routes import _is_demo_mode
+
+
+report_bp = Blueprint("report_bp", __name__)
+
+_DEFAULT_DAYS = 30
+
+
+def _report_query():
+    """Servers and day range of a report request. Returns (servers, first, last, None) or (..., error response)"""
+    yesterday = datetime.utcnow().date() - timedelta(days=1)
+    try:
+        last = datetime.strptime(request.args["until"], "%Y-%m-%d").date() if request.args.get("until") else yesterday
+        first = (datetime.strptime(request.args["since"], "%Y-%m-%d").date() if request.args.get("since")
+                 else last - timedelta(days=_DEFAULT_DAYS - 1))
+        server_ids = [int(i) for i in request.args.get("server_ids", "").split(",") if i.strip()]
+    except ValueError:
+        return None, None, None, (jsonify({"error": "since/until must be dates (YYYY-MM-DD) and server_ids integers"}), 400)
+    if first > last:
+        return None, None, None, (jsonify({"error": "since must not be after until"}), 400)
+    # Today is summarised tomorrow
+    last = min(last, yesterday)
+
+    if _is_demo_mode():
+        # Demo servers have no stored history to summarise
+        return [], first, last, None
+    query = Server.query.filter_by(is_demo=False)
+    if server_ids:
+        query = query.filter(Server.id.in_(server_ids))
+    tag = request.args.get("tag")
+    servers = [s for s in query.order_by(Server.id).all() if not tag or tag in s.tag_list()]
+    return servers, first, last, None
+
+
+def _daily_rows(servers, first, last) -> dict:
+    """DailySummary rows per server id, oldest first"""
+    rows = {server.id: [] for server in servers}
+    if not servers:
+        return rows
+    query = DailySummary.query.filter(
+        DailySummary.server_id.in_(list(rows)), DailySummary.day >= first, DailySummary.day <= last,
+    ).order_by(DailySummary.server_id, DailySummary.day)
+    for row in query:
+        rows[row.server_id].append(row)
+    return rows
+
+
+@report_bp.route("/reports/daily", methods=["GET"])
+def daily_report():
+    """Daily summaries per server
+
+    Query params: since / until (YYYY-MM-DD, default the last 30 finished
+    days), server_ids (comma-separated) and tag.
+    """
+    servers, first, last, error = _report_query()
+    if error:
+        return error
+
+    rows = _daily_rows(servers, first, last)
+    return jsonify({
+        "since": first.isoformat(),
+        "until": last.isoformat(),
+        "servers": [
+            {"server_id": server.id, "name": server.name or server.hostname, "days": [row.to_dict() for row in rows[server.id]]}
+            for server in servers
+        ],
+    })
+
+
+@report_bp.route("/reports/summary", methods=["GET"])
+def summary_report():
+    """Uptime, CPU, memory, disk growth and outages per server over a period, from the daily summaries
+
+    Same query params as /reports/daily.
+    """
+    servers, first, last, error = _report_query()
+    if error:
+        return error
+
+    rows = _daily_rows(servers, first, last)
+    return jsonify({
+        "since": first.isoformat(),
+        "until": last.isoformat(),
+        "servers": [
+            {"server_id": server.id, "name": server.name or server.hostname, "os_type": server.os_type, **combine(rows[server.id])}
+            for server in servers
+        ],
+    })
@@ -1,36 +1,47 @@
+import codecs
 import os
+import json
+import math
 import subprocess
-from flask import Blueprint, jsonify, request
+import threading
+import time
+import uuid
+from flask import Blueprint, Response, jsonify, request
 
 from ..db import db
-from ..models import Server
-from ..handlers.linux_handler import (
-    get_basic_metrics as linux_metrics,
-    create_user as linux_create_user,
-    list_users as linux_list_users,
-    delete_user as linux_delete_user,
-    test_connection as linux_test_connection,
-    get_detailed_metrics as linux_detailed_metrics,
-    execute_command as linux_execute_command,
-    restart_service as linux_restart_service,
-    start_service as linux_start_service,
-    stop_service as linux_stop_service,
-    run_health_check as linux_health_check,
+from ..models import Alert, DailySummary, Server
+from ..handlers.credentials import get_server_password
+from ..handlers.breaker import CircuitOpenError, host_breaker
+from ..handlers.inventory import get_system_info
+from ..handlers.limits import HostBusyError, host_limiter
+from ..handlers.probe import probe_pool
+from ..handlers.rates import counter_rates
+from ..handlers.timeouts import RemoteTimeout, parse_timeout, server_timeouts
+from ..handlers.fleet import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_HOST_TIMEOUT,
+    MAX_HOST_TIMEOUT,
+    MAX_SERVERS,
+    HostTimeout,
+    fan_out,
 )
-from ..handlers.windows_handler import (
-    get_basic_metrics as windows_metrics,
-    create_windows_user,
-    list_users as windows_list_users,
-    delete_user as windows_delete_user,
-    test_connection as windows_test_connection,
-    get_detailed_metrics as windows_detailed_metrics,
-    execute_command as windows_execute_command,
-    restart_service as windows_restart_service,
-    start_service as windows_start_service,
-    stop_service as windows_stop_service,
-    run_health_check as windows_health_check,
+from ..handlers.executors import (
+    SERVICE_ACTIONS,
+    UnsupportedOSType,
+    get_executor,
+    get_executor_class,
 )
 
+from ..metrics.aggregate import GROUP_BY, aggregate, fleet_frame, frame_from_samples, parse_reductions, top_k
+from ..metrics.alerts import alert_engine
+from ..metrics.anomaly import anomaly_detector
+from ..metrics.export import FORMATS as EXPORT_FORMATS, ExportQuery, export_csv, export_parquet, parquet_available
+from ..metrics.ingest import FRESH_FOR, issue_token
+from ..metrics.reports import daily_reports
+from ..metrics.store import FIELDS, metrics_from_sample, metrics_store, sample_from_metrics
+from ..metrics.writer import WriteBufferFull
+from .metrics_cache import DETAILED_METRICS_TTL, METRICS_TTL, cached_response, metrics_cache, wants_fresh
+
 # Import demo data
 from ..demo_data import get_demo_servers, generate_demo_metrics, get_demo_users
 
@@ -72,62 +83,35 @@ def _is_demo_mode():
     return True
 
 
-def _get_windows_credentials(server: Server, data: dict) -> tuple[str, int]:
-    """Helper function to get Windows password and port from request or stored values"""
-    # Try to get password from request, fallback to stored password
-    password = data.get("password")
-    if not password or (isinstance(password, str) and password.strip() == ""):
-        stored_password = server.get_password()
-        if stored_password:
-            password = stored_password
-        else:
-            raise ValueError("password required for windows")
-    
-    # Get port - prioritize stored winrm_port for Windows servers
-    # Only use request port if it's explicitly provided AND it's a valid WinRM port (5985 or 5986)
-    # Ignore SSH port (22) if it's accidentally passed
-    request_port = data.get("port")
-    if request_port:
-        try:
-            request_port = int(request_port)
-            # If it's a valid WinRM port, use it (allows override)
-            if request_port in [5985, 5986]:
-                port = request_port
-            else:
-                # Invalid port for Windows (likely SSH port 22), use stored winrm_port instead
-                port = int(server.winrm_port) if hasattr(server, 'winrm_port') and server.winrm_port else 5985
-        except (ValueError, TypeError):
-            # Invalid port value, use stored winrm_port
-            port = int(server.winrm_port) if hasattr(server, 'winrm_port') and server.winrm_port else 5985
-    else:
-        # No port in request, use stored winrm_port or default
-        port = int(server.winrm_port) if hasattr(server, 'winrm_port') and server.winrm_port else 5985
-    
-    return password, port
+def _get_executor(server: Server, data: dict):
+    """Build the remote executor for a server. Returns (executor, None) or (None, error response)"""
+    try:
+        return get_executor(server, data), None
+    except UnsupportedOSType as e:
+        return None, (jsonify({"error": str(e)}), 400)
+    except ValueError as e:
+        return None, (jsonify({"error": str(e)}), 400)
 
 
-def _get_linux_credentials(server: Server, data: dict) -> tuple[str | None, str | None, int]:
-    """Helper function to get Linux credentials (password, key_path, port) from request or stored values"""
-    # Get password from request or stored
-    password = data.get("password")
-    if not password or (isinstance(password, str) and password.strip() == ""):
-        stored_password = server.get_password()
-        if stored_password:
-            password = stored_password
-        else:
-            password = None
-    
-    # Get key_path from request or stored
-    key_path = data.get("key_path") or server.key_path
-    
-    # Get port (default to stored ssh_port, then request param, then 22)
-    port = int(data.get("port") or server.ssh_port or 22)
-    
-    # Validate: need either key_path or password
-    if not key_path and not password:
-        raise ValueError("key_path or password required for linux")
-    
-    return password, key_path, port
+def _remote_endpoint(server: Server) -> str:
+    """host:port key the handlers use for a server's session limiter and circuit breaker"""
+    if server.os_type == "windows":
+        return f"{server.ip}:{server.winrm_port or 5985}"
+    return f"{server.ip}:{server.ssh_port or 22}"
+
+
+def _remote_error_response(exc: Exception):
+    """Error response for a host that is busy (HostBusyError), known to be down
+    (CircuitOpenError) or too slow (RemoteTimeout)"""
+    if isinstance(exc, RemoteTimeout):
+        return jsonify({"error": str(exc), "timeout": exc.to_dict()}), 504
+    response = jsonify({"error": str(exc)})
+    if isinstance(exc, CircuitOpenError):
+        response.headers["Retry-After"] = str(max(1, int(exc.retry_after)))
+    return response, 503
+
+
+_TIMEOUT_FIELDS = ("connect_timeout", "auth_timeout", "command_timeout")
 
 
 @server_bp.route("/servers", methods=["POST"])
@@ -156,6 +140,12 @@ def register_server():
         notes=data.get("notes"),
         is_demo=is_demo,
     )
+    server.set_tags(data.get("tags"))
+    try:
+        for field in _TIMEOUT_FIELDS:
+            setattr(server, field, parse_timeout(data.get(field), field))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     # Get credentials from request (don't save yet - only save after successful test)
     password = data.get("password")
@@ -181,73 +171,50 @@ def register_server():
         server.ssh_port = test_port
         if password:
             server.set_password(password)
+        if data.get("key_passphrase"):
+            server.set_key_passphrase(data["key_passphrase"])
     
     # Test connection (credentials already saved above)
     connection_status = None
     initial_metrics = None
     if not is_demo:
         try:
-            if server.os_type == "windows":
-                # Windows requires password
-                if not password:
-                    connection_status = {"success": False, "message": "Password is required for Windows servers"}
-                else:
-                    from ..handlers.windows_handler import test_connection, get_basic_metrics
+            executor_class = get_executor_class(server.os_type)
+        except UnsupportedOSType:
+            executor_class = None
+        
+        # Windows requires password
+        if executor_class and server.os_type == "windows" and not password:
+            connection_status = {"success": False, "message": "Password is required for Windows servers"}
+        elif executor_class:
+            executor = executor_class(server.ip, server.username, test_port, password=password, key_path=server.key_path,
+                                      timeouts=server_timeouts(server), key_passphrase=data.get("key_passphrase"))
+            try:
+                success, message = executor.connect()
+                connection_status = {"success": success, "message": message}
+                if success:
+                    # Credentials already saved above, just commit
+                    db.session.commit()
+                    
+                    # Fetch initial metrics
                     try:
-                        success, message = test_connection(server.ip, server.username, password, test_port)
-                        connection_status = {"success": success, "message": message}
-                        if success:
-                            # Credentials already saved above, just commit
-                            db.session.commit()
-                            
-                            # Fetch initial metrics
-                            try:
-                                initial_metrics = get_basic_metrics(server.ip, server.username, password, test_port)
-                                server.status = "online"
-                                from datetime import datetime
-                                server.last_seen = datetime.utcnow()
-                                db.session.commit()
-                            except Exception as e:
-                                print(f"Failed to fetch initial metrics: {e}")
-                                connection_status = {"success": True, "message": f"Connection successful but metrics fetch failed: {str(e)}"}
-                    except Exception as conn_err:
-                        # Network/connection errors during test
-                        error_msg = str(conn_err)
-                        if "401" in error_msg or "authentication" in error_msg.lower() or "unauthorized" in error_msg.lower():
-                            connection_status = {"success": False, "message": f"Authentication failed. Please verify username and password are correct."}
-                        elif "connection" in error_msg.lower() or "refused" in error_msg.lower() or "timeout" in error_msg.lower() or "network" in error_msg.lower():
-                            connection_status = {"success": False, "message": f"Network error: Unable to connect to {server.ip}:{test_port}. Check:\n1. Server is running and accessible\n2. WinRM service is running (run 'winrm quickconfig' on Windows server)\n3. Firewall allows connections on port {test_port}\n4. Server IP is correct"}
-                        else:
-                            connection_status = {"success": False, "message": f"Connection test failed: {error_msg}"}
-            elif server.os_type == "linux":
-                from ..handlers.linux_handler import test_connection, get_basic_metrics
-                key_path = server.key_path
-                
-                # For Linux, test with provided credentials
-                try:
-                    success, message = test_connection(server.ip, server.username, key_path, password, test_port)
-                    connection_status = {"success": success, "message": message}
-                    if success:
-                        # Credentials already saved above, just commit
+                        initial_metrics = executor.collect_metrics()
+                        server.status = "online"
+                        from datetime import datetime
+                        server.last_seen = datetime.utcnow()
                         db.session.commit()
-                        
-                        # Fetch initial metrics
-                        try:
-                            initial_metrics = get_basic_metrics(server.ip, server.username, key_path, password, test_port)
-                            server.status = "online"
-                            from datetime import datetime
-                            server.last_seen = datetime.utcnow()
-                            db.session.commit()
-                        except Exception as e:
-                            print(f"Failed to fetch initial metrics: {e}")
-                except Exception as conn_err:
-                    connection_status = {"success": False, "message": f"Connection test failed: {str(conn_err)}"}
-        except Exception as e:
-            # Catch-all for any unexpected errors
-            import traceback
-            print(f"Unexpected error during connection test: {e}")
-            print(traceback.format_exc())
-            connection_status = {"success": False, "message": f"Connection test encountered an error: {str(e)}"}
+                    except Exception as e:
+                        print(f"Failed to fetch initial metrics: {e}")
+                        connection_status = {"success": True, "message": f"Connection successful but metrics fetch failed: {str(e)}"}
+            except Exception as conn_err:
+                # Network/connection errors during test
+                error_msg = str(conn_err)
+                if "401" in error_msg or "authentication" in error_msg.lower() or "unauthorized" in error_msg.lower():
+                    connection_status = {"success": False, "message": f"Authentication failed. Please verify username and password are correct."}
+                elif "connection" in error_msg.lower() or "refused" in error_msg.lower() or "timeout" in error_msg.lower() or "network" in error_msg.lower():
+                    connection_status = {"success": False, "message": f"Network error: Unable to connect to {server.ip}:{test_port}. Check:\n1. Server is running and accessible\n2. The {'WinRM' if server.os_type == 'windows' else 'SSH'} service is running\n3. Firewall allows connections on port {test_port}\n4. Server IP is correct"}
+                else:
+                    connection_status = {"success": False, "message": f"Connection test failed: {error_msg}"}
     
     # Commit server even if connection test failed (server is still registered)
     try:
@@ -278,9 +245,18 @@ def delete_server(server_id: int):
     if server.is_demo:
         return jsonify({"error": "Demo server not accessible in live mode"}), 403
     
+    endpoint = _remote_endpoint(server)
     try:
+        Alert.query.filter_by(server_id=server_id).delete()
+        DailySummary.query.filter_by(server_id=server_id).delete()
         db.session.delete(server)
         db.session.commit()
+        metrics_cache.invalidate(server_id)
+        metrics_store.forget(server_id)
+        counter_rates.forget(endpoint)
+        alert_engine.forget_server(server_id)
+        anomaly_detector.forget(server_id)
+        daily_reports.forget(server_id)
         return jsonify({"message": "Server deleted successfully", "id": server_id}), 200
     except Exception as e:
         db.session.rollback()
@@ -296,7 +272,11 @@ def list_servers():
     # LIVE MODE - return ONLY live servers from database (is_demo=False), NEVER demo data
     if not is_demo:
         servers = Server.query.filter_by(is_demo=False).order_by(Server.id.desc()).all()
-        server_list = [s.to_dict() for s in servers]
+        server_list = []
+        for s in servers:
+            server_dict = s.to_dict()
+            server_dict["breaker"] = host_breaker.state(_remote_endpoint(s))
+            server_list.append(server_dict)
         return jsonify(server_list)
     
     # DEMO MODE - return ONLY demo servers, NEVER real data
@@ -306,6 +286,21 @@ def list_servers():
     return jsonify(demo_servers)
 
 
+@server_bp.route("/servers/session-limits", methods=["GET"])
+def get_session_limits():
+    """Per-host remote session slot usage and queue-time statistics"""
+    return jsonify({
+        "max_sessions_per_host": host_limiter.max_sessions,
+        "queue_timeout": host_limiter.queue_timeout,
+        "hosts": host_limiter.stats(),
+        "breakers": host_breaker.stats(),
+        "metrics_cache": metrics_cache.stats(),
+        "probes": probe_pool.stats(),
+        "metrics_store": metrics_store.stats(),
+        "anomaly_detector": anomaly_detector.stats(),
+    })
+
+
 @server_bp.route("/servers/<int:server_id>/metrics", methods=["GET"])  # credentials via query/body
 def fetch_metrics(server_id: int):
     """Fetch metrics for a specific server"""
@@ -337,7 +332,6 @@ def fetch_metrics(server_id: int):
     mock_mode = data.get("mock", "false").lower() == "true"
     if mock_mode:
         import random
-        import time
         
         # Generate realistic mock data based on server status
         if server.status == "offline":
@@ -402,67 +396,75 @@ def fetch_metrics(server_id: int):
         }
         return jsonify(mock_metrics)
 
+    # Hosts running the push agent are served from their latest sample, no probe needed
+    pushed = metrics_store.latest(server_id, source="push")
+    if pushed is not None and time.time() - pushed["timestamp"] <= FRESH_FOR:
+        return jsonify(metrics_from_sample(pushed, server))
+    
+    # Serve a recent probe result unless the client asks for fresh data
+    cache_key = (server_id, "metrics")
+    entry = None if wants_fresh() else metrics_cache.get(cache_key)
+    if entry is not None:
+        return cached_response(entry, hit=True)
+    
     # Real metrics (original code)
-    if server.os_type == "linux":
-        try:
-            password, key_path, port = _get_linux_credentials(server, data)
-        except ValueError as e:
+    try:
+        executor = get_executor(server, data)
+    except UnsupportedOSType as e:
+        return jsonify({"error": str(e)}), 400
+    except ValueError as e:
+        if server.os_type != "windows":
             return jsonify({"error": str(e)}), 400
-        
-        try:
-            metrics = linux_metrics(server.ip, server.username, key_path, password, port)
-            # Update server status and last_seen on successful connection
-            server.status = "online"
-            from datetime import datetime
-            server.last_seen = datetime.utcnow()
-            db.session.commit()
-            return jsonify(metrics)
-        except Exception as exc:  # noqa: WPS429
-            # Update server status to offline on connection failure
-            server.status = "offline"
-            db.session.commit()
-            return jsonify({"error": str(exc)}), 500
-    elif server.os_type == "windows":
-        try:
-            password, port = _get_windows_credentials(server, data)
-        except ValueError as e:
-            # Provide detailed error message
-            stored_password_available = bool(server.get_password())
-            return jsonify({
-                "error": str(e),
-                "details": {
-                    "message": "Windows servers require a password for WinRM authentication",
-                    "received_data": {
-                        "password_provided": bool(data.get("password")),
-                        "stored_password_available": stored_password_available,
-                        "password_type": type(data.get("password")).__name__ if data.get("password") else "None",
-                        "all_params": list(data.keys()) if data else "No data received",
-                        "request_method": request.method,
-                        "content_type": request.content_type,
-                        "server_id": server_id,
-                        "server_name": server.name or server.hostname,
-                        "has_encrypted_password": bool(server.encrypted_password)
-                    },
-                    "solution": "Stored password exists but decryption failed. Please test connection again to update credentials." if stored_password_available 
-                        else "Include 'password' parameter in request, or test connection during server registration to save credentials"
-                }
-            }), 400
-        
+        # Provide detailed error message
+        stored_password_available = bool(get_server_password(server))
+        return jsonify({
+            "error": str(e),
+            "details": {
+                "message": "Windows servers require a password for WinRM authentication",
+                "received_data": {
+                    "password_provided": bool(data.get("password")),
+                    "stored_password_available": stored_password_available,
+                    "password_type": type(data.get("password")).__name__ if data.get("password") else "None",
+                    "all_params": list(data.keys()) if data else "No data received",
+                    "request_method": request.method,
+                    "content_type": request.content_type,
+                    "server_id": server_id,
+                    "server_name": server.name or server.hostname,
+                    "has_encrypted_password": bool(server.encrypted_password)
+                },
+                "solution": "Stored password exists but decryption failed. Please test connection again to update credentials." if stored_password_available 
+                    else "Include 'password' parameter in request, or test connection during server registration to save credentials"
+            }
+        }), 400
+    
+    try:
+        metrics = executor.collect_metrics()
+        # Update server status and last_seen on successful connection
+        server.status = "online"
+        from datetime import datetime
+        server.last_seen = datetime.utcnow()
+        sample = sample_from_metrics(metrics)
         try:
-            metrics = windows_metrics(server.ip, server.username, password, port)
-            # Update server status and last_seen on successful connection
-            server.status = "online"
-            from datetime import datetime
-            server.last_seen = datetime.utcnow()
-            db.session.commit()
-            return jsonify(metrics)
-        except Exception as exc:  # noqa: WPS429
-            # Update server status to offline on connection failure
-            server.status = "offline"
-            db.session.commit()
-            return jsonify({"error": str(exc)}), 500
-    else:
-        return jsonify({"error": "Unsupported os_type"}), 400
+            metrics_store.add(server_id, [sample], source="pull")
+        except WriteBufferFull as exc:
+            # Storage is behind; still answer with the fresh numbers
+            print(f"Not storing metrics for server {server_id}: {exc}")
+        alert_engine.observe_samples(server, [sample])
+        daily_reports.observe(server, sample["timestamp"])
+        db.session.commit()
+        return cached_response(metrics_cache.put(cache_key, metrics, METRICS_TTL), hit=False)
+    except HostBusyError as exc:
+        # The host is busy, not down - leave its status alone
+        return _remote_error_response(exc)
+    except (CircuitOpenError, RemoteTimeout) as exc:
+        server.status = "offline"
+        db.session.commit()
+        return _remote_error_response(exc)
+    except Exception as exc:  # noqa: WPS429
+        # Update server status to offline on connection failure
+        server.status = "offline"
+        db.session.commit()
+        return jsonify({"error": str(exc)}), 500
 
 
 @server_bp.route("/servers/<int:server_id>/users", methods=["GET"])  # list users on remote host
@@ -539,41 +541,14 @@ def list_remote_users(server_id: int):
         })
 
     # Real users (original code)
-    if server.os_type == "linux":
-        try:
-            password, key_path, port = _get_linux_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            out = linux_list_users(server.ip, server.username, key_path, password, port)
-            users = [u for u in out.splitlines() if u.strip()]
-            return jsonify({"users": users})
-        except Exception as exc:  # noqa: WPS429
-            return jsonify({"error": str(exc)}), 500
-    elif server.os_type == "windows":
-        try:
-            password, port = _get_windows_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            out = windows_list_users(server.ip, server.username, password, port)
-            # Try to parse JSON first, fallback to text parsing
-            try:
-                import json
-                users_data = json.loads(out)
-                if isinstance(users_data, list):
-                    users = [u.get("Name", "") for u in users_data if u.get("Name")]
-                else:
-                    users = [users_data.get("Name", "")] if users_data.get("Name") else []
-            except:
-                users = [u.strip() for u in out.splitlines()[1:] if u.strip()]
-            return jsonify({"users": users})
-        except Exception as exc:  # noqa: WPS429
-            return jsonify({"error": str(exc)}), 500
-    else:
-        return jsonify({"error": "Unsupported os_type"}), 400
+    executor, error = _get_executor(server, data)
+    if error:
+        return error
+    
+    try:
+        return jsonify({"users": executor.list_users()})
+    except Exception as exc:  # noqa: WPS429
+        return jsonify({"error": str(exc)}), 500
 
 
 @server_bp.route("/servers/<int:server_id>/users", methods=["POST"])  # add user on remote host
@@ -593,30 +568,18 @@ def add_remote_user(server_id: int):
     if not newuser or not newpass:
         return jsonify({"error": "newuser and newpass required"}), 400
 
-    if server.os_type == "linux":
-        try:
-            password, key_path, port = _get_linux_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            linux_create_user(server.ip, server.username, newuser, newpass, key_path, password, port)
-            return jsonify({"status": "created"}), 201
-        except Exception as exc:  # noqa: WPS429
-            return jsonify({"error": str(exc)}), 500
-    elif server.os_type == "windows":
-        try:
-            password, port = _get_windows_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            out = create_windows_user(server.ip, server.username, password, newuser, newpass, port)
-            return jsonify({"status": "created", "output": out}), 201
-        except Exception as exc:  # noqa: WPS429
-            return jsonify({"error": str(exc)}), 500
-    else:
-        return jsonify({"error": "Unsupported os_type"}), 400
+    executor, error = _get_executor(server, data)
+    if error:
+        return error
+    
+    try:
+        out = executor.create_user(newuser, newpass)
+        response_data = {"status": "created"}
+        if out:
+            response_data["output"] = out
+        return jsonify(response_data), 201
+    except Exception as exc:  # noqa: WPS429
+        return jsonify({"error": str(exc)}), 500
 
 
 @server_bp.route("/servers/<int:server_id>/users/<username>", methods=["DELETE"])  # delete user
@@ -634,30 +597,15 @@ def delete_remote_user(server_id: int, username: str):
     if server.is_demo:
         return jsonify({"error": "Demo server not accessible in live mode"}), 403
     data = request.get_json(silent=True) or {}
-    if server.os_type == "linux":
-        try:
-            password, key_path, port = _get_linux_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            linux_delete_user(server.ip, server.username, username, key_path, password, port)
-            return jsonify({"status": "deleted"})
-        except Exception as exc:  # noqa: WPS429
-            return jsonify({"error": str(exc)}), 500
-    elif server.os_type == "windows":
-        try:
-            password, port = _get_windows_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            windows_delete_user(server.ip, server.username, password, username, port)
-            return jsonify({"status": "deleted"})
-        except Exception as exc:  # noqa: WPS429
-            return jsonify({"error": str(exc)}), 500
-    else:
-        return jsonify({"error": "Unsupported os_type"}), 400
+    executor, error = _get_executor(server, data)
+    if error:
+        return error
+    
+    try:
+        executor.delete_user(username)
+        return jsonify({"status": "deleted"})
+    except Exception as exc:  # noqa: WPS429
+        return jsonify({"error": str(exc)}), 500
 
 
 @server_bp.route("/test-connection", methods=["POST"])
@@ -673,30 +621,27 @@ def test_connection_direct():
     os_type = data["os_type"].lower()
     username = data["username"]
     
+    key_path = data.get("key_path")
+    password = data.get("password")
+    
     try:
-        if os_type == "windows":
-            password = data.get("password")
-            if not password:
-                return jsonify({"success": False, "message": "Password is required for Windows servers"}), 400
-            
-            port = int(data.get("winrm_port", 5985))
-            from ..handlers.windows_handler import test_connection
-            success, message = test_connection(ip, username, password, port)
-            return jsonify({"success": success, "message": message}), 200 if success else 500
-            
-        elif os_type == "linux":
-            key_path = data.get("key_path")
-            password = data.get("password")
-            port = int(data.get("port", 22))
-            
-            if not key_path and not password:
-                return jsonify({"success": False, "message": "key_path or password required for linux"}), 400
-            
-            from ..handlers.linux_handler import test_connection
-            success, message = test_connection(ip, username, key_path, password, port)
-            return jsonify({"success": success, "message": message}), 200 if success else 500
-        else:
-            return jsonify({"success": False, "message": "Unsupported os_type"}), 400
+        executor_class = get_executor_class(os_type)
+    except UnsupportedOSType as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    
+    if os_type == "windows":
+        if not password:
+            return jsonify({"success": False, "message": "Password is required for Windows servers"}), 400
+        port = int(data.get("winrm_port", 5985))
+    else:
+        if not key_path and not password and data.get("auth_type") != "agent":
+            return jsonify({"success": False, "message": "key_path or password required for linux"}), 400
+        port = int(data.get("port", 22))
+    
+    try:
+        executor = executor_class(ip, username, port, password=password, key_path=key_path, key_passphrase=data.get("key_passphrase"))
+        success, message = executor.connect()
+        return jsonify({"success": success, "message": message}), 200 if success else 500
     except Exception as e:
         return jsonify({"success": False, "message": f"Connection test failed: {str(e)}"}), 500
 
@@ -716,71 +661,32 @@ def test_server_connection(server_id: int):
         return jsonify({"error": "Demo server not accessible in live mode"}), 403
     data = request.get_json(silent=True) or {}
     
-    if server.os_type == "linux":
-        try:
-            password, key_path, port = _get_linux_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
+    executor, error = _get_executor(server, data)
+    if error:
+        return error
+    
+    try:
+        success, message = executor.connect()
         
-        try:
-            success, message = linux_test_connection(server.ip, server.username, key_path, password, port)
-            
-            # Update server status based on connection test result
-            from datetime import datetime
-            if success:
-                server.status = "online"
-                server.last_seen = datetime.utcnow()
-            else:
-                server.status = "offline"
-            
-            db.session.commit()
-            
-            return jsonify({
-                "success": success,
-                "message": message,
-                "status": server.status
-            }), 200 if success else 500
-        except Exception as exc:
+        # Update server status based on connection test result
+        from datetime import datetime
+        if success:
+            server.status = "online"
+            server.last_seen = datetime.utcnow()
+        else:
             server.status = "offline"
-            db.session.commit()
-            return jsonify({"success": False, "error": str(exc)}), 500
-    elif server.os_type == "windows":
-        # Try to get password from request, fallback to stored password
-        password = data.get("password")
-        if not password or (isinstance(password, str) and password.strip() == ""):
-            stored_password = server.get_password()
-            if stored_password:
-                password = stored_password
-            else:
-                return jsonify({"error": "password required for windows"}), 400
         
-        # Get port (default to stored winrm_port, then request param, then 5985)
-        port = int(data.get("port") or server.winrm_port or 5985)
+        db.session.commit()
         
-        try:
-            success, message = windows_test_connection(server.ip, server.username, password, port)
-            
-            # Update server status based on connection test result
-            from datetime import datetime
-            if success:
-                server.status = "online"
-                server.last_seen = datetime.utcnow()
-            else:
-                server.status = "offline"
-            
-            db.session.commit()
-            
-            return jsonify({
-                "success": success,
-                "message": message,
-                "status": server.status
-            }), 200 if success else 500
-        except Exception as exc:
-            server.status = "offline"
-            db.session.commit()
-            return jsonify({"success": False, "error": str(exc)}), 500
-    else:
-        return jsonify({"error": "Unsupported os_type"}), 400
+        return jsonify({
+            "success": success,
+            "message": message,
+            "status": server.status
+        }), 200 if success else 500
+    except Exception as exc:
+        server.status = "offline"
+        db.session.commit()
+        return jsonify({"success": False, "error": str(exc)}), 500
 
 
 @server_bp.route("/servers/<int:server_id>/status", methods=["PATCH"])
@@ -816,6 +722,332 @@ def update_server_status(server_id: int):
     }), 200
 
 
+@server_bp.route("/servers/<int:server_id>/timeouts", methods=["PATCH"])
+def update_server_timeouts(server_id: int):
+    """Set a server's connect/auth/command timeouts (null resets one to the global default)"""
+    is_demo = _is_demo_mode()
+    
+    if is_demo:
+        return jsonify({"error": "Cannot update timeouts in demo mode"}), 400
+    
+    server = Server.query.get_or_404(server_id)
+    
+    if server.is_demo:
+        return jsonify({"error": "Demo server not accessible in live mode"}), 403
+    data = request.get_json(silent=True) or {}
+    
+    try:
+        for field in _TIMEOUT_FIELDS:
+            if field in data:
+                setattr(server, field, parse_timeout(data[field], field))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    db.session.commit()
+    
+    return jsonify({
+        "id": server.id,
+        **{field: getattr(server, field) for field in _TIMEOUT_FIELDS},
+        "effective": server_timeouts(server).to_dict(),
+    }), 200
+
+
+@server_bp.route("/servers/<int:server_id>/tags", methods=["PUT"])
+def update_server_tags(server_id: int):
+    """Replace a server's tags, given as a list or a comma-separated string"""
+    is_demo = _is_demo_mode()
+    
+    if is_demo:
+        return jsonify({"error": "Cannot update tags in demo mode"}), 400
+    
+    server = Server.query.get_or_404(server_id)
+    
+    if server.is_demo:
+        return jsonify({"error": "Demo server not accessible in live mode"}), 403
+    data = request.get_json(silent=True) or {}
+    
+    tags = data.get("tags")
+    if not isinstance(tags, (list, str)) or (isinstance(tags, list) and not all(isinstance(t, str) for t in tags)):
+        return jsonify({"error": "tags must be a list of strings or a comma-separated string"}), 400
+    server.set_tags(tags)
+    db.session.commit()
+    
+    return jsonify({"id": server.id, "tags": server.tag_list()}), 200
+
+
+@server_bp.route("/servers/<int:server_id>/ingest-token", methods=["POST"])  # admin-only
+def issue_ingest_token(server_id: int):
+    """Issue (or rotate) the token a push agent uses for /api/ingest - shown only once"""
+    if not _require_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    
+    if _is_demo_mode():
+        return jsonify({"error": "Cannot issue ingest tokens in demo mode"}), 403
+    
+    server = Server.query.get_or_404(server_id)
+    
+    if server.is_demo:
+        return jsonify({"error": "Demo server not accessible in live mode"}), 403
+    
+    token = issue_token(server)
+    db.session.commit()
+    
+    return jsonify({"server_id": server.id, "token": token, "ingest_url": "/api/ingest"}), 201
+
+
+@server_bp.route("/servers/<int:server_id>/ingest-token", methods=["DELETE"])  # admin-only
+def revoke_ingest_token(server_id: int):
+    """Revoke a server's ingest token"""
+    if not _require_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    
+    if _is_demo_mode():
+        return jsonify({"error": "Cannot revoke ingest tokens in demo mode"}), 403
+    
+    server = Server.query.get_or_404(server_id)
+    server.ingest_token_hash = None
+    db.session.commit()
+    
+    return jsonify({"server_id": server.id, "revoked": True}), 200
+
+
+@server_bp.route("/servers/<int:server_id>/metrics/history", methods=["GET"])
+def metrics_history(server_id: int):
+    """Stored metrics samples (pulled and pushed) for a server, oldest first
+    
+    Query params: since / until (unix seconds), limit (newest N, default 500)
+    and fields (comma-separated, default all). With resolution (seconds) the
+    response holds rolled-up points instead - count/avg/min/max and the
+    quantiles given as e.g. quantiles=50,95,99 per field - read from the
+    rollup sketches rather than raw samples.
+    """
+    if _is_demo_mode():
+        return jsonify({"server_id": server_id, "samples": []})
+    
+    server = Server.query.get_or_404(server_id)
+    
+    if server.is_demo:
+        return jsonify({"error": "Demo server not accessible in live mode"}), 403
+    
+    try:
+        since = float(request.args["since"]) if request.args.get("since") else None
+        until = float(request.args["until"]) if request.args.get("until") else None
+        limit = int(request.args.get("limit", 500))
+    except ValueError:
+        return jsonify({"error": "since/until must be unix timestamps and limit an integer"}), 400
+    if not all(math.isfinite(t) for t in (since, until) if t is not None):
+        return jsonify({"error": "since/until must be finite unix timestamps"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+    
+    fields = None
+    if request.args.get("fields"):
+        fields = [f.strip() for f in request.args["fields"].split(",") if f.strip()]
+        unknown = [f for f in fields if f not in FIELDS]
+        if unknown:
+            return jsonify({"error": "Unknown fields", "unknown_fields": unknown, "fields": list(FIELDS)}), 400
+    
+    if request.args.get("resolution"):
+        try:
+            resolution = float(request.args["resolution"])
+            quantiles = [float(q) / 100 for q in request.args.get("quantiles", "50,95,99").split(",") if q.strip()]
+        except ValueError:
+            return jsonify({"error": "resolution must be a number of seconds and quantiles numbers like 50,95,99"}), 400
+        if not math.isfinite(resolution) or resolution <= 0 or not all(0 <= q <= 1 for q in quantiles):
+            return jsonify({"error": "resolution must be positive and quantiles between 0 and 100"}), 400
+        rollup = metrics_store.rollup_history(server.id, resolution, since=since, until=until, fields=fields, quantiles=quantiles)
+        return jsonify({"server_id": server.id, **rollup})
+    
+    return jsonify({
+        "server_id": server.id,
+        "samples": metrics_store.history(server.id, since=since, until=until, fields=fields, limit=limit),
+    })
+
+
+@server_bp.route("/servers/export", methods=["GET"])
+def export_metrics():
+    """Stream stored metrics history of many servers as CSV or Parquet
+    
+    Query params: server_ids (comma-separated, default every server), tag,
+    since / until (unix seconds), fields, format (csv or parquet - needs
+    pyarrow) and resolution / quantiles for rolled-up rows as in
+    /servers/<id>/metrics/history. Rows are written as they are read, see
+    metrics/export.py.
+    """
+    export_format = request.args.get("format", "csv").lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    if export_format == "parquet" and not parquet_available():
+        return jsonify({"error": "Parquet export needs pyarrow on the backend (pip install pyarrow)"}), 501
+    
+    try:
+        since = float(request.args["since"]) if request.args.get("since") else None
+        until = float(request.args["until"]) if request.args.get("until") else None
+        server_ids = [int(i) for i in request.args.get("server_ids", "").split(",") if i.strip()]
+        resolution = float(request.args["resolution"]) if request.args.get("resolution") else None
+        quantiles = [float(q) / 100 for q in request.args.get("quantiles", "50,95,99").split(",") if q.strip()]
+    except ValueError:
+        return jsonify({"error": "since/until must be unix timestamps, server_ids integers, resolution seconds and quantiles numbers"}), 400
+    if not all(math.isfinite(t) for t in (since, until) if t is not None):
+        return jsonify({"error": "since/until must be finite unix timestamps"}), 400
+    if (resolution is not None and not (math.isfinite(resolution) and resolution > 0)) or not all(0 <= q <= 1 for q in quantiles):
+        return jsonify({"error": "resolution must be positive and quantiles between 0 and 100"}), 400
+    
+    fields = None
+    if request.args.get("fields"):
+        fields = [f.strip() for f in request.args["fields"].split(",") if f.strip()]
+        unknown = [f for f in fields if f not in FIELDS]
+        if unknown:
+            return jsonify({"error": "Unknown fields", "unknown_fields": unknown, "fields": list(FIELDS)}), 400
+    
+    servers = []
+    # Demo servers have no stored history
+    if not _is_demo_mode():
+        query = Server.query.filter_by(is_demo=False)
+        if server_ids:
+            query = query.filter(Server.id.in_(server_ids))
+        tag = request.args.get("tag")
+        servers = [
+            {"id": s.id, "name": s.name or s.hostname}
+            for s in query.order_by(Server.id).all()
+            if not tag or tag in s.tag_list()
+        ]
+    
+    export = ExportQuery(servers, since=since, until=until, fields=fields, resolution=resolution, quantiles=quantiles)
+    if export_format == "parquet":
+        body, mimetype = export_parquet(metrics_store, export), "application/vnd.apache.parquet"
+    else:
+        body, mimetype = export_csv(metrics_store, export), "text/csv"
+    return Response(body, mimetype=mimetype, headers={
+        "Content-Disposition": f"attachment; filename=metrics-{int(time.time())}.{export_format}",
+    })
+
+
+# Fleet summaries skip servers whose newest sample is older than this (seconds)
+_FLEET_MAX_AGE = 600
+
+
+def _fleet_query():
+    """Frame and metric for the fleet aggregation routes. Returns (frame, metric, None) or (None, None, error response)"""
+    metric = request.args.get("metric", "cpu_percent")
+    if metric not in FIELDS:
+        return None, None, (jsonify({"error": f"Unknown metric {metric}", "fields": list(FIELDS)}), 400)
+    try:
+        max_age = float(request.args.get("max_age", _FLEET_MAX_AGE))
+    except ValueError:
+        return None, None, (jsonify({"error": "max_age must be a number of seconds"}), 400)
+    
+    if _is_demo_mode():
+        # Demo servers have no stored samples; summarise freshly generated demo metrics instead
+        servers, samples = [], []
+        now = time.time()
+        for demo in get_demo_servers():
+            if demo["status"] == "offline":
+                continue  # like a live server with no recent sample
+            metrics = generate_demo_metrics(demo)
+            servers.append({"id": demo["id"], "name": demo["name"], "os_type": demo["os_type"], "status": demo["status"], "tags": [demo["location"]] if demo.get("location") else []})
+            samples.append({
+                "timestamp": now,
+                "cpu_percent": metrics["cpu"]["usage"],
+                "cpu_cores": len(metrics["cpu"]["cores"]) or None,
+                "mem_total_gb": metrics["memory"]["total"] / 1024,
+                "mem_used_gb": metrics["memory"]["used"] / 1024,
+                "mem_percent": metrics["memory"]["percent"],
+                "disk_total_gb": metrics["disk"]["total"] / 1024,
+                "disk_used_gb": metrics["disk"]["used"] / 1024,
+                "disk_percent": metrics["disk"]["percent"],
+                "net_bytes_sent": metrics["network"]["bytes_sent"],
+                "net_bytes_recv": metrics["network"]["bytes_recv"],
+            })
+        return frame_from_samples(servers, samples), metric, None
+    
+    servers = [
+        {"id": s.id, "name": s.name or s.hostname, "os_type": s.os_type, "status": s.status, "tags": s.tag_list()}
+        for s in Server.query.filter_by(is_demo=False).all()
+    ]
+    return fleet_frame(servers, metrics_store, max_age=max_age), metric, None
+
+
+@server_bp.route("/servers/aggregate", methods=["GET"])
+def fleet_aggregate():
+    """Summarise one metric over the fleet's latest samples, without probing any host
+    
+    Query params: metric (default cpu_percent), group_by (os_type, status or tag),
+    reduce (comma-separated: count, avg, min, max, sum, p50, p95, ...) and
+    max_age (seconds, default 600).
+    """
+    frame, metric, error = _fleet_query()
+    if error:
+        return error
+    
+    group_by = request.args.get("group_by") or None
+    if group_by is not None and group_by not in GROUP_BY:
+        return jsonify({"error": f"group_by must be one of: {', '.join(GROUP_BY)}"}), 400
+    try:
+        reductions = parse_reductions(request.args.get("reduce"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify({
+        "metric": metric,
+        "group_by": group_by,
+        "servers": len(frame.servers),
+        "groups": aggregate(frame, metric, group_by, reductions),
+    })
+
+
+@server_bp.route("/servers/top", methods=["GET"])
+def fleet_top():
+    """Top servers by one metric from their latest samples
+    
+    Query params: metric (default cpu_percent), k (default 10), order (desc or asc)
+    and max_age (seconds, default 600).
+    """
+    frame, metric, error = _fleet_query()
+    if error:
+        return error
+    
+    try:
+        k = int(request.args.get("k", 10))
+    except ValueError:
+        return jsonify({"error": "k must be an integer"}), 400
+    order = request.args.get("order", "desc").lower()
+    if k < 1 or order not in ("asc", "desc"):
+        return jsonify({"error": "k must be positive and order asc or desc"}), 400
+    
+    return jsonify({
+        "metric": metric,
+        "order": order,
+        "servers": top_k(frame, metric, k, ascending=order == "asc"),
+    })
+
+
+@server_bp.route("/servers/<int:server_id>/anomalies", methods=["GET"])
+def server_anomalies(server_id: int):
+    """Per-metric baselines (EWMA mean/stddev, p50/p95/p99), latest z-scores and recent anomalies for a server"""
+    if _is_demo_mode():
+        return jsonify({"server_id": server_id, "metrics": {}, "recent": []})
+    
+    server = Server.query.get_or_404(server_id)
+    
+    if server.is_demo:
+        return jsonify({"error": "Demo server not accessible in live mode"}), 403
+    
+    return jsonify({"server_id": server.id, **anomaly_detector.server_report(server.id)})
+
+
+@server_bp.route("/servers/anomalies", methods=["GET"])
+def fleet_anomalies():
+    """Server metrics whose latest sample is anomalous"""
+    if _is_demo_mode():
+        return jsonify({"z_threshold": anomaly_detector.z_threshold, "anomalies": []})
+    
+    return jsonify({
+        "z_threshold": anomaly_detector.z_threshold,
+        "anomalies": sorted(anomaly_detector.current(), key=lambda a: abs(a["zscore"]), reverse=True),
+    })
+
+
 @server_bp.route("/servers/<int:server_id>/detailed-metrics", methods=["GET"])
 def get_detailed_metrics(server_id: int):
     """Get detailed metrics including top processes, network interfaces, disk partitions, and system info"""
@@ -854,38 +1086,32 @@ def get_detailed_metrics(server_id: int):
     if server.is_demo:
         return jsonify({"error": "Demo server not accessible in live mode"}), 403
     
-    if server.os_type == "linux":
-        data = request.get_json(silent=True) or {}
-        if not data:
-            data = request.args.to_dict()
-        
-        try:
-            password, key_path, port = _get_linux_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            detailed_metrics = linux_detailed_metrics(server.ip, server.username, key_path, password, port)
-            return jsonify(detailed_metrics)
-        except Exception as exc:
-            return jsonify({"error": str(exc)}), 500
-    elif server.os_type == "windows":
-        data = request.get_json(silent=True) or {}
-        if not data:
-            data = request.args.to_dict()
-        
-        try:
-            password, port = _get_windows_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            detailed_metrics = windows_detailed_metrics(server.ip, server.username, password, port)
-            return jsonify(detailed_metrics)
-        except Exception as exc:
-            return jsonify({"error": str(exc)}), 500
-    else:
-        return jsonify({"error": "Unsupported os_type"}), 400
+    data = request.get_json(silent=True) or {}
+    if not data:
+        data = request.args.to_dict()
+    
+    # Processes, partitions and system info change slowly - reuse a recent result
+    cache_key = (server_id, "detailed-metrics")
+    entry = None if wants_fresh() else metrics_cache.get(cache_key)
+    if entry is not None:
+        return cached_response(entry, hit=True)
+    
+    executor, error = _get_executor(server, data)
+    if error:
+        return error
+    
+    try:
+        metrics = executor.detailed_metrics(include_system_info=False)
+        # OS/kernel/hostname come from the stored inventory (one boot-time check instead of a full re-read)
+        metrics["system_info"] = get_system_info(server, executor)
+        db.session.commit()
+        # The collectors answer [] when they fail - don't keep that for the whole TTL
+        complete = all(metrics.get(name) for name in ("top_processes", "network_interfaces", "disk_partitions"))
+        return cached_response(metrics_cache.put(cache_key, metrics, DETAILED_METRICS_TTL if complete else 0), hit=False)
+    except (HostBusyError, CircuitOpenError, RemoteTimeout) as exc:
+        return _remote_error_response(exc)
+    except Exception as exc:
+        return jsonify({"error": str(exc)}), 500
 
 
 @server_bp.route("/servers/<int:server_id>/execute-command", methods=["POST"])
@@ -907,39 +1133,29 @@ def execute_server_command(server_id: int):
     if not command:
         return jsonify({"error": "command is required"}), 400
     
-    if server.os_type == "linux":
-        try:
-            password, key_path, port = _get_linux_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            result = linux_execute_command(server.ip, server.username, command, key_path, password, port)
-            return jsonify(result)
-        except Exception as exc:
-            return jsonify({"error": str(exc)}), 500
-    elif server.os_type == "windows":
-        try:
-            password, port = _get_windows_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            result = windows_execute_command(server.ip, server.username, password, command, port)
-            return jsonify(result)
-        except Exception as exc:
-            return jsonify({"error": str(exc)}), 500
-    else:
-        return jsonify({"error": "Unsupported os_type"}), 400
+    executor, error = _get_executor(server, data)
+    if error:
+        return error
+    
+    try:
+        return jsonify(executor.run(command))
+    except (HostBusyError, CircuitOpenError, RemoteTimeout) as exc:
+        return _remote_error_response(exc)
+    except Exception as exc:
+        return jsonify({"error": str(exc)}), 500
 
 
-@server_bp.route("/servers/<int:server_id>/quick-actions/restart-service", methods=["POST"])
-def restart_server_service(server_id: int):
-    """Restart a service on the server (systemd for Linux, Windows Service for Windows)"""
+# Upper bound on commands accepted by one execute-batch request
+MAX_BATCH_COMMANDS = 50
+
+
+@server_bp.route("/servers/<int:server_id>/execute-batch", methods=["POST"])
+def execute_server_command_batch(server_id: int):
+    """Execute an ordered list of commands over a single SSH/WinRM session"""
     is_demo = _is_demo_mode()
     
     if is_demo:
-        return jsonify({"error": "Service restart not available in demo mode"}), 403
+        return jsonify({"error": "Command execution not available in demo mode"}), 403
     
     server = Server.query.get_or_404(server_id)
     
@@ -947,44 +1163,51 @@ def restart_server_service(server_id: int):
         return jsonify({"error": "Demo server not accessible in live mode"}), 403
     
     data = request.get_json(force=True)
-    service_name = data.get("service_name")
+    commands = data.get("commands")
     
-    if not service_name:
-        return jsonify({"error": "service_name is required"}), 400
+    if not isinstance(commands, list) or not commands or not all(isinstance(c, str) and c.strip() for c in commands):
+        return jsonify({"error": "commands must be a non-empty list of command strings"}), 400
+    if len(commands) > MAX_BATCH_COMMANDS:
+        return jsonify({"error": f"At most {MAX_BATCH_COMMANDS} commands per batch"}), 400
     
-    if server.os_type == "linux":
-        try:
-            password, key_path, port = _get_linux_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            result = linux_restart_service(server.ip, server.username, service_name, key_path, password, port)
-            return jsonify(result)
-        except Exception as exc:
-            return jsonify({"error": str(exc)}), 500
-    elif server.os_type == "windows":
-        try:
-            password, port = _get_windows_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            result = windows_restart_service(server.ip, server.username, password, service_name, port)
-            return jsonify(result)
-        except Exception as exc:
-            return jsonify({"error": str(exc)}), 500
-    else:
-        return jsonify({"error": "Unsupported os_type"}), 400
+    executor, error = _get_executor(server, data)
+    if error:
+        return error
+    
+    started = time.monotonic()
+    try:
+        results = executor.run_batch(commands, concurrent=bool(data.get("concurrent")))
+    except (HostBusyError, CircuitOpenError, RemoteTimeout) as exc:
+        return _remote_error_response(exc)
+    except Exception as exc:
+        return jsonify({"error": str(exc)}), 500
+    
+    return jsonify({
+        "results": results,
+        "success": all(r["success"] for r in results),
+        "total_duration_ms": round((time.monotonic() - started) * 1000, 1),
+    })
 
 
-@server_bp.route("/servers/<int:server_id>/quick-actions/start-service", methods=["POST"])
-def start_server_service(server_id: int):
-    """Start a service on the server (systemd for Linux, Windows Service for Windows)"""
+# Hard cap on output streamed from one command (requests may ask for less)
+STREAM_MAX_BYTES = int(os.getenv("STREAM_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# stream_id -> (server_id, threading.Event), the event is set to cancel a running execute-stream command
+_active_streams: dict = {}
+
+
+@server_bp.route("/servers/<int:server_id>/execute-stream", methods=["POST"])
+def execute_server_command_stream(server_id: int):
+    """Execute a command and stream stdout/stderr chunks as they are produced
+    
+    Body: {"command": "...", "max_bytes": 1048576, "format": "ndjson" | "sse"}.
+    Events are JSON objects of type "start" (with the stream_id used for
+    cancellation), "stdout", "stderr" and a final "exit".
+    """
     is_demo = _is_demo_mode()
     
     if is_demo:
-        return jsonify({"error": "Service start not available in demo mode"}), 403
+        return jsonify({"error": "Command execution not available in demo mode"}), 403
     
     server = Server.query.get_or_404(server_id)
     
@@ -992,44 +1215,185 @@ def start_server_service(server_id: int):
         return jsonify({"error": "Demo server not accessible in live mode"}), 403
     
     data = request.get_json(force=True)
-    service_name = data.get("service_name")
+    command = data.get("command")
     
-    if not service_name:
-        return jsonify({"error": "service_name is required"}), 400
+    if not command:
+        return jsonify({"error": "command is required"}), 400
     
-    if server.os_type == "linux":
-        try:
-            password, key_path, port = _get_linux_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
+    max_bytes = data.get("max_bytes")
+    if max_bytes is None:
+        max_bytes = STREAM_MAX_BYTES
+    if isinstance(max_bytes, bool) or not isinstance(max_bytes, int) or max_bytes < 1:
+        return jsonify({"error": "max_bytes must be a positive integer"}), 400
+    max_bytes = min(max_bytes, STREAM_MAX_BYTES)
+    
+    executor, error = _get_executor(server, data)
+    if error:
+        return error
+    
+    use_sse = data.get("format") == "sse" or "text/event-stream" in request.headers.get("Accept", "")
+    stream_id = uuid.uuid4().hex
+    cancel_event = threading.Event()
+    _active_streams[stream_id] = (server_id, cancel_event)
+    
+    def encode(event: dict) -> str:
+        if use_sse:
+            return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        return json.dumps(event) + "\n"
+    
+    def generate():
+        # Incremental decoders so multi-byte characters split across chunks survive
+        decoders = {
+            "stdout": codecs.getincrementaldecoder("utf-8")(errors="replace"),
+            "stderr": codecs.getincrementaldecoder("utf-8")(errors="replace"),
+        }
         try:
-            result = linux_start_service(server.ip, server.username, service_name, key_path, password, port)
-            return jsonify(result)
+            yield encode({"type": "start", "stream_id": stream_id, "server_id": server_id, "max_bytes": max_bytes, "timeout": executor.timeouts.command})
+            for kind, payload in executor.run_stream(command, max_bytes=max_bytes, cancel_event=cancel_event):
+                if kind == "exit":
+                    yield encode({"type": "exit", **payload})
+                else:
+                    text = decoders[kind].decode(payload)
+                    if text:
+                        yield encode({"type": kind, "data": text})
         except Exception as exc:
-            return jsonify({"error": str(exc)}), 500
-    elif server.os_type == "windows":
+            yield encode({"type": "error", "error": str(exc)})
+        finally:
+            _active_streams.pop(stream_id, None)
+    
+    mimetype = "text/event-stream" if use_sse else "application/x-ndjson"
+    return Response(generate(), mimetype=mimetype, headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+        "X-Stream-Id": stream_id,
+    })
+
+
+@server_bp.route("/servers/<int:server_id>/execute-stream/<stream_id>/cancel", methods=["POST"])
+def cancel_server_command_stream(server_id: int, stream_id: str):
+    """Cancel a running execute-stream command"""
+    stream = _active_streams.get(stream_id)
+    # Another server's stream id is answered like an unknown one
+    if stream is None or stream[0] != server_id:
+        return jsonify({"error": "Stream not found or already finished"}), 404
+    stream[1].set()
+    return jsonify({"stream_id": stream_id, "status": "cancelling"})
+
+
+@server_bp.route("/servers/execute-fleet", methods=["POST"])
+def execute_fleet_command():
+    """Run one command on many servers, streaming each host's result as it finishes
+    
+    Body: {"server_ids": [...], "command": "...", "concurrency": 20, "timeout": 30,
+    "format": "ndjson" | "sse"}. Every line/event is a JSON object of type
+    "result"; the last one is a "summary" with exit code counts.
+    """
+    is_demo = _is_demo_mode()
+    
+    if is_demo:
+        return jsonify({"error": "Command execution not available in demo mode"}), 403
+    
+    data = request.get_json(force=True)
+    command = data.get("command")
+    server_ids = data.get("server_ids")
+    
+    if not command:
+        return jsonify({"error": "command is required"}), 400
+    if not isinstance(server_ids, list) or not server_ids:
+        return jsonify({"error": "server_ids must be a non-empty list"}), 400
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in server_ids):
+        return jsonify({"error": "server_ids must be integers"}), 400
+    # Each server runs the command once, and the summary counts it once
+    server_ids = list(dict.fromkeys(server_ids))
+    if len(server_ids) > MAX_SERVERS:
+        return jsonify({"error": f"At most {MAX_SERVERS} servers per request"}), 400
+    
+    try:
+        concurrency = int(data.get("concurrency") or DEFAULT_CONCURRENCY)
+        timeout = min(float(data.get("timeout") or DEFAULT_HOST_TIMEOUT), MAX_HOST_TIMEOUT)
+    except (ValueError, TypeError):
+        return jsonify({"error": "concurrency and timeout must be numbers"}), 400
+    
+    use_sse = data.get("format") == "sse" or "text/event-stream" in request.headers.get("Accept", "")
+    
+    # Resolve servers and credentials now, while the request/DB context is available;
+    # the stream itself only touches the executors
+    servers = Server.query.filter(Server.id.in_(server_ids), Server.is_demo.is_(False)).all()
+    found = {server.id: server for server in servers}
+    hostnames = {server.id: server.name or server.hostname for server in servers}
+    executors = {}
+    early_results = []
+    for server_id in server_ids:
+        server = found.get(server_id)
+        if server is None:
+            early_results.append({"type": "result", "server_id": server_id, "success": False, "exit_code": None, "error": "Server not found"})
+            continue
         try:
-            password, port = _get_windows_credentials(server, data)
+            # The per-host deadline doubles as the remote command timeout
+            executors[server_id] = get_executor(server, {**data, "timeout": timeout})
         except ValueError as e:
-            return jsonify({"error": str(e)}), 400
+            early_results.append({"type": "result", "server_id": server_id, "hostname": hostnames[server_id], "success": False, "exit_code": None, "error": str(e)})
+    
+    def encode(event: dict) -> str:
+        if use_sse:
+            return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        return json.dumps(event) + "\n"
+    
+    def generate():
+        started = time.monotonic()
+        exit_codes = {}
+        succeeded = failed = timed_out = 0
         
-        try:
-            result = windows_start_service(server.ip, server.username, password, service_name, port)
-            return jsonify(result)
-        except Exception as exc:
-            return jsonify({"error": str(exc)}), 500
-    else:
-        return jsonify({"error": "Unsupported os_type"}), 400
+        for event in early_results:
+            failed += 1
+            yield encode(event)
+        
+        for server_id, results, error, duration_ms in fan_out(
+            executors, lambda executor: executor.run_batch([command]), concurrency, timeout
+        ):
+            event = {"type": "result", "server_id": server_id, "hostname": hostnames[server_id], "duration_ms": duration_ms}
+            if error is not None:
+                event.update({"success": False, "exit_code": None, "error": str(error), "timed_out": isinstance(error, HostTimeout)})
+                if isinstance(error, HostTimeout):
+                    timed_out += 1
+                else:
+                    failed += 1
+            else:
+                result = results[0]
+                event.update({
+                    "success": result["success"],
+                    "exit_code": result["exit_code"],
+                    "stdout": result["stdout"],
+                    "stderr": result["stderr"],
+                })
+                exit_codes[str(result["exit_code"])] = exit_codes.get(str(result["exit_code"]), 0) + 1
+                if result["success"]:
+                    succeeded += 1
+                else:
+                    failed += 1
+            yield encode(event)
+        
+        yield encode({
+            "type": "summary",
+            "total": len(server_ids),
+            "succeeded": succeeded,
+            "failed": failed,
+            "timed_out": timed_out,
+            "exit_codes": exit_codes,
+            "duration_ms": round((time.monotonic() - started) * 1000, 1),
+        })
+    
+    mimetype = "text/event-stream" if use_sse else "application/x-ndjson"
+    # Disable proxy buffering so results reach the client as each host finishes
+    return Response(generate(), mimetype=mimetype, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
-@server_bp.route("/servers/<int:server_id>/quick-actions/stop-service", methods=["POST"])
-def stop_server_service(server_id: int):
-    """Stop a systemd service on the server"""
+def _run_service_action(server_id: int, action: str):
+    """Shared body of the start/stop/restart quick actions"""
     is_demo = _is_demo_mode()
     
     if is_demo:
-        return jsonify({"error": "Service stop not available in demo mode"}), 403
+        return jsonify({"error": f"Service {action} not available in demo mode"}), 403
     
     server = Server.query.get_or_404(server_id)
     
@@ -1042,30 +1406,37 @@ def stop_server_service(server_id: int):
     if not service_name:
         return jsonify({"error": "service_name is required"}), 400
     
-    if server.os_type == "linux":
-        try:
-            password, key_path, port = _get_linux_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            result = linux_stop_service(server.ip, server.username, service_name, key_path, password, port)
-            return jsonify(result)
-        except Exception as exc:
-            return jsonify({"error": str(exc)}), 500
-    elif server.os_type == "windows":
-        try:
-            password, port = _get_windows_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            result = windows_stop_service(server.ip, server.username, password, service_name, port)
-            return jsonify(result)
-        except Exception as exc:
-            return jsonify({"error": str(exc)}), 500
-    else:
-        return jsonify({"error": "Unsupported os_type"}), 400
+    if action not in SERVICE_ACTIONS:
+        return jsonify({"error": f"Unsupported service action: {action}"}), 400
+    
+    executor, error = _get_executor(server, data)
+    if error:
+        return error
+    
+    try:
+        return jsonify(executor.service_action(action, service_name))
+    except (HostBusyError, CircuitOpenError, RemoteTimeout) as exc:
+        return _remote_error_response(exc)
+    except Exception as exc:
+        return jsonify({"error": str(exc)}), 500
+
+
+@server_bp.route("/servers/<int:server_id>/quick-actions/restart-service", methods=["POST"])
+def restart_server_service(server_id: int):
+    """Restart a service on the server (systemd for Linux, Windows Service for Windows)"""
+    return _run_service_action(server_id, "restart")
+
+
+@server_bp.route("/servers/<int:server_id>/quick-actions/start-service", methods=["POST"])
+def start_server_service(server_id: int):
+    """Start a service on the server (systemd for Linux, Windows Service for Windows)"""
+    return _run_service_action(server_id, "start")
+
+
+@server_bp.route("/servers/<int:server_id>/quick-actions/stop-service", methods=["POST"])
+def stop_server_service(server_id: int):
+    """Stop a service on the server (systemd for Linux, Windows Service for Windows)"""
+    return _run_service_action(server_id, "stop")
 
 
 @server_bp.route("/servers/<int:server_id>/quick-actions/health-check", methods=["POST"])
@@ -1085,38 +1456,20 @@ def run_server_health_check(server_id: int):
     if server.is_demo:
         return jsonify({"error": "Demo server not accessible in live mode"}), 403
     
-    if server.os_type == "linux":
-        data = request.get_json(silent=True) or {}
-        if not data:
-            data = request.args.to_dict()
-        
-        try:
-            password, key_path, port = _get_linux_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            health_checks = linux_health_check(server.ip, server.username, key_path, password, port)
-            return jsonify(health_checks)
-        except Exception as exc:
-            return jsonify({"error": str(exc)}), 500
-    elif server.os_type == "windows":
-        data = request.get_json(silent=True) or {}
-        if not data:
-            data = request.args.to_dict()
-        
-        try:
-            password, port = _get_windows_credentials(server, data)
-        except ValueError as e:
-            return jsonify({"error": str(e)}), 400
-        
-        try:
-            health_checks = windows_health_check(server.ip, server.username, password, port)
-            return jsonify(health_checks)
-        except Exception as exc:
-            return jsonify({"error": str(exc)}), 500
-    else:
-        return jsonify({"error": "Unsupported os_type"}), 400
+    data = request.get_json(silent=True) or {}
+    if not data:
+        data = request.args.to_dict()
+    
+    executor, error = _get_executor(server, data)
+    if error:
+        return error
+    
+    try:
+        return jsonify(executor.health_check())
+    except (HostBusyError, CircuitOpenError, RemoteTimeout) as exc:
+        return _remote_error_response(exc)
+    except Exception as exc:
+        return jsonify({"error": str(exc)}), 500
 
 
 # VM control via VBoxManage
@@ -10,7 +10,7 @@ def create_app() -> Flask:
     load_dotenv()
     app = Flask(__name__)
     # CORS with explicit header support
-    CORS(app, expose_headers=['X-Data-Mode'], allow_headers=['X-Data-Mode', 'Content-Type', 'Authorization'])
+    CORS(app, expose_headers=['X-Data-Mode', 'X-Stream-Id', 'ETag', 'Age', 'X-Cache'], allow_headers=['X-Data-Mode', 'Content-Type', 'Authorization', 'If-None-Match'])
 
     database_url = os.getenv("SQLALCHEMY_DATABASE_URI", "sqlite:///portal.db")
     app.config["SQLALCHEMY_DATABASE_URI"] = database_url
@@ -22,10 +22,19 @@ def create_app() -> Flask:
         from .api.server_routes import server_bp  # noqa: WPS433
         from .api.user_routes import user_bp  # noqa: WPS433
         from .api.auth_routes import auth_bp  # noqa: WPS433
+        from .api.ingest_routes import ingest_bp  # noqa: WPS433
+        from .api.alert_routes import alert_bp  # noqa: WPS433
+        from .api.prometheus_routes import prometheus_bp  # noqa: WPS433
+        from .api.report_routes import report_bp  # noqa: WPS433
 
         app.register_blueprint(server_bp, url_prefix="/api")
         app.register_blueprint(user_bp, url_prefix="/api")
         app.register_blueprint(auth_bp, url_prefix="/api/auth")
+        app.register_blueprint(ingest_bp, url_prefix="/api")
+        app.register_blueprint(alert_bp, url_prefix="/api")
+        app.register_blueprint(report_bp, url_prefix="/api")
+        # Scraped by Prometheus at the conventional path
+        app.register_blueprint(prometheus_bp)
 
         db.create_all()
         
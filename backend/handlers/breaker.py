@@ -0,0 +1,125 @@
+"""
+Per-host circuit breaker.
+
+After BREAKER_FAILURE_THRESHOLD consecutive connection failures (default 3)
+a host's circuit opens and calls to it fail immediately with
+CircuitOpenError instead of waiting out another connect timeout. Once
+BREAKER_COOLDOWN seconds (default 30) have passed, one call is let through
+as a half-open probe: success closes the circuit, failure re-opens it for
+another cooldown.
+
+Only failures to reach the host count; authentication errors and failing
+commands prove the host is up and close the circuit.
+"""
+
+import os
+import threading
+import time
+
+
+FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of connecting to a host whose circuit is open"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _HostCircuit:
+    def __init__(self):
+        self.state = "closed"
+        self.failures = 0
+        self.retry_at = 0.0
+        self.opened_at = None
+        self.last_error = None
+        self.opens = 0
+
+
+class CircuitBreaker:
+    """Tracks reachability per host and fast-fails calls to hosts that are down"""
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, cooldown: float = COOLDOWN):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._hosts: dict = {}
+
+    def _circuit(self, host: str) -> _HostCircuit:
+        circuit = self._hosts.get(host)
+        if circuit is None:
+            circuit = self._hosts[host] = _HostCircuit()
+        return circuit
+
+    def before_call(self, host: str) -> None:
+        """Raise CircuitOpenError if host's circuit is open, otherwise allow the call
+
+        When the cooldown has elapsed the caller becomes the half-open probe;
+        other callers keep failing fast until the probe reports back (or, if
+        it never does, for one more cooldown).
+        """
+        with self._lock:
+            circuit = self._circuit(host)
+            if circuit.state == "closed":
+                return
+            now = time.monotonic()
+            if now < circuit.retry_at:
+                retry_after = circuit.retry_at - now
+                raise CircuitOpenError(
+                    f"{host} is unreachable ({circuit.failures} consecutive connection failures, "
+                    f"last: {circuit.last_error}); not retrying for {retry_after:.0f}s",
+                    retry_after,
+                )
+            circuit.state = "half_open"
+            circuit.retry_at = now + self.cooldown
+
+    def record_success(self, host: str) -> None:
+        """The host was reached - close its circuit"""
+        with self._lock:
+            circuit = self._circuit(host)
+            circuit.state = "closed"
+            circuit.failures = 0
+            circuit.opened_at = None
+
+    def record_failure(self, host: str, error) -> None:
+        """The host could not be reached - open its circuit once the threshold is hit"""
+        with self._lock:
+            circuit = self._circuit(host)
+            circuit.failures += 1
+            circuit.last_error = str(error).splitlines()[0] if str(error) else type(error).__name__
+            if circuit.state == "half_open" or circuit.failures >= self.failure_threshold:
+                if circuit.opened_at is None:
+                    circuit.opens += 1
+                    circuit.opened_at = time.time()
+                circuit.state = "open"
+                circuit.retry_at = time.monotonic() + self.cooldown
+
+    def state(self, host: str) -> dict:
+        """Breaker state for one host"""
+        with self._lock:
+            circuit = self._hosts.get(host)
+            if circuit is None:
+                return {"state": "closed", "failures": 0}
+            info = {"state": circuit.state, "failures": circuit.failures}
+            if circuit.state != "closed":
+                info["retry_in"] = round(max(0.0, circuit.retry_at - time.monotonic()), 1)
+                info["opened_at"] = circuit.opened_at
+                info["last_error"] = circuit.last_error
+            return info
+
+    def stats(self) -> dict:
+        """Breaker state and open counts for every host seen so far"""
+        with self._lock:
+            hosts = list(self._hosts)
+        stats = {}
+        for host in hosts:
+            stats[host] = self.state(host)
+            stats[host]["opens"] = self._hosts[host].opens
+        return stats
+
+
+# Shared by the SSH and WinRM handlers
+host_breaker = CircuitBreaker()
@@ -0,0 +1,122 @@
+"""
+Credential resolution cache.
+
+Decrypting a stored password and parsing a private key file are both
+repeated for every remote command of a poll. This module keeps decrypted
+secrets per server and parsed keys per (path, passphrase) in memory so the
+work is done once until the server record or the key file changes. A
+decrypted key is only served to callers that present the same passphrase.
+
+Key files of any type paramiko supports are accepted, optionally protected
+by a passphrase; servers without a password or key file authenticate with
+the keys held by the local ssh-agent.
+"""
+
+import hashlib
+import os
+import threading
+from typing import Optional
+
+import paramiko
+
+
+_lock = threading.Lock()
+# server_id -> (encrypted_password, decrypted_password)
+_password_cache: dict = {}
+# (key_path, passphrase digest) -> (mtime, PKey)
+_key_cache: dict = {}
+
+
+def get_server_password(server) -> str:
+    """Return the decrypted stored password for a server, decrypting it at most once"""
+    encrypted = server.encrypted_password
+    if not encrypted:
+        return ""
+
+    with _lock:
+        cached = _password_cache.get(server.id)
+    # The ciphertext is part of the key so a changed password is never served stale
+    if cached and cached[0] == encrypted:
+        return cached[1]
+
+    password = server.get_password()
+    if password and server.id is not None:
+        with _lock:
+            _password_cache[server.id] = (encrypted, password)
+    return password
+
+
+# Tried in order when detecting the type of a key file
+_KEY_CLASSES = (
+    paramiko.Ed25519Key,
+    paramiko.ECDSAKey,
+    paramiko.RSAKey,
+    paramiko.DSSKey,
+)
+
+
+def _parse_private_key(key_path: str, passphrase: Optional[str] = None) -> paramiko.PKey:
+    """Parse a private key file of any supported type"""
+    last_error = None
+    for key_class in _KEY_CLASSES:
+        try:
+            return key_class.from_private_key_file(key_path, password=passphrase or None)
+        except paramiko.PasswordRequiredException:
+            raise ValueError(f"Private key {key_path} is encrypted; a key_passphrase is required")
+        except (paramiko.SSHException, ValueError) as e:
+            # Wrong key type (or wrong passphrase) - try the next class
+            last_error = e
+    raise ValueError(f"Unsupported or unreadable private key {key_path}: {last_error}")
+
+
+def load_private_key(key_path: str, passphrase: Optional[str] = None) -> paramiko.PKey:
+    """Load a private key file, reusing the parsed key while the file is unchanged
+
+    Ed25519, ECDSA, RSA and DSA keys are detected automatically. Parsed keys
+    are cached per path and passphrase, so an encrypted key is decrypted once
+    and never handed to a caller without its passphrase; the cache entry is
+    dropped when the file's mtime changes.
+    """
+    mtime = os.path.getmtime(key_path)
+    cache_key = (key_path, hashlib.sha256(passphrase.encode()).hexdigest() if passphrase else "")
+
+    with _lock:
+        cached = _key_cache.get(cache_key)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    pkey = _parse_private_key(key_path, passphrase)
+    with _lock:
+        _key_cache[cache_key] = (mtime, pkey)
+    return pkey
+
+
+def get_server_key_passphrase(server) -> str:
+    """Return the decrypted stored key passphrase for a server"""
+    if not getattr(server, "encrypted_key_passphrase", None):
+        return ""
+    return server.get_key_passphrase()
+
+
+def get_agent_keys() -> tuple:
+    """Return the keys offered by the local ssh-agent (empty if no agent is running)"""
+    try:
+        return paramiko.Agent().get_keys()
+    except paramiko.SSHException:
+        return ()
+
+
+def invalidate_server(server_id: Optional[int], key_path: Optional[str] = None) -> None:
+    """Drop cached secrets for a server (called when the server record changes)"""
+    with _lock:
+        _password_cache.pop(server_id, None)
+        if key_path:
+            for cache_key in [cache_key for cache_key in _key_cache if cache_key[0] == key_path]:
+                del _key_cache[cache_key]
+
+
+def clear_cache() -> None:
+    """Drop every cached secret and key"""
+    with _lock:
+        _password_cache.clear()
+        _key_cache.clear()
@@ -0,0 +1,343 @@
+"""
+Remote executors.
+
+A RemoteExecutor wraps the connection details of one server and exposes the
+operations the API needs (connect, run, run_batch, collect_metrics,
+health_check, service_action, ...) independent of the transport. Linux
+servers are driven over SSH by linux_handler and Windows servers over WinRM
+by windows_handler; implementations are registered by os_type so routes
+never branch on the operating system themselves.
+"""
+
+import json
+from typing import Optional
+
+from . import linux_handler, probe, windows_handler
+from .credentials import get_server_password, get_server_key_passphrase, load_private_key
+from .timeouts import Timeouts, parse_timeout, server_timeouts
+
+
+class UnsupportedOSType(ValueError):
+    """Raised when no executor is registered for a server's os_type"""
+
+
+_EXECUTORS: dict = {}
+
+
+def register_executor(os_type: str):
+    """Class decorator registering an executor implementation for an os_type"""
+    def decorator(cls):
+        cls.os_type = os_type
+        _EXECUTORS[os_type] = cls
+        return cls
+    return decorator
+
+
+def get_executor_class(os_type: str):
+    """Return the executor class registered for an os_type"""
+    executor_class = _EXECUTORS.get((os_type or "").lower())
+    if executor_class is None:
+        raise UnsupportedOSType("Unsupported os_type")
+    return executor_class
+
+
+def get_executor(server, data: Optional[dict] = None):
+    """Build an executor for a stored server, taking credential overrides from request data"""
+    return get_executor_class(server.os_type).from_server(server, data or {})
+
+
+class RemoteExecutor:
+    """Base class for running operations on one remote server"""
+
+    os_type: str = ""
+    default_port: int = 0
+
+    def __init__(self, host: str, username: str, port: Optional[int] = None,
+                 password: Optional[str] = None, key_path: Optional[str] = None,
+                 timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None):
+        self.host = host
+        self.username = username
+        self.port = int(port or self.default_port)
+        self.password = password
+        self.key_path = key_path
+        # Every connection that parses an encrypted key_path needs it, not just the first
+        self.key_passphrase = key_passphrase
+        self.timeouts = timeouts or Timeouts()
+
+    @classmethod
+    def from_server(cls, server, data: dict):
+        """Resolve credentials for a stored server (raises ValueError when missing)"""
+        raise NotImplementedError
+
+    @staticmethod
+    def _timeouts(server, data: dict) -> Timeouts:
+        """The server's timeouts, with an optional per-request command "timeout" override"""
+        timeouts = server_timeouts(server)
+        command_timeout = parse_timeout(data.get("timeout"))
+        if command_timeout is not None:
+            timeouts = timeouts.with_command(command_timeout)
+        return timeouts
+
+    def connect(self) -> tuple[bool, str]:
+        """Check that the server is reachable and the credentials work"""
+        raise NotImplementedError
+
+    def run(self, command: str) -> dict:
+        """Run one command and return {"success", "output", "error", "exit_code", "duration_ms"}"""
+        raise NotImplementedError
+
+    def run_batch(self, commands: list, concurrent: bool = False) -> list:
+        """Run several commands over one session, returning per-command
+        {"command", "success", "exit_code", "stdout", "stderr", "duration_ms"}"""
+        raise NotImplementedError
+
+    def run_stream(self, command: str, max_bytes: Optional[int] = None, cancel_event=None):
+        """Run one command, yielding ("stdout"|"stderr", bytes) chunks and a final ("exit", status)"""
+        raise NotImplementedError
+
+    def collect_metrics(self) -> dict:
+        """Collect basic CPU/memory/disk/network metrics"""
+        raise NotImplementedError
+
+    def detailed_metrics(self, include_system_info: bool = True) -> dict:
+        """Collect processes, interfaces, partitions and (optionally) system info"""
+        raise NotImplementedError
+
+    def system_info(self) -> dict:
+        """Collect OS name, kernel, hostname and boot time"""
+        raise NotImplementedError
+
+    def boot_time(self) -> Optional[str]:
+        """Boot time as "YYYY-mm-dd HH:MM:SS", or None if it could not be read"""
+        raise NotImplementedError
+
+    def health_check(self) -> dict:
+        """Run disk/memory/load health checks"""
+        raise NotImplementedError
+
+    def service_action(self, action: str, service_name: str) -> dict:
+        """Start, stop or restart a service"""
+        raise NotImplementedError
+
+    def list_users(self) -> list:
+        """List user account names"""
+        raise NotImplementedError
+
+    def create_user(self, newuser: str, newpass: str) -> Optional[str]:
+        """Create a user account, returning any command output"""
+        raise NotImplementedError
+
+    def delete_user(self, target_user: str) -> None:
+        """Delete a user account"""
+        raise NotImplementedError
+
+
+SERVICE_ACTIONS = ("start", "stop", "restart")
+
+
+@register_executor("linux")
+class LinuxSSHExecutor(RemoteExecutor):
+    """Executor for Linux servers over SSH"""
+
+    default_port = 22
+
+    @classmethod
+    def from_server(cls, server, data: dict):
+        # Get password from request or stored
+        password = data.get("password")
+        if not password or (isinstance(password, str) and password.strip() == ""):
+            password = get_server_password(server) or None
+
+        # Get key_path from request or stored
+        key_path = data.get("key_path") or server.key_path
+
+        # Get port (request param, then stored ssh_port, then 22)
+        port = int(data.get("port") or server.ssh_port or 22)
+
+        # ssh-agent servers authenticate without a stored secret
+        if not key_path and not password:
+            if server.auth_type == "agent":
+                return cls(server.ip, server.username, port, timeouts=cls._timeouts(server, data))
+            raise ValueError("key_path or password required for linux")
+
+        # Parse (and cache) the key up front so encrypted keys are decrypted once
+        # with the passphrase and bad key files are reported as a request error
+        passphrase = None
+        if key_path and not password:
+            passphrase = data.get("key_passphrase") or get_server_key_passphrase(server)
+            try:
+                load_private_key(key_path, passphrase)
+            except OSError as e:
+                raise ValueError(f"Cannot read key_path: {e}")
+
+        return cls(server.ip, server.username, port, password=password, key_path=key_path, timeouts=cls._timeouts(server, data),
+                   key_passphrase=passphrase)
+
+    def _with_probe(self, probe_call, shell_call, idempotent: bool = True):
+        """Use the persistent probe when SSH_PROBE is enabled, else (or if it fails) shell commands
+
+        Only reads fall back after a failed probe request; an action that
+        changes the host (idempotent=False) falls back only if the probe was
+        never asked (ProbeUnavailable, or ProbeBusy while another request
+        holds the probe), so it cannot run twice.
+        """
+        if probe.PROBE_ENABLED:
+            try:
+                return probe_call()
+            except probe.ProbeUnavailable:
+                pass
+            except probe.ProbeError:
+                if not idempotent:
+                    raise
+        return shell_call()
+
+    def connect(self) -> tuple[bool, str]:
+        return linux_handler.test_connection(self.host, self.username, self.key_path, self.password, self.port, timeouts=self.timeouts, key_passphrase=self.key_passphrase)
+
+    def run(self, command: str) -> dict:
+        return linux_handler.execute_command(self.host, self.username, command, self.key_path, self.password, self.port, timeouts=self.timeouts, key_passphrase=self.key_passphrase)
+
+    def run_batch(self, commands: list, concurrent: bool = False) -> list:
+        return linux_handler.run_ssh_batch(self.host, self.username, commands, self.key_path, self.password, self.port, concurrent=concurrent, timeouts=self.timeouts, key_passphrase=self.key_passphrase)
+
+    def run_stream(self, command: str, max_bytes: Optional[int] = None, cancel_event=None):
+        return linux_handler.stream_ssh_command(self.host, self.username, command, self.key_path, self.password, self.port, max_bytes=max_bytes, cancel_event=cancel_event, timeouts=self.timeouts, key_passphrase=self.key_passphrase)
+
+    def collect_metrics(self) -> dict:
+        timeouts = self.timeouts.for_metrics()
+        return self._with_probe(
+            lambda: probe.get_basic_metrics(self.host, self.username, self.key_path, self.password, self.port, timeouts=timeouts, key_passphrase=self.key_passphrase),
+            lambda: linux_handler.get_basic_metrics(self.host, self.username, self.key_path, self.password, self.port, timeouts=timeouts, key_passphrase=self.key_passphrase),
+        )
+
+    def detailed_metrics(self, include_system_info: bool = True) -> dict:
+        timeouts = self.timeouts.for_metrics()
+        top_processes = self._with_probe(
+            lambda: probe.get_top_processes(self.host, self.username, self.key_path, self.password, self.port, timeouts=timeouts, key_passphrase=self.key_passphrase),
+            lambda: None,
+        )
+        return linux_handler.get_detailed_metrics(self.host, self.username, self.key_path, self.password, self.port, timeouts=timeouts, include_system_info=include_system_info, top_processes=top_processes, key_passphrase=self.key_passphrase)
+
+    def system_info(self) -> dict:
+        return linux_handler.get_system_info(self.host, self.username, self.key_path, self.password, self.port, timeouts=self.timeouts.for_metrics(), key_passphrase=self.key_passphrase)
+
+    def boot_time(self) -> Optional[str]:
+        return linux_handler.get_boot_time(self.host, self.username, self.key_path, self.password, self.port, timeouts=self.timeouts.for_metrics(), key_passphrase=self.key_passphrase)
+
+    def health_check(self) -> dict:
+        timeouts = self.timeouts.for_metrics()
+        return self._with_probe(
+            lambda: probe.run_health_check(self.host, self.username, self.key_path, self.password, self.port, timeouts=timeouts, key_passphrase=self.key_passphrase),
+            lambda: linux_handler.run_health_check(self.host, self.username, self.key_path, self.password, self.port, timeouts=timeouts, key_passphrase=self.key_passphrase),
+        )
+
+    def service_action(self, action: str, service_name: str) -> dict:
+        handler = {
+            "start": linux_handler.start_service,
+            "stop": linux_handler.stop_service,
+            "restart": linux_handler.restart_service,
+        }[action]
+        try:
+            return self._with_probe(
+                lambda: probe.service_action(self.host, self.username, service_name, action, self.key_path, self.password, self.port, timeouts=self.timeouts, key_passphrase=self.key_passphrase),
+                lambda: handler(self.host, self.username, service_name, self.key_path, self.password, self.port, timeouts=self.timeouts, key_passphrase=self.key_passphrase),
+                idempotent=False,
+            )
+        except probe.ProbeError as e:
+            # The request may have reached the host: report it rather than running the action again
+            return {"success": False, "output": None, "status": "unknown",
+                    "error": f"{e}; the {action} may still have been applied, check the service status"}
+
+    def list_users(self) -> list:
+        out = linux_handler.list_users(self.host, self.username, self.key_path, self.password, self.port, timeouts=self.timeouts, key_passphrase=self.key_passphrase)
+        return [u for u in out.splitlines() if u.strip()]
+
+    def create_user(self, newuser: str, newpass: str) -> Optional[str]:
+        linux_handler.create_user(self.host, self.username, newuser, newpass, self.key_path, self.password, self.port, timeouts=self.timeouts, key_passphrase=self.key_passphrase)
+        return None
+
+    def delete_user(self, target_user: str) -> None:
+        linux_handler.delete_user(self.host, self.username, target_user, self.key_path, self.password, self.port, timeouts=self.timeouts, key_passphrase=self.key_passphrase)
+
+
+@register_executor("windows")
+class WindowsWinRMExecutor(RemoteExecutor):
+    """Executor for Windows servers over WinRM"""
+
+    default_port = 5985
+
+    @classmethod
+    def from_server(cls, server, data: dict):
+        # Try to get password from request, fallback to stored password
+        password = data.get("password")
+        if not password or (isinstance(password, str) and password.strip() == ""):
+            password = get_server_password(server)
+            if not password:
+                raise ValueError("password required for windows")
+
+        stored_port = int(server.winrm_port) if getattr(server, "winrm_port", None) else 5985
+        # Only honour a request port if it is a valid WinRM port (5985 or 5986);
+        # anything else (e.g. an SSH port passed by mistake) falls back to the stored one
+        port = stored_port
+        request_port = data.get("port")
+        if request_port:
+            try:
+                if int(request_port) in (5985, 5986):
+                    port = int(request_port)
+            except (ValueError, TypeError):
+                pass
+
+        return cls(server.ip, server.username, port, password=password, timeouts=cls._timeouts(server, data))
+
+    def connect(self) -> tuple[bool, str]:
+        return windows_handler.test_connection(self.host, self.username, self.password, self.port, timeouts=self.timeouts)
+
+    def run(self, command: str) -> dict:
+        return windows_handler.execute_command(self.host, self.username, self.password, command, self.port, timeouts=self.timeouts)
+
+    def run_batch(self, commands: list, concurrent: bool = False) -> list:
+        # A WinRM shell runs one command at a time, so concurrent is ignored
+        return windows_handler.run_winrm_batch(self.host, self.username, self.password, commands, self.port, timeouts=self.timeouts)
+
+    def run_stream(self, command: str, max_bytes: Optional[int] = None, cancel_event=None):
+        return windows_handler.stream_winrm_command(self.host, self.username, self.password, command, self.port, max_bytes=max_bytes, cancel_event=cancel_event, timeouts=self.timeouts)
+
+    def collect_metrics(self) -> dict:
+        return windows_handler.get_basic_metrics(self.host, self.username, self.password, self.port, timeouts=self.timeouts.for_metrics())
+
+    def detailed_metrics(self, include_system_info: bool = True) -> dict:
+        return windows_handler.get_detailed_metrics(self.host, self.username, self.password, self.port, timeouts=self.timeouts.for_metrics(), include_system_info=include_system_info)
+
+    def system_info(self) -> dict:
+        return windows_handler.get_system_info(self.host, self.username, self.password, self.port, timeouts=self.timeouts.for_metrics())
+
+    def boot_time(self) -> Optional[str]:
+        return windows_handler.get_boot_time(self.host, self.username, self.password, self.port, timeouts=self.timeouts.for_metrics())
+
+    def health_check(self) -> dict:
+        return windows_handler.run_health_check(self.host, self.username, self.password, self.port, timeouts=self.timeouts.for_metrics())
+
+    def service_action(self, action: str, service_name: str) -> dict:
+        handler = {
+            "start": windows_handler.start_service,
+            "stop": windows_handler.stop_service,
+            "restart": windows_handler.restart_service,
+        }[action]
+        return handler(self.host, self.username, self.password, service_name, self.port, timeouts=self.timeouts)
+
+    def list_users(self) -> list:
+        out = windows_handler.list_users(self.host, self.username, self.password, self.port, timeouts=self.timeouts)
+        # Try to parse JSON first, fallback to text parsing
+        try:
+            users_data = json.loads(out)
+            if isinstance(users_data, list):
+                return [u.get("Name", "") for u in users_data if u.get("Name")]
+            return [users_data.get("Name", "")] if users_data.get("Name") else []
+        except (ValueError, AttributeError):
+            return [u.strip() for u in out.splitlines()[1:] if u.strip()]
+
+    def create_user(self, newuser: str, newpass: str) -> Optional[str]:
+        return windows_handler.create_windows_user(self.host, self.username, self.password, newuser, newpass, self.port, timeouts=self.timeouts)
+
+    def delete_user(self, target_user: str) -> None:
+        windows_handler.delete_user(self.host, self.username, self.password, target_user, self.port, timeouts=self.timeouts)
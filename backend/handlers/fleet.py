@@ -0,0 +1,73 @@
+"""
+Fleet fan-out.
+
+Runs one operation against many executors with bounded concurrency and a
+per-host deadline, yielding each host's outcome as soon as it finishes so
+callers can stream results instead of waiting for the slowest host.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Iterator
+
+
+DEFAULT_CONCURRENCY = 20
+MAX_CONCURRENCY = 100
+DEFAULT_HOST_TIMEOUT = 30.0
+MAX_HOST_TIMEOUT = 600.0
+MAX_SERVERS = 500
+
+
+class HostTimeout(Exception):
+    """A host did not finish within the per-host timeout"""
+
+
+def fan_out(executors: dict, operation: Callable, concurrency: int = DEFAULT_CONCURRENCY,
+            timeout: float = DEFAULT_HOST_TIMEOUT) -> Iterator[tuple]:
+    """Run operation(executor) for every executor, yielding (key, result, error, duration_ms)
+
+    Results are yielded in completion order. At most `concurrency` hosts run
+    at a time, and each is started on a thread of its own, so its deadline
+    counts from submission. A host that exceeds its timeout is reported with
+    a HostTimeout error and its worker is abandoned: the next host starts on
+    a fresh thread instead of queueing behind it, so hung hosts cannot stall
+    the stream. Callers should also pass the timeout down as the operation's
+    command timeout so abandoned workers finish soon after.
+    """
+    concurrency = max(1, min(int(concurrency), MAX_CONCURRENCY, max(len(executors), 1)))
+    queued = iter(executors.items())
+    pending = {}  # future -> (key, submitted at)
+
+    # One thread per host at most; threads are only created while fewer than
+    # `concurrency` hosts are running
+    pool = ThreadPoolExecutor(max_workers=max(len(executors), 1), thread_name_prefix="fleet")
+
+    def submit_next() -> None:
+        while len(pending) < concurrency:
+            item = next(queued, None)
+            if item is None:
+                return
+            key, executor = item
+            pending[pool.submit(operation, executor)] = (key, time.monotonic())
+
+    try:
+        submit_next()
+        while pending:
+            done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+
+            for future in done:
+                key, started = pending.pop(future)
+                duration_ms = round((now - started) * 1000, 1)
+                try:
+                    yield key, future.result(), None, duration_ms
+                except Exception as e:
+                    yield key, None, e, duration_ms
+
+            for future, (key, started) in list(pending.items()):
+                if now - started > timeout:
+                    del pending[future]
+                    yield key, None, HostTimeout(f"Timed out after {timeout:g}s"), round((now - started) * 1000, 1)
+            submit_next()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
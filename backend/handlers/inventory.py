@@ -0,0 +1,100 @@
+"""
+Stored system inventory.
+
+OS name, kernel, hostname and boot time rarely change, so detailed-metrics
+serves them from the server record instead of re-collecting them on every
+request. Each request makes one cheap boot-time check; the full inventory is
+re-read when the boot time moves (a reboot, possibly into a new kernel),
+when it is older than INVENTORY_MAX_AGE seconds (default one day) or when it
+has never been collected. Callers commit the server record.
+"""
+
+import os
+from datetime import datetime
+from typing import Optional
+
+
+INVENTORY_MAX_AGE = float(os.getenv("INVENTORY_MAX_AGE", "86400"))
+
+# `uptime -s` is derived from /proc/uptime and can move by a second between calls
+BOOT_TIME_TOLERANCE = 60
+
+_BOOT_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _parse_boot_time(boot_time: Optional[str]) -> Optional[datetime]:
+    try:
+        return datetime.strptime(boot_time, _BOOT_TIME_FORMAT) if boot_time else None
+    except ValueError:
+        return None
+
+
+def uptime_days(boot_time: Optional[str]) -> int:
+    """Whole days since a "YYYY-mm-dd HH:MM:SS" boot time"""
+    booted = _parse_boot_time(boot_time)
+    return (datetime.now() - booted).days if booted else 0
+
+
+def boot_time_changed(old: Optional[str], new: Optional[str]) -> bool:
+    """True if the host has rebooted between two boot time readings"""
+    if not old or not new:
+        return old != new
+    old_dt, new_dt = _parse_boot_time(old), _parse_boot_time(new)
+    if old_dt is None or new_dt is None:
+        return old != new
+    return abs((new_dt - old_dt).total_seconds()) > BOOT_TIME_TOLERANCE
+
+
+def needs_refresh(server, boot_time: Optional[str]) -> bool:
+    """Whether the stored inventory is missing, too old or predates a reboot"""
+    if server.inventory_updated_at is None:
+        return True
+    if (datetime.utcnow() - server.inventory_updated_at).total_seconds() > INVENTORY_MAX_AGE:
+        return True
+    # A failed boot-time check is not a reboot
+    return boot_time is not None and boot_time_changed(server.boot_time, boot_time)
+
+
+def inventory_changed(server, info: dict) -> bool:
+    """Whether reported system info differs from the stored inventory (or that is due for a refresh)"""
+    if needs_refresh(server, info.get("uptime_since")):
+        return True
+    return (server.os_name, server.kernel, server.system_hostname) != (info.get("os"), info.get("kernel"), info.get("hostname"))
+
+
+def store_inventory(server, info: dict) -> None:
+    """Save collected system info on the server record"""
+    server.os_name = info.get("os")
+    server.kernel = info.get("kernel")
+    server.system_hostname = info.get("hostname")
+    server.boot_time = info.get("uptime_since")
+    server.inventory_updated_at = datetime.utcnow()
+
+
+def stored_system_info(server, boot_time: Optional[str] = None) -> dict:
+    """system_info in the detailed-metrics shape, built from the stored inventory"""
+    boot_time = boot_time or server.boot_time
+    return {
+        "os": server.os_name or "Unknown",
+        "kernel": server.kernel or "Unknown",
+        "hostname": server.system_hostname or "Unknown",
+        "uptime_days": uptime_days(boot_time),
+        "uptime_since": boot_time,
+        "inventory_updated_at": server.inventory_updated_at.isoformat() + "Z" if server.inventory_updated_at else None,
+    }
+
+
+def get_system_info(server, executor) -> dict:
+    """Serve system info from the stored inventory, re-collecting it only when stale"""
+    boot_time = executor.boot_time()
+    if not needs_refresh(server, boot_time):
+        return stored_system_info(server, boot_time)
+
+    info = executor.system_info()
+    # Collection failures come back as "Unknown" - keep the last good inventory
+    if info.get("kernel") != "Unknown":
+        store_inventory(server, info)
+        return stored_system_info(server, info.get("uptime_since"))
+    if server.inventory_updated_at is not None:
+        return stored_system_info(server, boot_time)
+    return info
@@ -0,0 +1,138 @@
+"""
+Per-host concurrency limiter.
+
+Every SSH/WinRM session the handlers open to a host first takes a slot from
+that host's semaphore, so concurrent API requests queue instead of
+exceeding sshd MaxStartups or WinRM MaxConcurrentOperationsPerUser. Queue
+time is recorded per host for monitoring.
+
+Limits come from REMOTE_MAX_SESSIONS_PER_HOST (default 4) and
+REMOTE_QUEUE_TIMEOUT seconds (default 30). REMOTE_MAX_SESSIONS_HOSTS
+overrides single hosts as comma-separated host:port=limit pairs, e.g.
+"10.0.0.5:22=1,winbox:5985=2". A limit changed with set_host_limit applies
+to new sessions once the host's current ones have finished.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+DEFAULT_MAX_SESSIONS = int(os.getenv("REMOTE_MAX_SESSIONS_PER_HOST", "4"))
+DEFAULT_QUEUE_TIMEOUT = float(os.getenv("REMOTE_QUEUE_TIMEOUT", "30"))
+
+
+def parse_host_limits(spec: str) -> dict:
+    """host:port -> session limit from "host:port=limit,..." (malformed pairs are skipped)"""
+    limits = {}
+    for pair in spec.split(","):
+        endpoint, _, limit = pair.strip().rpartition("=")
+        try:
+            limits[endpoint.strip()] = max(1, int(limit))
+        except ValueError:
+            if pair.strip():
+                print(f"Ignoring malformed REMOTE_MAX_SESSIONS_HOSTS entry {pair.strip()!r}")
+    return limits
+
+
+class HostBusyError(Exception):
+    """Raised when no session slot for a host frees up within the queue timeout"""
+
+
+class _HostSlots:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.semaphore = threading.BoundedSemaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+class HostLimiter:
+    """Bounds the number of simultaneous remote sessions per host"""
+
+    def __init__(self, max_sessions: int = DEFAULT_MAX_SESSIONS, queue_timeout: float = DEFAULT_QUEUE_TIMEOUT,
+                 host_limits: Optional[dict] = None):
+        self.max_sessions = max(1, max_sessions)
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._hosts: dict = {}
+        self._overrides: dict = dict(host_limits or {})
+
+    def limit_for(self, host: str) -> int:
+        return self._overrides.get(host, self.max_sessions)
+
+    def set_host_limit(self, host: str, max_sessions: int) -> None:
+        """Override the session limit for one host"""
+        with self._lock:
+            self._overrides[host] = max(1, max_sessions)
+            self._swap_if_drained(host)
+
+    def _swap_if_drained(self, host: str) -> None:
+        """Drop a host's slot set whose limit is out of date once nobody holds or waits for it (caller holds the lock)"""
+        slots = self._hosts.get(host)
+        if slots is not None and slots.limit != self.limit_for(host) and slots.active == 0 and slots.waiting == 0:
+            del self._hosts[host]
+
+    @contextmanager
+    def slot(self, host: str, timeout: float = None):
+        """Hold one session slot for host for the duration of the block"""
+        timeout = self.queue_timeout if timeout is None else timeout
+
+        with self._lock:
+            slots = self._hosts.get(host)
+            if slots is None:
+                slots = self._hosts[host] = _HostSlots(self.limit_for(host))
+            slots.waiting += 1
+        started = time.monotonic()
+        acquired = slots.semaphore.acquire(timeout=timeout)
+        waited = time.monotonic() - started
+
+        with self._lock:
+            slots.waiting -= 1
+            if not acquired:
+                slots.rejected += 1
+                self._swap_if_drained(host)
+            else:
+                slots.active += 1
+                slots.acquired += 1
+                slots.total_wait += waited
+                slots.max_wait = max(slots.max_wait, waited)
+        if not acquired:
+            raise HostBusyError(
+                f"Too many concurrent sessions to {host} (limit {slots.limit}); "
+                f"no slot freed up within {timeout:g}s"
+            )
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                slots.active -= 1
+                self._swap_if_drained(host)
+            slots.semaphore.release()
+
+    def stats(self) -> dict:
+        """Per-host slot usage and queue-time statistics"""
+        with self._lock:
+            return {
+                host: {
+                    "limit": slots.limit,
+                    "active": slots.active,
+                    "waiting": slots.waiting,
+                    "acquired": slots.acquired,
+                    "rejected": slots.rejected,
+                    "avg_wait_ms": round(slots.total_wait / slots.acquired * 1000, 1) if slots.acquired else 0.0,
+                    "max_wait_ms": round(slots.max_wait * 1000, 1),
+                }
+                for host, slots in self._hosts.items()
+            }
+
+
+# Shared by the SSH and WinRM handlers
+host_limiter = HostLimiter(host_limits=parse_host_limits(os.getenv("REMOTE_MAX_SESSIONS_HOSTS", "")))
@@ -1,9 +1,26 @@
-import paramiko
+import re
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import Optional
 
+import paramiko
+
+from .breaker import host_breaker
+from .credentials import load_private_key, get_agent_keys
+from .inventory import uptime_days
+from .limits import host_limiter
+from .rates import busy_percent, counter_rates, disk_io_rates, network_rates
+from .results import HOST_UNAVAILABLE, CommandResult
+from .timeouts import RemoteTimeout, Timeouts
 
-def run_ssh_command(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, cmd: str = "", port: int = 22) -> str:
-    """Execute SSH command using either key-based or password authentication"""
+
+def _open_ssh_client(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> paramiko.SSHClient:
+    """Open an authenticated SSH client using key, password or ssh-agent authentication"""
+    timeouts = timeouts or Timeouts()
+    # TCP connect and SSH banner share the connect timeout; auth has its own
+    connect_timeouts = {"timeout": timeouts.connect, "banner_timeout": timeouts.connect, "auth_timeout": timeouts.auth}
     client = paramiko.SSHClient()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
     
@@ -15,33 +32,226 @@ def run_ssh_command(host: str, user: str, key_path: Optional[str] = None, passwo
                 username=user, 
                 password=password, 
                 port=port, 
-                timeout=10,
                 allow_agent=False,
-                look_for_keys=False
+                look_for_keys=False,
+                **connect_timeouts
             )
         elif key_path:
-            # Key-based authentication
-            pkey = paramiko.RSAKey.from_private_key_file(key_path)
-            client.connect(hostname=host, username=user, pkey=pkey, port=port, timeout=10)
+            # Key-based authentication (parsed key is cached until the file changes)
+            pkey = load_private_key(key_path, key_passphrase)
+            client.connect(hostname=host, username=user, pkey=pkey, port=port, **connect_timeouts)
         else:
-            raise ValueError("Either key_path or password must be provided")
-        
-        stdin, stdout, stderr = client.exec_command(cmd)
-        out = stdout.read().decode()
-        error = stderr.read().decode()
+            # No password or key file - authenticate with the local ssh-agent's keys
+            if not get_agent_keys():
+                raise ValueError("Either key_path or password must be provided (no ssh-agent keys available)")
+            client.connect(hostname=host, username=user, port=port, allow_agent=True, look_for_keys=False, **connect_timeouts)
+    except Exception:
+        client.close()
+        raise
+    return client
+
+
+def open_checked_client(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> paramiko.SSHClient:
+    """Open a client and report the outcome to the host's circuit breaker
+    
+    Connect and auth timeouts raise RemoteTimeout. The caller is expected to
+    have called host_breaker.before_call and to hold a session slot.
+    """
+    timeouts = timeouts or Timeouts()
+    endpoint = f"{host}:{port}"
+    started = time.monotonic()
+    try:
+        client = _open_ssh_client(host, user, key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase)
+    except paramiko.AuthenticationException as e:
+        # The server answered, so it is reachable
+        host_breaker.record_success(endpoint)
+        if "timeout" in str(e).lower():
+            raise RemoteTimeout("auth", timeouts.auth, endpoint) from e
+        raise
+    except (OSError, paramiko.SSHException) as e:
+        host_breaker.record_failure(endpoint, e)
+        # paramiko reports a banner timeout as a generic SSHException, so go by elapsed time
+        if isinstance(e, socket.timeout) or time.monotonic() - started >= timeouts.connect:
+            raise RemoteTimeout("connect", timeouts.connect, endpoint) from e
+        raise
+    host_breaker.record_success(endpoint)
+    return client
+
+
+@contextmanager
+def _ssh_session(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None):
+    """Open a client while holding one of the host's session slots (see limits.host_limiter)
+
+    Hosts whose circuit is open fail fast with CircuitOpenError (see breaker.host_breaker);
+    connect and auth timeouts raise RemoteTimeout.
+    """
+    endpoint = f"{host}:{port}"
+    host_breaker.before_call(endpoint)
+    with host_limiter.slot(endpoint):
+        client = open_checked_client(host, user, key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase)
+        try:
+            yield client
+        finally:
+            client.close()
+
+
+# Bytes read from a channel per recv() call when streaming output
+STREAM_CHUNK_SIZE = 32768
+
+
+def iter_channel_output(channel: paramiko.Channel, max_bytes: Optional[int] = None, cancel_event=None, timeout: Optional[float] = None):
+    """Read stdout and stderr from a channel concurrently, yielding events as data arrives
+    
+    Yields ("stdout", bytes), ("stderr", bytes) and finally one
+    ("exit", {"exit_code", "bytes", "truncated", "cancelled", "timed_out"}).
+    Draining both streams together avoids the deadlock where a command blocks
+    on a full stderr window while we wait for stdout. When max_bytes is
+    exceeded, cancel_event is set or the command runs longer than timeout
+    seconds the channel is closed and the remote command is abandoned.
+    """
+    total = 0
+    truncated = cancelled = timed_out = False
+    deadline = time.monotonic() + timeout if timeout else None
+    
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            cancelled = True
+            break
+        if deadline is not None and time.monotonic() > deadline:
+            timed_out = True
+            break
         
-        if error and not out:
-            raise Exception(f"SSH command failed: {error}")
+        progressed = False
+        if channel.recv_ready():
+            data = channel.recv(STREAM_CHUNK_SIZE)
+            if data:
+                progressed = True
+                total += len(data)
+                yield "stdout", data
+        if channel.recv_stderr_ready():
+            data = channel.recv_stderr(STREAM_CHUNK_SIZE)
+            if data:
+                progressed = True
+                total += len(data)
+                yield "stderr", data
         
-        return out
-    finally:
-        client.close()
+        if max_bytes is not None and total > max_bytes:
+            truncated = True
+            break
+        if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+            break
+        if not progressed:
+            time.sleep(0.01)
+    
+    exit_code = None
+    if truncated or cancelled or timed_out:
+        channel.close()
+    else:
+        exit_code = channel.recv_exit_status()
+    yield "exit", {"exit_code": exit_code, "bytes": total, "truncated": truncated, "cancelled": cancelled, "timed_out": timed_out}
+
+
+def stream_ssh_command(host: str, user: str, cmd: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, max_bytes: Optional[int] = None, cancel_event=None, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None):
+    """Run a command and yield its output incrementally (see iter_channel_output)"""
+    timeouts = timeouts or Timeouts()
+    # The session is also released when the consumer stops early (e.g. the HTTP client disconnected)
+    with _ssh_session(host, user, key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase) as client:
+        channel = client.get_transport().open_session()
+        channel.exec_command(cmd)
+        yield from iter_channel_output(channel, max_bytes, cancel_event, timeouts.command)
+
+
+def _collect_channel_output(channel: paramiko.Channel, cmd: str, started: float, max_bytes: Optional[int] = None, timeout: Optional[float] = None) -> CommandResult:
+    """Drain a channel into a CommandResult"""
+    out, err, status = [], [], {}
+    for kind, data in iter_channel_output(channel, max_bytes, timeout=timeout):
+        if kind == "stdout":
+            out.append(data)
+        elif kind == "stderr":
+            err.append(data)
+        else:
+            status = data
+    return CommandResult(
+        command=cmd,
+        exit_code=status.get("exit_code"),
+        stdout=b"".join(out).decode(errors="replace"),
+        stderr=b"".join(err).decode(errors="replace"),
+        duration_ms=round((time.monotonic() - started) * 1000, 1),
+        bytes=status.get("bytes", 0),
+        truncated=status.get("truncated", False),
+        timed_out=status.get("timed_out", False),
+    )
+
+
+def run_ssh(host: str, user: str, cmd: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, max_bytes: Optional[int] = None, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> CommandResult:
+    """Execute a command and return its structured result (exit code, output, timing)
+    
+    Connection and authentication errors raise; a command that runs but fails
+    (or exceeds the command timeout) is reported through the CommandResult.
+    """
+    timeouts = timeouts or Timeouts()
+    started = time.monotonic()
+    with _ssh_session(host, user, key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase) as client:
+        channel = client.get_transport().open_session()
+        channel.exec_command(cmd)
+        return _collect_channel_output(channel, cmd, started, max_bytes, timeouts.command)
+
+
+def run_ssh_command(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, cmd: str = "", port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> str:
+    """Execute SSH command using either key-based or password authentication
+    
+    Returns stdout; raises if the command exits with a non-zero status and
+    RemoteTimeout if it runs past the command timeout.
+    """
+    timeouts = timeouts or Timeouts()
+    result = run_ssh(host, user, cmd, key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase)
+    if result.timed_out:
+        raise RemoteTimeout("command", timeouts.command)
+    if not result.ok:
+        raise Exception(f"SSH command failed: {result.error_message}")
+    return result.stdout
+
+
+def _run_on_client(client: paramiko.SSHClient, cmd: str, timeout: Optional[float] = None) -> CommandResult:
+    """Run one command on an open client"""
+    started = time.monotonic()
+    try:
+        channel = client.get_transport().open_session()
+        channel.exec_command(cmd)
+        return _collect_channel_output(channel, cmd, started, timeout=timeout)
+    except Exception as e:
+        return CommandResult(
+            command=cmd,
+            exit_code=None,
+            stderr=str(e),
+            duration_ms=round((time.monotonic() - started) * 1000, 1),
+        )
+
 
+# sshd's default MaxSessions is 10 channels per connection
+MAX_CONCURRENT_CHANNELS = 10
 
-def test_connection(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22) -> tuple[bool, str]:
+
+def run_ssh_batch(host: str, user: str, commands: list, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, concurrent: bool = False, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> list:
+    """Run several commands over one SSH connection
+    
+    Commands run in order on the same transport; with concurrent=True each runs
+    on its own channel in parallel. Results are returned in request order. The
+    command timeout applies to each command separately.
+    """
+    timeouts = timeouts or Timeouts()
+    with _ssh_session(host, user, key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase) as client:
+        if concurrent and len(commands) > 1:
+            workers = min(len(commands), MAX_CONCURRENT_CHANNELS)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                return [r.to_dict() for r in pool.map(lambda cmd: _run_on_client(client, cmd, timeouts.command), commands)]
+        return [_run_on_client(client, cmd, timeouts.command).to_dict() for cmd in commands]
+
+
+def test_connection(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> tuple[bool, str]:
     """Test SSH connection to server. Returns (success, message)"""
     try:
-        result = run_ssh_command(host, user, key_path, password, "echo 'connection_test'", port)
+        result = run_ssh_command(host, user, key_path, password, "echo 'connection_test'", port, timeouts=timeouts, key_passphrase=key_passphrase)
         if "connection_test" in result:
             return True, "Connection successful"
         return False, "Connection test failed: unexpected response"
@@ -56,41 +266,90 @@ def test_connection(host: str, user: str, key_path: Optional[str] = None, passwo
             return False, f"Connection failed: {error_msg}"
 
 
-def get_basic_metrics(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22) -> dict:
-    """Get basic server metrics via SSH and return structured data"""
-    import re
-    import time
+# Sections are marked so one round trip can carry every cumulative counter
+_PROC_COUNTERS_CMD = "echo @stat; cat /proc/stat; echo @net; cat /proc/net/dev; echo @disk; cat /proc/diskstats 2>/dev/null; echo @load; cat /proc/loadavg"
+
+# Whole disks only - partitions, loop, ram and device-mapper devices would double count
+_DISK_DEVICE = re.compile(r"^(?:[shv]d[a-z]+|xvd[a-z]+|nvme\d+n\d+|mmcblk\d+)$")
+
+# /proc/diskstats always counts 512-byte sectors
+_SECTOR_BYTES = 512
+
+
+def parse_proc_counters(output: str) -> dict:
+    """Parse the output of _PROC_COUNTERS_CMD into cumulative counters"""
+    sections = {}
+    current = None
+    for line in output.splitlines():
+        if line.startswith("@"):
+            current = sections.setdefault(line[1:].strip(), [])
+        elif current is not None:
+            current.append(line)
     
-    # Get CPU usage percentage
-    cpu_cmd = "top -bn1 | grep 'Cpu(s)' | sed 's/.*, *\\([0-9.]*\\)%* id.*/\\1/' | awk '{print 100 - $1}'"
-    cpu_output = run_ssh_command(host, user, key_path, password, cpu_cmd, port)
-    try:
-        cpu_usage = float(cpu_output.strip().split('\n')[0])
-    except:
-        # Fallback method
-        cpu_cmd2 = "grep 'cpu ' /proc/stat | awk '{usage=($2+$4)*100/($2+$3+$4+$5)} END {print usage}'"
-        cpu_output = run_ssh_command(host, user, key_path, password, cpu_cmd2, port)
-        try:
-            cpu_usage = float(cpu_output.strip())
-        except:
-            cpu_usage = 0.0
+    counters = dict.fromkeys((
+        "cpu_total", "cpu_idle",
+        "net_bytes_recv", "net_bytes_sent", "net_packets_recv", "net_packets_sent",
+        "disk_reads", "disk_writes", "disk_read_bytes", "disk_write_bytes",
+    ), 0)
+    cores = 0
+    btime = None
+    for line in sections.get("stat", []):
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == "cpu":
+            # user nice system idle iowait irq softirq steal (guest time is already in user)
+            times = [int(x) for x in fields[1:9]]
+            counters["cpu_total"] = sum(times)
+            counters["cpu_idle"] = sum(times[3:5])
+        elif fields[0].startswith("cpu"):
+            cores += 1
+        elif fields[0] == "btime" and len(fields) > 1:
+            btime = fields[1]
+    
+    for line in sections.get("net", []):
+        if ":" not in line:
+            continue
+        name, data = line.split(":", 1)
+        fields = data.split()
+        if name.strip() == "lo" or len(fields) < 10:
+            continue
+        counters["net_bytes_recv"] += int(fields[0])
+        counters["net_packets_recv"] += int(fields[1])
+        counters["net_bytes_sent"] += int(fields[8])
+        counters["net_packets_sent"] += int(fields[9])
+    
+    for line in sections.get("disk", []):
+        fields = line.split()
+        if len(fields) < 10 or not _DISK_DEVICE.match(fields[2]):
+            continue
+        counters["disk_reads"] += int(fields[3])
+        counters["disk_read_bytes"] += int(fields[5]) * _SECTOR_BYTES
+        counters["disk_writes"] += int(fields[7])
+        counters["disk_write_bytes"] += int(fields[9]) * _SECTOR_BYTES
     
-    # Get number of CPU cores
-    cores_cmd = "nproc"
-    cores_output = run_ssh_command(host, user, key_path, password, cores_cmd, port)
     try:
-        cpu_cores = int(cores_output.strip())
-    except:
-        cpu_cores = 1
+        load_avg = [float(x) for x in sections.get("load", [""])[0].split()[:3]]
+    except (IndexError, ValueError):
+        load_avg = []
     
-    # Get load average
-    loadavg_cmd = "cat /proc/loadavg | awk '{print $1, $2, $3}'"
-    loadavg_output = run_ssh_command(host, user, key_path, password, loadavg_cmd, port)
-    load_avg = [float(x) for x in loadavg_output.strip().split()[:3]] if loadavg_output.strip() else [0.0, 0.0, 0.0]
+    return {
+        "counters": counters,
+        "cores": cores or 1,
+        "btime": btime,
+        "load_avg": load_avg if len(load_avg) == 3 else [0.0, 0.0, 0.0],
+    }
+
+
+def get_basic_metrics(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> dict:
+    """Get basic server metrics via SSH and return structured data"""
+    # CPU, load average, network and disk I/O counters in one read
+    counters_output = run_ssh_command(host, user, key_path, password, _PROC_COUNTERS_CMD, port, timeouts=timeouts, key_passphrase=key_passphrase)
+    proc = parse_proc_counters(counters_output)
     
     # Get memory usage
     mem_cmd = "free -m | awk 'NR==2{printf \"%.2f\", $3*100/$2}'"
-    mem_output = run_ssh_command(host, user, key_path, password, mem_cmd, port)
+    mem_output = run_ssh_command(host, user, key_path, password, mem_cmd, port, timeouts=timeouts, key_passphrase=key_passphrase)
     try:
         memory_usage = float(mem_output.strip())
     except:
@@ -98,7 +357,7 @@ def get_basic_metrics(host: str, user: str, key_path: Optional[str] = None, pass
     
     # Get memory details
     mem_details_cmd = "free -m | awk 'NR==2{print $2, $3, $4}'"
-    mem_details = run_ssh_command(host, user, key_path, password, mem_details_cmd, port)
+    mem_details = run_ssh_command(host, user, key_path, password, mem_details_cmd, port, timeouts=timeouts, key_passphrase=key_passphrase)
     try:
         total_mem, used_mem, available_mem = [float(x) for x in mem_details.strip().split()[:3]]
         total_mem_gb = total_mem / 1024
@@ -111,7 +370,7 @@ def get_basic_metrics(host: str, user: str, key_path: Optional[str] = None, pass
     
     # Get disk usage
     disk_cmd = "df -h / | awk 'NR==2 {print $5}' | sed 's/%//'"
-    disk_output = run_ssh_command(host, user, key_path, password, disk_cmd, port)
+    disk_output = run_ssh_command(host, user, key_path, password, disk_cmd, port, timeouts=timeouts, key_passphrase=key_passphrase)
     try:
         disk_usage = float(disk_output.strip())
     except:
@@ -119,7 +378,7 @@ def get_basic_metrics(host: str, user: str, key_path: Optional[str] = None, pass
     
     # Get disk details
     disk_details_cmd = "df -h / | awk 'NR==2 {print $2, $3, $4}'"
-    disk_details = run_ssh_command(host, user, key_path, password, disk_details_cmd, port)
+    disk_details = run_ssh_command(host, user, key_path, password, disk_details_cmd, port, timeouts=timeouts, key_passphrase=key_passphrase)
     try:
         parts = disk_details.strip().split()
         total_disk_str = parts[0] if len(parts) > 0 else "0G"
@@ -154,16 +413,35 @@ def get_basic_metrics(host: str, user: str, key_path: Optional[str] = None, pass
     
     # Get uptime
     uptime_cmd = "uptime -p 2>/dev/null || uptime | awk -F'up ' '{print $2}' | awk -F',' '{print $1, $2}'"
-    uptime_output = run_ssh_command(host, user, key_path, password, uptime_cmd, port)
+    uptime_output = run_ssh_command(host, user, key_path, password, uptime_cmd, port, timeouts=timeouts, key_passphrase=key_passphrase)
     
-    # Get network stats
-    network_cmd = "cat /proc/net/dev | awk 'NR>2 {rx+=$2; tx+=$10} END {print rx, tx}'"
-    network_output = run_ssh_command(host, user, key_path, password, network_cmd, port)
-    try:
-        bytes_recv, bytes_sent = [int(x) for x in network_output.strip().split()[:2]]
-    except:
-        bytes_recv = 0
-        bytes_sent = 0
+    memory = {
+        "total_gb": total_mem_gb,
+        "used_gb": used_mem_gb,
+        "available_gb": available_mem_gb,
+        "usage_percent": memory_usage,
+    }
+    disk = {
+        "total_gb": total_disk_gb,
+        "used_gb": used_disk_gb,
+        "available_gb": available_disk_gb,
+        "usage_percent": disk_usage,
+    }
+    return basic_metrics_payload(host, port, proc, memory, disk, uptime_output.strip() or "N/A")
+
+
+def basic_metrics_payload(host: str, port: int, proc: dict, memory: dict, disk: dict, uptime_text: str) -> dict:
+    """Build the basic metrics response from parsed /proc counters, memory and root disk figures
+    
+    Also used by the probe (see probe.py), so both collection paths report the
+    same shape and share the host's counter-rate sample.
+    """
+    rates, interval = counter_rates.update(f"{host}:{port}", proc["counters"], boot_id=proc["btime"])
+    
+    cpu_usage = busy_percent(rates)
+    if cpu_usage is None:
+        # No previous sample yet: average since boot (what top's first iteration shows too)
+        cpu_usage = busy_percent(proc["counters"]) or 0.0
     
     return {
         "server_id": None,  # Will be set by the route
@@ -172,68 +450,73 @@ def get_basic_metrics(host: str, user: str, key_path: Optional[str] = None, pass
         "timestamp": time.time(),
         "cpu": {
             "usage_percent": round(cpu_usage, 1),
-            "cores": cpu_cores,
-            "load_avg": [round(x, 2) for x in load_avg]
-        },
-        "memory": {
-            "total_gb": round(total_mem_gb, 2),
-            "used_gb": round(used_mem_gb, 2),
-            "available_gb": round(available_mem_gb, 2),
-            "usage_percent": round(memory_usage, 1)
+            "cores": proc["cores"],
+            "load_avg": [round(x, 2) for x in proc["load_avg"]]
         },
+        "memory": {name: round(value, 1 if name == "usage_percent" else 2) for name, value in memory.items()},
         "disk": {
-            "total_gb": round(total_disk_gb, 2),
-            "used_gb": round(used_disk_gb, 2),
-            "available_gb": round(available_disk_gb, 2),
-            "usage_percent": round(disk_usage, 1),
-            "mount_point": "/"
+            **{name: round(value, 1 if name == "usage_percent" else 2) for name, value in disk.items()},
+            "mount_point": "/",
+            "io": disk_io_rates(rates)
         },
         "network": {
-            "bytes_sent": bytes_sent,
-            "bytes_recv": bytes_recv,
-            "packets_sent": 0,
-            "packets_recv": 0,
+            "bytes_sent": proc["counters"]["net_bytes_sent"],
+            "bytes_recv": proc["counters"]["net_bytes_recv"],
+            "packets_sent": proc["counters"]["net_packets_sent"],
+            "packets_recv": proc["counters"]["net_packets_recv"],
+            **network_rates(rates),
             "interfaces": []
         },
+        "rate_interval": round(interval, 1) if interval else None,
         "uptime": {
-            "text": uptime_output.strip() if uptime_output.strip() else "N/A"
+            "text": uptime_text
         }
     }
 
 
-def create_user(host: str, user: str, newuser: str, newpass: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22) -> bool:
+def create_user(host: str, user: str, newuser: str, newpass: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> bool:
     """Create a new user on the remote server"""
-    run_ssh_command(host, user, key_path, password, f"sudo useradd -m {newuser}", port)
-    run_ssh_command(host, user, key_path, password, f"echo '{newuser}:{newpass}' | sudo chpasswd", port)
+    run_ssh_command(host, user, key_path, password, f"sudo useradd -m {newuser}", port, timeouts=timeouts, key_passphrase=key_passphrase)
+    run_ssh_command(host, user, key_path, password, f"echo '{newuser}:{newpass}' | sudo chpasswd", port, timeouts=timeouts, key_passphrase=key_passphrase)
     return True
 
 
-def list_users(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22) -> str:
+def list_users(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> str:
     """List users on the remote server (UID >= 1000)"""
-    return run_ssh_command(host, user, key_path, password, "getent passwd | awk -F: '$3 >= 1000 {print $1}'", port)
+    return run_ssh_command(host, user, key_path, password, "getent passwd | awk -F: '$3 >= 1000 {print $1}'", port, timeouts=timeouts, key_passphrase=key_passphrase)
 
 
-def delete_user(host: str, user: str, target_user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22) -> bool:
+def delete_user(host: str, user: str, target_user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> bool:
     """Delete a user from the remote server"""
-    run_ssh_command(host, user, key_path, password, f"sudo userdel -r {target_user}", port)
+    run_ssh_command(host, user, key_path, password, f"sudo userdel -r {target_user}", port, timeouts=timeouts, key_passphrase=key_passphrase)
     return True
 
 
-def execute_command(host: str, user: str, command: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22) -> dict:
+def execute_command(host: str, user: str, command: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> dict:
     """Execute an arbitrary command on the remote server and return output"""
     try:
-        output = run_ssh_command(host, user, key_path, password, command, port)
-        return {"success": True, "output": output, "error": None}
+        result = run_ssh(host, user, command, key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase)
+    except HOST_UNAVAILABLE:
+        # The route answers 503/504 for these
+        raise
     except Exception as e:
-        return {"success": False, "output": None, "error": str(e)}
+        return {"success": False, "output": None, "error": str(e), "exit_code": None, "timed_out": False}
+    return {
+        "success": result.ok,
+        "output": result.stdout,
+        "error": None if result.ok else result.error_message,
+        "exit_code": result.exit_code,
+        "duration_ms": result.duration_ms,
+        "timed_out": result.timed_out,
+    }
 
 
-def get_top_processes(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, limit: int = 10) -> list:
+def get_top_processes(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, limit: int = 10, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> list:
     """Get top processes by CPU and Memory usage"""
     # Get top processes by CPU
     cmd = f"ps aux --sort=-%cpu | head -n {limit + 1} | tail -n {limit} | awk '{{print $2, $3, $4, $11, $1}}'"
     try:
-        output = run_ssh_command(host, user, key_path, password, cmd, port)
+        output = run_ssh_command(host, user, key_path, password, cmd, port, timeouts=timeouts, key_passphrase=key_passphrase)
         processes = []
         for line in output.strip().split('\n'):
             if line.strip():
@@ -247,16 +530,18 @@ def get_top_processes(host: str, user: str, key_path: Optional[str] = None, pass
                         "user": parts[4] if len(parts) > 4 else "unknown"
                     })
         return processes[:limit]
+    except HOST_UNAVAILABLE:
+        raise
     except:
         return []
 
 
-def get_network_interfaces(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22) -> list:
+def get_network_interfaces(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> list:
     """Get detailed network interface statistics"""
     # Get interface stats from /proc/net/dev
     cmd = "cat /proc/net/dev | awk 'NR>2 {print $1, $2, $10, $3, $11}' | sed 's/://'"
     try:
-        output = run_ssh_command(host, user, key_path, password, cmd, port)
+        output = run_ssh_command(host, user, key_path, password, cmd, port, timeouts=timeouts, key_passphrase=key_passphrase)
         interfaces = []
         for line in output.strip().split('\n'):
             if line.strip():
@@ -266,8 +551,10 @@ def get_network_interfaces(host: str, user: str, key_path: Optional[str] = None,
                     # Get IP address for this interface
                     ip_cmd = f"ip addr show {interface_name} 2>/dev/null | grep 'inet ' | awk '{{print $2}}' | cut -d'/' -f1 | head -1"
                     try:
-                        ip_output = run_ssh_command(host, user, key_path, password, ip_cmd, port)
+                        ip_output = run_ssh_command(host, user, key_path, password, ip_cmd, port, timeouts=timeouts, key_passphrase=key_passphrase)
                         ip = ip_output.strip() if ip_output.strip() else "N/A"
+                    except HOST_UNAVAILABLE:
+                        raise
                     except:
                         ip = "N/A"
                     
@@ -280,15 +567,17 @@ def get_network_interfaces(host: str, user: str, key_path: Optional[str] = None,
                         "tx_packets": int(parts[4])
                     })
         return interfaces
+    except HOST_UNAVAILABLE:
+        raise
     except:
         return []
 
 
-def get_disk_partitions(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22) -> list:
+def get_disk_partitions(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> list:
     """Get all disk partitions and mount points"""
     cmd = "df -h | awk 'NR>1 {print $1, $2, $3, $4, $5, $6}'"
     try:
-        output = run_ssh_command(host, user, key_path, password, cmd, port)
+        output = run_ssh_command(host, user, key_path, password, cmd, port, timeouts=timeouts, key_passphrase=key_passphrase)
         partitions = []
         for line in output.strip().split('\n'):
             if line.strip():
@@ -323,49 +612,46 @@ def get_disk_partitions(host: str, user: str, key_path: Optional[str] = None, pa
                         "mount": parts[5]
                     })
         return partitions
+    except HOST_UNAVAILABLE:
+        raise
     except:
         return []
 
 
-def get_system_info(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22) -> dict:
+# Boot time as "YYYY-mm-dd HH:MM:SS" (falls back to /proc/stat btime without procps)
+_BOOT_TIME_CMD = "uptime -s 2>/dev/null || date -d \"@$(awk '/^btime/ {print $2}' /proc/stat)\" '+%Y-%m-%d %H:%M:%S'"
+
+# OS name, kernel, hostname and boot time in one round trip, one value per line
+_SYSTEM_INFO_SCRIPT = f"""
+os_name=$(grep '^PRETTY_NAME=' /etc/os-release 2>/dev/null | cut -d'=' -f2 | tr -d '"')
+echo "$os_name"
+uname -r
+hostname
+{_BOOT_TIME_CMD} 2>/dev/null || echo ''
+"""
+
+
+def get_boot_time(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> Optional[str]:
+    """Boot time as "YYYY-mm-dd HH:MM:SS" (cheap check used to detect reboots)"""
+    try:
+        output = run_ssh_command(host, user, key_path, password, _BOOT_TIME_CMD, port, timeouts=timeouts, key_passphrase=key_passphrase)
+    except Exception:
+        return None
+    return output.strip() or None
+
+
+def get_system_info(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> dict:
     """Get system information (OS, kernel, hostname, etc.)"""
     try:
-        # Get OS info
-        os_cmd = "cat /etc/os-release | grep PRETTY_NAME | cut -d'=' -f2 | tr -d '\"'"
-        os_output = run_ssh_command(host, user, key_path, password, os_cmd, port)
-        os_name = os_output.strip() if os_output.strip() else "Unknown"
-        
-        # Get kernel version
-        kernel_cmd = "uname -r"
-        kernel_output = run_ssh_command(host, user, key_path, password, kernel_cmd, port)
-        kernel = kernel_output.strip() if kernel_output.strip() else "Unknown"
-        
-        # Get hostname
-        hostname_cmd = "hostname"
-        hostname_output = run_ssh_command(host, user, key_path, password, hostname_cmd, port)
-        hostname = hostname_output.strip() if hostname_output.strip() else "Unknown"
-        
-        # Get uptime in days
-        uptime_cmd = "uptime -s 2>/dev/null || echo ''"
-        uptime_since = run_ssh_command(host, user, key_path, password, uptime_cmd, port)
-        uptime_since_str = uptime_since.strip() if uptime_since.strip() else None
-        
-        # Calculate uptime days
-        uptime_days = 0
-        if uptime_since_str:
-            try:
-                from datetime import datetime
-                uptime_date = datetime.strptime(uptime_since_str, "%Y-%m-%d %H:%M:%S")
-                uptime_days = (datetime.now() - uptime_date).days
-            except:
-                pass
+        lines = run_ssh_command(host, user, key_path, password, _SYSTEM_INFO_SCRIPT, port, timeouts=timeouts, key_passphrase=key_passphrase).splitlines()
+        os_name, kernel, hostname, uptime_since = ([line.strip() for line in lines] + ["", "", "", ""])[:4]
         
         return {
-            "os": os_name,
-            "kernel": kernel,
-            "hostname": hostname,
-            "uptime_days": uptime_days,
-            "uptime_since": uptime_since_str
+            "os": os_name or "Unknown",
+            "kernel": kernel or "Unknown",
+            "hostname": hostname or "Unknown",
+            "uptime_days": uptime_days(uptime_since or None),
+            "uptime_since": uptime_since or None
         }
     except Exception as e:
         return {
@@ -377,313 +663,161 @@ def get_system_info(host: str, user: str, key_path: Optional[str] = None, passwo
         }
 
 
-def get_detailed_metrics(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22) -> dict:
-    """Get detailed metrics including top processes, network interfaces, disk partitions, and system info"""
-    return {
-        "top_processes": get_top_processes(host, user, key_path, password, port),
-        "network_interfaces": get_network_interfaces(host, user, key_path, password, port),
-        "disk_partitions": get_disk_partitions(host, user, key_path, password, port),
-        "system_info": get_system_info(host, user, key_path, password, port)
+def get_detailed_metrics(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, include_system_info: bool = True, top_processes: Optional[list] = None, key_passphrase: Optional[str] = None) -> dict:
+    """Get detailed metrics including top processes, network interfaces, disk partitions, and system info
+    
+    With include_system_info=False system_info is left out so the caller can
+    serve it from the stored inventory. top_processes, when given, is used
+    instead of running ps (the probe collects it itself).
+    """
+    if top_processes is None:
+        top_processes = get_top_processes(host, user, key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase)
+    metrics = {
+        "top_processes": top_processes,
+        "network_interfaces": get_network_interfaces(host, user, key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase),
+        "disk_partitions": get_disk_partitions(host, user, key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase),
     }
+    if include_system_info:
+        metrics["system_info"] = get_system_info(host, user, key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase)
+    return metrics
+
+
+# Performs a service action and reports the resulting state in one round trip.
+# The exit status of the script is the exit status of the action itself; the
+# service state comes from `systemctl is-active` / `service status` exit codes.
+_SERVICE_ACTION_SCRIPT = """
+SUDO=""
+if [ "$(id -u)" != "0" ] && command -v sudo >/dev/null 2>&1; then SUDO="sudo -n"; fi
+if [ "$(ps -p 1 -o comm= 2>/dev/null)" = "systemd" ] && command -v systemctl >/dev/null 2>&1; then
+    $SUDO systemctl {action} {service}
+    rc=$?
+    $SUDO systemctl is-active --quiet {service}
+    echo "__state_rc=$?"
+    exit $rc
+elif command -v service >/dev/null 2>&1; then
+    $SUDO service {service} {action}
+    rc=$?
+    $SUDO service {service} status >/dev/null 2>&1
+    echo "__state_rc=$?"
+    exit $rc
+fi
+echo "no service manager available" >&2
+exit 127
+"""
+
+_DOCKER_SERVICE_HINT = "Service management is not available in this Docker container. Docker containers typically don't support systemd or service commands. Use 'Execute Command' instead to manage processes directly (e.g., 'ps aux | grep <process>', 'kill <pid>', or start processes manually)."
+
+
+def service_action_script(action: str, service_name: str) -> str:
+    """_SERVICE_ACTION_SCRIPT for one action and (shell-quoted) service"""
+    import shlex
+    
+    return _SERVICE_ACTION_SCRIPT.format(action=action, service=shlex.quote(service_name))
 
 
-def restart_service(host: str, user: str, service_name: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22) -> dict:
-    """Restart a service (systemd or service command)"""
+def _service_action(host: str, user: str, service_name: str, action: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> dict:
+    """Run start/stop/restart for a service (systemd or service command) with exit-status-based results"""
+    script = service_action_script(action, service_name)
     try:
-        # Check if we're root or if sudo is available
-        try:
-            whoami_output = run_ssh_command(host, user, key_path, password, "whoami", port)
-            is_root = "root" in whoami_output.strip().lower()
-        except:
-            is_root = False
-        
-        # Try with sudo first, fallback to without sudo if not available or if root
-        sudo_prefix = "" if is_root else "sudo "
-        try:
-            # Test if sudo is available (if not root)
-            if not is_root:
-                run_ssh_command(host, user, key_path, password, "which sudo", port)
-        except:
-            # sudo not available, try without it
-            sudo_prefix = ""
-        
-        # Check if systemd is available - try to check if systemd is actually running
-        use_systemd = False
-        try:
-            # First check if systemctl command exists
-            which_check = run_ssh_command(host, user, key_path, password, "which systemctl 2>/dev/null", port)
-            if which_check and "systemctl" in which_check.strip():
-                # Then check if systemd is actually running by checking PID 1
-                try:
-                    # Check if PID 1 is systemd
-                    pid1_check = run_ssh_command(host, user, key_path, password, "ps -p 1 -o comm= 2>/dev/null", port)
-                    if pid1_check and "systemd" in pid1_check.strip().lower():
-                        # Double check with a simple systemctl command that won't fail if systemd is running
-                        try:
-                            systemctl_check = run_ssh_command(host, user, key_path, password, f"{sudo_prefix}systemctl is-system-running 2>&1", port)
-                            # If it doesn't contain the error message about systemd not booted, assume it works
-                            if systemctl_check and "not been booted with systemd" not in systemctl_check.lower() and "not booted" not in systemctl_check.lower():
-                                use_systemd = True
-                        except:
-                            # If the check fails, systemd is not available
-                            use_systemd = False
-                except:
-                    # If PID check fails, systemd is not available
-                    use_systemd = False
-        except:
-            # systemctl command doesn't exist or check failed
-            use_systemd = False
-        
-        if use_systemd:
-            # Use systemctl
-            cmd = f"{sudo_prefix}systemctl restart {service_name}"
-            output = run_ssh_command(host, user, key_path, password, cmd, port)
-            # Check if service is running
-            status_cmd = f"{sudo_prefix}systemctl is-active {service_name}"
-            status_output = run_ssh_command(host, user, key_path, password, status_cmd, port)
-            is_active = "active" in status_output.lower()
-        else:
-            # Try using service command as fallback
-            try:
-                cmd = f"{sudo_prefix}service {service_name} restart"
-                output = run_ssh_command(host, user, key_path, password, cmd, port)
-                # Check status using service command
-                status_cmd = f"{sudo_prefix}service {service_name} status"
-                status_output = run_ssh_command(host, user, key_path, password, status_cmd, port)
-                is_active = "running" in status_output.lower() or "active" in status_output.lower()
-            except Exception as e:
-                error_msg = str(e)
-                # Provide helpful error message for Docker containers
-                if "unrecognized service" in error_msg.lower() or "not been booted with systemd" in error_msg.lower():
-                    return {
-                        "success": False, 
-                        "output": None, 
-                        "status": "unknown", 
-                        "error": "Service management is not available in this Docker container. Docker containers typically don't support systemd or service commands. Use 'Execute Command' instead to manage processes directly (e.g., 'ps aux | grep <process>', 'kill <pid>', or start processes manually)."
-                    }
-                return {
-                    "success": False, 
-                    "output": None, 
-                    "status": "unknown", 
-                    "error": f"Service management not available. Error: {error_msg}"
-                }
-        
-        return {"success": True, "output": output, "status": "active" if is_active else "inactive", "error": None}
+        result = run_ssh(host, user, script, key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase)
+    except HOST_UNAVAILABLE:
+        raise
     except Exception as e:
         return {"success": False, "output": None, "status": "unknown", "error": str(e)}
+    return service_result(result)
 
 
-def start_service(host: str, user: str, service_name: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22) -> dict:
-    """Start a service (systemd or service command)"""
-    try:
-        # Check if we're root or if sudo is available
-        try:
-            whoami_output = run_ssh_command(host, user, key_path, password, "whoami", port)
-            is_root = "root" in whoami_output.strip().lower()
-        except:
-            is_root = False
-        
-        # Try with sudo first, fallback to without sudo if not available or if root
-        sudo_prefix = "" if is_root else "sudo "
-        try:
-            # Test if sudo is available (if not root)
-            if not is_root:
-                run_ssh_command(host, user, key_path, password, "which sudo", port)
-        except:
-            # sudo not available, try without it
-            sudo_prefix = ""
-        
-        # Check if systemd is available - try to check if systemd is actually running
-        use_systemd = False
-        try:
-            # First check if systemctl command exists
-            which_check = run_ssh_command(host, user, key_path, password, "which systemctl 2>/dev/null", port)
-            if which_check and "systemctl" in which_check.strip():
-                # Then check if systemd is actually running by checking PID 1
-                try:
-                    # Check if PID 1 is systemd
-                    pid1_check = run_ssh_command(host, user, key_path, password, "ps -p 1 -o comm= 2>/dev/null", port)
-                    if pid1_check and "systemd" in pid1_check.strip().lower():
-                        # Double check with a simple systemctl command that won't fail if systemd is running
-                        try:
-                            systemctl_check = run_ssh_command(host, user, key_path, password, f"{sudo_prefix}systemctl is-system-running 2>&1", port)
-                            # If it doesn't contain the error message about systemd not booted, assume it works
-                            if systemctl_check and "not been booted with systemd" not in systemctl_check.lower() and "not booted" not in systemctl_check.lower():
-                                use_systemd = True
-                        except:
-                            # If the check fails, systemd is not available
-                            use_systemd = False
-                except:
-                    # If PID check fails, systemd is not available
-                    use_systemd = False
-        except:
-            # systemctl command doesn't exist or check failed
-            use_systemd = False
-        
-        if use_systemd:
-            # Use systemctl
-            cmd = f"{sudo_prefix}systemctl start {service_name}"
-            output = run_ssh_command(host, user, key_path, password, cmd, port)
-            # Check if service is running
-            status_cmd = f"{sudo_prefix}systemctl is-active {service_name}"
-            status_output = run_ssh_command(host, user, key_path, password, status_cmd, port)
-            is_active = "active" in status_output.lower()
+def service_result(result: CommandResult) -> dict:
+    """Turn the result of _SERVICE_ACTION_SCRIPT into the service action response"""
+    state_rc = None
+    output_lines = []
+    for line in result.stdout.splitlines():
+        if line.startswith("__state_rc="):
+            state_rc = int(line.split("=", 1)[1])
         else:
-            # Try using service command as fallback
-            try:
-                cmd = f"{sudo_prefix}service {service_name} start"
-                output = run_ssh_command(host, user, key_path, password, cmd, port)
-                # Check status using service command
-                status_cmd = f"{sudo_prefix}service {service_name} status"
-                status_output = run_ssh_command(host, user, key_path, password, status_cmd, port)
-                is_active = "running" in status_output.lower() or "active" in status_output.lower()
-            except Exception as e:
-                error_msg = str(e)
-                # Provide helpful error message for Docker containers
-                if "unrecognized service" in error_msg.lower() or "not been booted with systemd" in error_msg.lower():
-                    return {
-                        "success": False, 
-                        "output": None, 
-                        "status": "unknown", 
-                        "error": "Service management is not available in this Docker container. Docker containers typically don't support systemd or service commands. Use 'Execute Command' instead to manage processes directly (e.g., 'ps aux | grep <process>', 'kill <pid>', or start processes manually)."
-                    }
-                return {
-                    "success": False, 
-                    "output": None, 
-                    "status": "unknown", 
-                    "error": f"Service management not available. Error: {error_msg}"
-                }
-        
-        return {"success": True, "output": output, "status": "active" if is_active else "inactive", "error": None}
-    except Exception as e:
-        return {"success": False, "output": None, "status": "unknown", "error": str(e)}
+            output_lines.append(line)
+    output = "\n".join(output_lines)
+    
+    # is-active / status exit 0 means the service is running
+    if state_rc is None:
+        status = "unknown"
+    else:
+        status = "active" if state_rc == 0 else "inactive"
+    
+    if not result.ok:
+        error_msg = result.error_message
+        if result.exit_code == 127 or "unrecognized service" in error_msg.lower() or "not been booted with systemd" in error_msg.lower():
+            error_msg = _DOCKER_SERVICE_HINT
+        return {"success": False, "output": output or None, "status": status, "error": error_msg, "exit_code": result.exit_code}
+    
+    return {"success": True, "output": output, "status": status, "error": None, "exit_code": result.exit_code}
+
+
+def restart_service(host: str, user: str, service_name: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> dict:
+    """Restart a service (systemd or service command)"""
+    return _service_action(host, user, service_name, "restart", key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase)
 
 
-def stop_service(host: str, user: str, service_name: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22) -> dict:
+def start_service(host: str, user: str, service_name: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> dict:
+    """Start a service (systemd or service command)"""
+    return _service_action(host, user, service_name, "start", key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase)
+
+
+def stop_service(host: str, user: str, service_name: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> dict:
     """Stop a service (systemd or service command)"""
+    return _service_action(host, user, service_name, "stop", key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase)
+
+
+# Disk %, memory %, 1-minute load and core count, one value per line
+_HEALTH_CHECK_SCRIPT = (
+    "df -P / | awk 'NR==2 {print $5}' | sed 's/%//'; "
+    "free -m | awk 'NR==2{printf \"%.1f\\n\", $3*100/$2}'; "
+    "awk '{print $1}' /proc/loadavg; "
+    "nproc"
+)
+
+
+def run_health_check(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> dict:
+    """Run system health checks (all values are collected in one command)"""
     try:
-        # Check if we're root or if sudo is available
-        try:
-            whoami_output = run_ssh_command(host, user, key_path, password, "whoami", port)
-            is_root = "root" in whoami_output.strip().lower()
-        except:
-            is_root = False
-        
-        # Try with sudo first, fallback to without sudo if not available or if root
-        sudo_prefix = "" if is_root else "sudo "
-        try:
-            # Test if sudo is available (if not root)
-            if not is_root:
-                run_ssh_command(host, user, key_path, password, "which sudo", port)
-        except:
-            # sudo not available, try without it
-            sudo_prefix = ""
-        
-        # Check if systemd is available - try to check if systemd is actually running
-        use_systemd = False
+        lines = run_ssh(host, user, _HEALTH_CHECK_SCRIPT, key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase).stdout.splitlines()
+    except HOST_UNAVAILABLE:
+        raise
+    except Exception:
+        lines = []
+    
+    def value(index: int, cast):
         try:
-            # First check if systemctl command exists
-            which_check = run_ssh_command(host, user, key_path, password, "which systemctl 2>/dev/null", port)
-            if which_check and "systemctl" in which_check.strip():
-                # Then check if systemd is actually running by checking PID 1
-                try:
-                    # Check if PID 1 is systemd
-                    pid1_check = run_ssh_command(host, user, key_path, password, "ps -p 1 -o comm= 2>/dev/null", port)
-                    if pid1_check and "systemd" in pid1_check.strip().lower():
-                        # Double check with a simple systemctl command that won't fail if systemd is running
-                        try:
-                            systemctl_check = run_ssh_command(host, user, key_path, password, f"{sudo_prefix}systemctl is-system-running 2>&1", port)
-                            # If it doesn't contain the error message about systemd not booted, assume it works
-                            if systemctl_check and "not been booted with systemd" not in systemctl_check.lower() and "not booted" not in systemctl_check.lower():
-                                use_systemd = True
-                        except:
-                            # If the check fails, systemd is not available
-                            use_systemd = False
-                except:
-                    # If PID check fails, systemd is not available
-                    use_systemd = False
-        except:
-            # systemctl command doesn't exist or check failed
-            use_systemd = False
-        
-        if use_systemd:
-            # Use systemctl
-            cmd = f"{sudo_prefix}systemctl stop {service_name}"
-            output = run_ssh_command(host, user, key_path, password, cmd, port)
-            # Check if service is stopped
-            status_cmd = f"{sudo_prefix}systemctl is-active {service_name}"
-            status_output = run_ssh_command(host, user, key_path, password, status_cmd, port)
-            is_inactive = "inactive" in status_output.lower() or "failed" in status_output.lower()
-        else:
-            # Try using service command as fallback
-            try:
-                cmd = f"{sudo_prefix}service {service_name} stop"
-                output = run_ssh_command(host, user, key_path, password, cmd, port)
-                # Check status using service command
-                status_cmd = f"{sudo_prefix}service {service_name} status"
-                status_output = run_ssh_command(host, user, key_path, password, status_cmd, port)
-                is_inactive = "stopped" in status_output.lower() or "inactive" in status_output.lower() or "not running" in status_output.lower()
-            except Exception as e:
-                error_msg = str(e)
-                # Provide helpful error message for Docker containers
-                if "unrecognized service" in error_msg.lower() or "not been booted with systemd" in error_msg.lower():
-                    return {
-                        "success": False, 
-                        "output": None, 
-                        "status": "unknown", 
-                        "error": "Service management is not available in this Docker container. Docker containers typically don't support systemd or service commands. Use 'Execute Command' instead to manage processes directly (e.g., 'ps aux | grep <process>', 'kill <pid>', or start processes manually)."
-                    }
-                return {
-                    "success": False, 
-                    "output": None, 
-                    "status": "unknown", 
-                    "error": f"Service management not available. Error: {error_msg}"
-                }
-        
-        return {"success": True, "output": output, "status": "inactive" if is_inactive else "active", "error": None}
-    except Exception as e:
-        return {"success": False, "output": None, "status": "unknown", "error": str(e)}
+            return cast(lines[index].strip())
+        except (IndexError, ValueError):
+            return None
+    
+    return health_checks(value(0, float), value(1, float), value(2, float), value(3, int))
 
 
-def run_health_check(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22) -> dict:
-    """Run system health checks"""
+def health_checks(disk_usage: Optional[float], mem_usage: Optional[float], load_avg: Optional[float], cores: Optional[int]) -> dict:
+    """Grade disk %, memory %, 1-minute load and core count (None means "could not check")"""
     checks = {}
     
-    try:
-        # Check disk space
-        disk_cmd = "df -h / | awk 'NR==2 {print $5}' | sed 's/%//'"
-        disk_output = run_ssh_command(host, user, key_path, password, disk_cmd, port)
-        disk_usage = float(disk_output.strip())
+    if disk_usage is not None:
         checks["disk"] = {
             "status": "ok" if disk_usage < 80 else "warning" if disk_usage < 90 else "critical",
             "usage_percent": disk_usage,
             "message": f"Disk usage: {disk_usage}%"
         }
-    except:
+    else:
         checks["disk"] = {"status": "unknown", "usage_percent": 0, "message": "Could not check disk"}
     
-    try:
-        # Check memory
-        mem_cmd = "free -m | awk 'NR==2{printf \"%.1f\", $3*100/$2}'"
-        mem_output = run_ssh_command(host, user, key_path, password, mem_cmd, port)
-        mem_usage = float(mem_output.strip())
+    if mem_usage is not None:
         checks["memory"] = {
             "status": "ok" if mem_usage < 80 else "warning" if mem_usage < 90 else "critical",
             "usage_percent": mem_usage,
             "message": f"Memory usage: {mem_usage}%"
         }
-    except:
+    else:
         checks["memory"] = {"status": "unknown", "usage_percent": 0, "message": "Could not check memory"}
     
-    try:
-        # Check load average
-        load_cmd = "uptime | awk -F'load average:' '{print $2}' | awk '{print $1}' | sed 's/,//'"
-        load_output = run_ssh_command(host, user, key_path, password, load_cmd, port)
-        load_avg = float(load_output.strip())
-        # Get CPU cores for comparison
-        cores_cmd = "nproc"
-        cores_output = run_ssh_command(host, user, key_path, password, cores_cmd, port)
-        cores = int(cores_output.strip())
+    if load_avg is not None and cores is not None:
         load_ratio = load_avg / cores if cores > 0 else load_avg
         checks["load"] = {
             "status": "ok" if load_ratio < 1.0 else "warning" if load_ratio < 2.0 else "critical",
@@ -691,7 +825,7 @@ def run_health_check(host: str, user: str, key_path: Optional[str] = None, passw
             "cores": cores,
             "message": f"Load average: {load_avg} (cores: {cores})"
         }
-    except:
+    else:
         checks["load"] = {"status": "unknown", "load_average": 0, "cores": 0, "message": "Could not check load"}
     
     return checks
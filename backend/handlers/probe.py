@@ -0,0 +1,318 @@
+"""
+Persistent probe mode for Linux hosts (optional).
+
+With SSH_PROBE=1, basic metrics, process lists, health checks and service
+actions are served by a small Python probe (probe_agent.py) instead of a new
+shell pipeline per poll. The probe is uploaded over SFTP to SSH_PROBE_DIR in
+the login user's home (named by content hash, so a new version is uploaded
+alongside the old one), started with SSH_PROBE_PYTHON on a long-lived SSH
+channel and spoken to with one JSON request and one JSON response per line.
+Reading /proc from a resident process costs no remote forks, which keeps
+sub-second polling of a host cheap.
+
+One probe is kept per host and login until it has been idle for
+SSH_PROBE_IDLE_TIMEOUT seconds (default 300). The connection is opened
+through the circuit breaker and a session slot, but does not keep the slot
+once the probe is running. Hosts where the probe cannot start (no python3,
+no SFTP) raise ProbeUnavailable - callers fall back to shell commands - and
+are not retried for SSH_PROBE_RETRY seconds (default 600).
+"""
+
+import hashlib
+import io
+import json
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import paramiko
+
+from .breaker import host_breaker
+from .limits import host_limiter
+from .linux_handler import (
+    basic_metrics_payload,
+    health_checks,
+    open_checked_client,
+    parse_proc_counters,
+    service_action_script,
+    service_result,
+)
+from .results import CommandResult
+from .timeouts import RemoteTimeout, Timeouts
+
+
+PROBE_ENABLED = os.getenv("SSH_PROBE", "").lower() in ("1", "true", "yes")
+PROBE_DIR = os.getenv("SSH_PROBE_DIR", ".server-monitoring")
+PROBE_PYTHON = os.getenv("SSH_PROBE_PYTHON", "python3")
+IDLE_TIMEOUT = float(os.getenv("SSH_PROBE_IDLE_TIMEOUT", "300"))
+RETRY_AFTER = float(os.getenv("SSH_PROBE_RETRY", "600"))
+
+_PROBE_SOURCE = Path(__file__).with_name("probe_agent.py").read_bytes()
+_PROBE_NAME = f"probe-{hashlib.sha1(_PROBE_SOURCE).hexdigest()[:12]}.py"
+
+
+class ProbeError(Exception):
+    """A probe request failed, possibly after the probe received it"""
+
+
+class ProbeUnavailable(ProbeError):
+    """The probe could not be started (or is not being retried yet) on a host"""
+
+
+class ProbeBusy(ProbeUnavailable):
+    """The probe stayed busy with another request; this one was never sent"""
+
+
+class ProbeOpFailed(ProbeError):
+    """The probe answered that an op failed; the probe itself is still usable"""
+
+
+def _upload_probe(client: paramiko.SSHClient) -> str:
+    """Copy probe_agent.py to the host unless this version is already there; returns its path"""
+    path = f"{PROBE_DIR}/{_PROBE_NAME}"
+    sftp = client.open_sftp()
+    try:
+        try:
+            sftp.stat(path)
+            return path
+        except IOError:
+            pass
+        try:
+            sftp.mkdir(PROBE_DIR, 0o700)
+        except IOError:
+            pass  # already exists
+        # Upload under a temporary name so a concurrent start never runs a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        sftp.putfo(io.BytesIO(_PROBE_SOURCE), tmp_path)
+        try:
+            sftp.rename(tmp_path, path)
+        except IOError:
+            # Another backend worker won the race
+            sftp.remove(tmp_path)
+        return path
+    finally:
+        sftp.close()
+
+
+class _ProbeSession:
+    """One running probe: its SSH client, channel and request counter"""
+
+    def __init__(self, endpoint: str, client: paramiko.SSHClient, channel: paramiko.Channel):
+        self.endpoint = endpoint
+        self.client = client
+        self.channel = channel
+        self.reader = channel.makefile("rb")
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.requests = 0
+        self.busy_time = 0.0  # seconds spent in answered requests
+        self.max_time = 0.0
+        self.started_at = time.time()
+        self.last_used = time.monotonic()
+        self.version = None
+
+    def handshake(self, timeout: float) -> None:
+        """Wait for the probe's hello line"""
+        self.channel.settimeout(timeout)
+        try:
+            line = self.reader.readline()
+        except socket.timeout:
+            raise ProbeUnavailable(f"probe on {self.endpoint} did not start within {timeout:g}s")
+        try:
+            hello = json.loads(line) if line else {}
+        except ValueError:
+            hello = {}
+        if "hello" not in hello:
+            stderr = self.channel.recv_stderr(4096).decode(errors="replace").strip() if self.channel.recv_stderr_ready() else ""
+            raise ProbeUnavailable(f"probe on {self.endpoint} did not start: {stderr or 'no response'}")
+        self.version = hello.get("version")
+
+    def alive(self) -> bool:
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active() and not self.channel.closed and not self.channel.exit_status_ready()
+
+    def request(self, op: str, args: dict, timeout: float):
+        """Send one request and wait up to timeout seconds for its response"""
+        if not self.lock.acquire(timeout=timeout):
+            raise ProbeBusy(f"probe on {self.endpoint} is busy")
+        started = time.monotonic()
+        try:
+            self.next_id += 1
+            request_id = self.next_id
+            self.channel.settimeout(timeout)
+            try:
+                self.channel.sendall(json.dumps({"id": request_id, "op": op, "args": args}).encode() + b"\n")
+                while True:
+                    line = self.reader.readline()
+                    if not line:
+                        raise ProbeError(f"probe on {self.endpoint} exited")
+                    response = json.loads(line)
+                    # Anything else is a late answer to a request that timed out
+                    if response.get("id") == request_id:
+                        break
+            except socket.timeout:
+                raise RemoteTimeout("command", timeout, self.endpoint)
+            except (OSError, EOFError, ValueError, paramiko.SSHException) as e:
+                raise ProbeError(f"probe on {self.endpoint} failed: {e}")
+            self.requests += 1
+            self.last_used = time.monotonic()
+            elapsed = self.last_used - started
+            self.busy_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+        finally:
+            self.lock.release()
+        if not response.get("ok"):
+            raise ProbeOpFailed(response.get("error") or "probe request failed")
+        return response.get("result")
+
+    def close(self) -> None:
+        # Closing the channel closes the probe's stdin, which makes it exit
+        self.client.close()
+
+
+class ProbePool:
+    """Running probes by host and login"""
+
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT, retry_after: float = RETRY_AFTER):
+        self.idle_timeout = idle_timeout
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._sessions: dict = {}
+        self._starting: dict = {}
+        self._unavailable: dict = {}
+
+    def request(self, host: str, user: str, key_path: Optional[str], password: Optional[str], port: int,
+                timeouts: Optional[Timeouts], op: str, args: Optional[dict] = None, key_passphrase: Optional[str] = None):
+        """Run one probe op on a host, starting the probe first if needed"""
+        timeouts = timeouts or Timeouts()
+        session = self._session(host, user, key_path, password, port, timeouts, key_passphrase)
+        try:
+            return session.request(op, args or {}, timeouts.command)
+        except (ProbeBusy, ProbeOpFailed):
+            # Another thread's request is still in flight on this probe, or
+            # the probe answered fine: keep it
+            raise
+        except (ProbeError, RemoteTimeout):
+            # A probe that failed or stopped answering is not reused
+            self._discard(session)
+            raise
+
+    def _session(self, host, user, key_path, password, port, timeouts, key_passphrase) -> _ProbeSession:
+        endpoint = f"{host}:{port}"
+        key = (endpoint, user)
+        with self._lock:
+            self._close_idle()
+            retry_at = self._unavailable.get(key)
+            if retry_at is not None and time.monotonic() < retry_at:
+                raise ProbeUnavailable(f"probe unavailable on {endpoint}")
+            session = self._sessions.get(key)
+            if session is not None and session.alive():
+                return session
+            starting = self._starting.setdefault(key, threading.Lock())
+
+        # Only one caller starts the probe; the others wait and reuse it
+        with starting:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is not None and session.alive():
+                    return session
+            try:
+                session = self._start(endpoint, host, user, key_path, password, port, timeouts, key_passphrase)
+            except ProbeUnavailable as e:
+                print(f"Probe unavailable on {endpoint}, using shell commands for {self.retry_after:.0f}s: {e}")
+                with self._lock:
+                    self._unavailable[key] = time.monotonic() + self.retry_after
+                raise
+            with self._lock:
+                self._unavailable.pop(key, None)
+                self._sessions[key] = session
+            return session
+
+    def _start(self, endpoint, host, user, key_path, password, port, timeouts, key_passphrase) -> _ProbeSession:
+        host_breaker.before_call(endpoint)
+        with host_limiter.slot(endpoint):
+            client = open_checked_client(host, user, key_path, password, port, timeouts=timeouts, key_passphrase=key_passphrase)
+        try:
+            path = _upload_probe(client)
+            channel = client.get_transport().open_session()
+            channel.exec_command(f"exec {PROBE_PYTHON} {path}")
+            session = _ProbeSession(endpoint, client, channel)
+            session.handshake(timeouts.connect)
+        except ProbeUnavailable:
+            client.close()
+            raise
+        except (OSError, paramiko.SSHException) as e:
+            client.close()
+            raise ProbeUnavailable(str(e) or type(e).__name__)
+        return session
+
+    def _discard(self, session: _ProbeSession) -> None:
+        with self._lock:
+            for key, current in list(self._sessions.items()):
+                if current is session:
+                    del self._sessions[key]
+        session.close()
+
+    def _close_idle(self) -> None:
+        """Close probes idle for longer than idle_timeout (caller holds the lock)"""
+        now = time.monotonic()
+        for key, session in list(self._sessions.items()):
+            if now - session.last_used > self.idle_timeout or not session.alive():
+                del self._sessions[key]
+                session.close()
+
+    def stats(self) -> dict:
+        """Running probes by host"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                f"{user}@{endpoint}": {
+                    "version": session.version,
+                    "requests": session.requests,
+                    "avg_ms": round(session.busy_time / session.requests * 1000, 1) if session.requests else 0.0,
+                    "max_ms": round(session.max_time * 1000, 1),
+                    "started_at": session.started_at,
+                    "idle_for": round(now - session.last_used, 1),
+                }
+                for (endpoint, user), session in self._sessions.items()
+            }
+
+
+probe_pool = ProbePool()
+
+
+def get_basic_metrics(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> dict:
+    """Basic metrics from the probe, in the same shape as linux_handler.get_basic_metrics"""
+    data = probe_pool.request(host, user, key_path, password, port, timeouts, "metrics", key_passphrase=key_passphrase)
+    return basic_metrics_payload(host, port, parse_proc_counters(data["proc"]), data["memory"], data["disk"], data["uptime"])
+
+
+def get_top_processes(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, limit: int = 10, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> list:
+    """Top processes by CPU from the probe"""
+    return probe_pool.request(host, user, key_path, password, port, timeouts, "processes", {"limit": limit}, key_passphrase=key_passphrase)
+
+
+def run_health_check(host: str, user: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> dict:
+    """Disk, memory and load health checks from the probe"""
+    data = probe_pool.request(host, user, key_path, password, port, timeouts, "health", key_passphrase=key_passphrase)
+    return health_checks(data.get("disk_usage"), data.get("mem_usage"), data.get("load_avg"), data.get("cores"))
+
+
+def service_action(host: str, user: str, service_name: str, action: str, key_path: Optional[str] = None, password: Optional[str] = None, port: int = 22, timeouts: Optional[Timeouts] = None, key_passphrase: Optional[str] = None) -> dict:
+    """Start, stop or restart a service through the probe"""
+    timeouts = timeouts or Timeouts()
+    script = service_action_script(action, service_name)
+    started = time.monotonic()
+    # The probe enforces the command timeout; the channel waits a little longer for its answer
+    data = probe_pool.request(host, user, key_path, password, port, timeouts.with_command(timeouts.command + 5), "run", {"cmd": script, "timeout": timeouts.command}, key_passphrase=key_passphrase)
+    return service_result(CommandResult(
+        command=script,
+        exit_code=data.get("exit_code"),
+        stdout=data.get("stdout", ""),
+        stderr=data.get("stderr", ""),
+        duration_ms=round((time.monotonic() - started) * 1000, 1),
+        timed_out=data.get("timed_out", False),
+    ))
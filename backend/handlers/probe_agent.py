@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Server Monitoring probe.
+
+Uploaded to Linux hosts and started by the backend over SSH (see probe.py).
+Reads one JSON request per line on stdin and answers with one JSON line on
+stdout, so metrics, process lists and health checks are read straight from
+/proc by this resident process instead of spawning shells, awk and ps on
+every poll. Standard library only and Python 3.5 compatible; exits when
+stdin closes, i.e. when the backend drops the SSH channel.
+"""
+
+import json
+import math
+import os
+import pwd
+import subprocess
+import sys
+
+VERSION = 1
+
+# Same sections (and markers) as linux_handler._PROC_COUNTERS_CMD
+PROC_COUNTER_FILES = (
+    ("stat", "/proc/stat"),
+    ("net", "/proc/net/dev"),
+    ("disk", "/proc/diskstats"),
+    ("load", "/proc/loadavg"),
+)
+
+GB = 1024.0 ** 3
+
+
+def read(path):
+    try:
+        with open(path, errors="replace") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+
+def proc_counters():
+    lines = []
+    for name, path in PROC_COUNTER_FILES:
+        lines.append("@" + name)
+        lines.append(read(path).rstrip("\n"))
+    return "\n".join(lines)
+
+
+def meminfo():
+    info = {}
+    for line in read("/proc/meminfo").splitlines():
+        name, _, rest = line.partition(":")
+        fields = rest.split()
+        if fields:
+            info[name] = int(fields[0]) * 1024
+    return info
+
+
+def memory():
+    info = meminfo()
+    total = info.get("MemTotal", 0)
+    available = info.get("MemAvailable", info.get("MemFree", 0) + info.get("Buffers", 0) + info.get("Cached", 0))
+    used = total - available
+    return {
+        "total_gb": total / GB,
+        "used_gb": used / GB,
+        "available_gb": available / GB,
+        "usage_percent": used * 100.0 / total if total else 0.0,
+    }
+
+
+def root_disk():
+    st = os.statvfs("/")
+    total = st.f_blocks * st.f_frsize
+    used = (st.f_blocks - st.f_bfree) * st.f_frsize
+    available = st.f_bavail * st.f_frsize
+    # Like df: space reserved for root is neither used nor available, and Use% rounds up
+    usage = math.ceil(used * 100.0 / (used + available)) if used + available else 0
+    return {
+        "total_gb": total / GB,
+        "used_gb": used / GB,
+        "available_gb": available / GB,
+        "usage_percent": float(usage),
+    }
+
+
+def uptime_seconds():
+    try:
+        return float(read("/proc/uptime").split()[0])
+    except (IndexError, ValueError):
+        return 0.0
+
+
+def uptime_text():
+    """Same wording as `uptime -p`"""
+    minutes = int(uptime_seconds()) // 60
+    days, minutes = divmod(minutes, 1440)
+    hours, minutes = divmod(minutes, 60)
+    parts = []
+    for value, unit in ((days, "day"), (hours, "hour"), (minutes, "minute")):
+        if value or (unit == "minute" and not parts):
+            parts.append("{} {}{}".format(value, unit, "" if value == 1 else "s"))
+    return "up " + ", ".join(parts)
+
+
+def cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def op_metrics(args):
+    return {"proc": proc_counters(), "memory": memory(), "disk": root_disk(), "uptime": uptime_text()}
+
+
+def op_processes(args):
+    """Top processes by CPU, with %CPU and %MEM computed the way ps does"""
+    limit = int(args.get("limit", 10))
+    hz = os.sysconf("SC_CLK_TCK")
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    uptime = uptime_seconds()
+    total_memory = meminfo().get("MemTotal") or 1
+    users = {}
+    processes = []
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        stat = read("/proc/{}/stat".format(pid))
+        if not stat:
+            continue
+        # The command name may contain spaces; fields after ")" start at field 3 (state)
+        fields = stat[stat.rfind(")") + 2:].split()
+        try:
+            cpu_time = (int(fields[11]) + int(fields[12])) / hz
+            elapsed = uptime - int(fields[19]) / hz
+            rss = int(fields[21]) * page_size
+            uid = os.stat("/proc/" + pid).st_uid
+        except (IndexError, ValueError, OSError):
+            continue
+        if uid not in users:
+            try:
+                users[uid] = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                users[uid] = str(uid)
+        name = read("/proc/{}/cmdline".format(pid)).split("\0")[0] or stat[stat.find("(") + 1:stat.rfind(")")]
+        processes.append({
+            "pid": int(pid),
+            "cpu": round(cpu_time * 100.0 / elapsed, 1) if elapsed > 0 else 0.0,
+            "memory": round(rss * 100.0 / total_memory, 1),
+            "name": name,
+            "user": users[uid],
+        })
+    processes.sort(key=lambda p: p["cpu"], reverse=True)
+    return processes[:limit]
+
+
+def op_health(args):
+    try:
+        load_1 = float(read("/proc/loadavg").split()[0])
+    except (IndexError, ValueError):
+        load_1 = None
+    return {
+        "disk_usage": root_disk()["usage_percent"],
+        "mem_usage": round(memory()["usage_percent"], 1),
+        "load_avg": load_1,
+        "cores": cores(),
+    }
+
+
+def op_run(args):
+    """Run a shell command (used for service actions, which need systemctl/service anyway)"""
+    try:
+        process = subprocess.run(
+            ["sh", "-c", args["cmd"]],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            timeout=args.get("timeout"),
+        )
+    except subprocess.TimeoutExpired as e:
+        return {"exit_code": None, "stdout": (e.stdout or b"").decode(errors="replace"), "stderr": "", "timed_out": True}
+    return {
+        "exit_code": process.returncode,
+        "stdout": process.stdout.decode(errors="replace"),
+        "stderr": process.stderr.decode(errors="replace"),
+        "timed_out": False,
+    }
+
+
+def op_ping(args):
+    return {"version": VERSION, "pid": os.getpid()}
+
+
+OPS = {
+    "metrics": op_metrics,
+    "processes": op_processes,
+    "health": op_health,
+    "run": op_run,
+    "ping": op_ping,
+}
+
+
+def write(message):
+    sys.stdout.write(json.dumps(message) + "\n")
+    sys.stdout.flush()
+
+
+def main():
+    write({"hello": "server-monitoring-probe", "version": VERSION, "pid": os.getpid()})
+    for line in iter(sys.stdin.readline, ""):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            write({"id": None, "ok": False, "error": "invalid JSON request"})
+            continue
+        handler = OPS.get(request.get("op"))
+        if handler is None:
+            write({"id": request.get("id"), "ok": False, "error": "unknown op: {}".format(request.get("op"))})
+            continue
+        try:
+            result = handler(request.get("args") or {})
+        except Exception as e:
+            write({"id": request.get("id"), "ok": False, "error": "{}: {}".format(type(e).__name__, e)})
+            continue
+        write({"id": request.get("id"), "ok": True, "result": result})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Per-second rates from cumulative counters.
+
+/proc/stat, /proc/net/dev, /proc/diskstats and the Windows raw performance
+counters only ever count up since boot. The collector keeps the previous
+sample per host ("host:port") and turns the difference into per-second
+rates, so CPU% comes from one cheap read instead of a sampling `top -bn1`
+and network / disk I/O report throughput rather than totals since boot.
+
+The first sample for a host has nothing to compare against, so its rates are
+None. A changed boot id (the host rebooted) discards the previous sample.
+The counters are sums over CPUs, interfaces and disks, so one that goes
+backwards means an interface or device went away (or a counter was reset),
+not a wrap: its rate is None for that sample. Samples closer
+together than RATE_MIN_INTERVAL seconds reuse the last rates instead of
+dividing by a tiny interval.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+MIN_INTERVAL = float(os.getenv("RATE_MIN_INTERVAL", "1"))
+
+
+def counter_delta(previous: int, current: int) -> Optional[int]:
+    """Increase of a summed counter; None if it went down (a reset or a removed device)"""
+    if current >= previous:
+        return current - previous
+    return None
+
+
+class _Sample:
+    __slots__ = ("boot_id", "counters", "taken_at", "rates", "interval")
+
+    def __init__(self, boot_id, counters: dict, taken_at: float):
+        self.boot_id = boot_id
+        self.counters = counters
+        self.taken_at = taken_at
+        self.rates = None
+        self.interval = None
+
+
+class CounterRates:
+    """Keeps the last counter sample per host and computes rates against it"""
+
+    def __init__(self, min_interval: float = MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._samples: Dict[str, _Sample] = {}
+
+    def update(self, key: str, counters: Dict[str, int], boot_id=None, now: Optional[float] = None) -> Tuple[Optional[dict], Optional[float]]:
+        """Record a sample and return (per-second rates, interval in seconds)
+
+        Rates are None for the first sample of a host or after a reboot.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            previous = self._samples.get(key)
+            if previous is not None and previous.boot_id == boot_id:
+                elapsed = now - previous.taken_at
+                if elapsed < self.min_interval:
+                    return previous.rates, previous.interval
+                rates = {}
+                for name, value in counters.items():
+                    old = previous.counters.get(name)
+                    delta = counter_delta(old, value) if old is not None else None
+                    rates[name] = delta / elapsed if delta is not None else None
+            else:
+                rates, elapsed = None, None
+            sample = self._samples[key] = _Sample(boot_id, counters, now)
+            sample.rates, sample.interval = rates, elapsed
+            return rates, elapsed
+
+    def forget(self, key: str) -> None:
+        """Drop the stored sample for a host"""
+        with self._lock:
+            self._samples.pop(key, None)
+
+
+def busy_percent(rates: Optional[dict], idle: str = "cpu_idle", total: str = "cpu_total") -> Optional[float]:
+    """CPU% from the rates of an idle and a total time counter"""
+    if not rates or not rates.get(total) or rates.get(idle) is None:
+        return None
+    return max(0.0, min(100.0, 100.0 * (1 - rates[idle] / rates[total])))
+
+
+def rounded(rates: Optional[dict], name: str, digits: int = 1) -> Optional[float]:
+    """One rate rounded for display, or None if it is not known"""
+    value = rates.get(name) if rates else None
+    return round(value, digits) if value is not None else None
+
+
+def network_rates(rates: Optional[dict]) -> dict:
+    """Network throughput fields for the metrics payload"""
+    return {
+        "bytes_sent_per_sec": rounded(rates, "net_bytes_sent"),
+        "bytes_recv_per_sec": rounded(rates, "net_bytes_recv"),
+        "packets_sent_per_sec": rounded(rates, "net_packets_sent"),
+        "packets_recv_per_sec": rounded(rates, "net_packets_recv"),
+    }
+
+
+def disk_io_rates(rates: Optional[dict]) -> dict:
+    """Disk I/O throughput fields for the metrics payload"""
+    return {
+        "read_bytes_per_sec": rounded(rates, "disk_read_bytes"),
+        "write_bytes_per_sec": rounded(rates, "disk_write_bytes"),
+        "reads_per_sec": rounded(rates, "disk_reads"),
+        "writes_per_sec": rounded(rates, "disk_writes"),
+    }
+
+
+# Shared by the SSH and WinRM handlers
+counter_rates = CounterRates()
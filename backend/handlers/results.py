@@ -0,0 +1,57 @@
+"""
+Structured result of one remote command, shared by the SSH and WinRM handlers.
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+from .breaker import CircuitOpenError
+from .limits import HostBusyError
+from .timeouts import RemoteTimeout
+
+
+# The host was never asked: its circuit is open, its session slots are taken
+# or it did not answer in time. Collectors that fall back to empty values on
+# errors re-raise these so the route reports the host instead of zeros.
+HOST_UNAVAILABLE = (CircuitOpenError, HostBusyError, RemoteTimeout)
+
+
+@dataclass
+class CommandResult:
+    command: str
+    exit_code: Optional[int]
+    stdout: str = ""
+    stderr: str = ""
+    duration_ms: float = 0.0
+    bytes: int = 0
+    truncated: bool = False
+    timed_out: bool = False
+
+    @property
+    def ok(self) -> bool:
+        """True when the command ran to completion with exit status 0"""
+        return self.exit_code == 0
+
+    @property
+    def error_message(self) -> str:
+        """Best description of why the command failed"""
+        if self.timed_out:
+            return f"Command timed out after {self.duration_ms / 1000:.0f}s"
+        if self.stderr.strip():
+            return self.stderr.strip()
+        if self.exit_code is None:
+            return "Command did not complete"
+        return f"Command exited with code {self.exit_code}"
+
+    def to_dict(self) -> dict:
+        return {
+            "command": self.command,
+            "success": self.ok,
+            "exit_code": self.exit_code,
+            "stdout": self.stdout,
+            "stderr": self.stderr,
+            "duration_ms": self.duration_ms,
+            "bytes": self.bytes,
+            "truncated": self.truncated,
+            "timed_out": self.timed_out,
+        }
@@ -0,0 +1,80 @@
+"""
+Connect, authentication and command timeouts for remote calls.
+
+Global defaults come from the environment; a server can override them with
+its connect_timeout / auth_timeout / command_timeout columns and a single
+request can override the command timeout. Metrics collection is capped at
+REMOTE_METRICS_TIMEOUT (unless the request sets its own timeout) so a
+dashboard refresh never waits on the much longer budget allowed for
+maintenance commands.
+"""
+
+import os
+from dataclasses import dataclass, replace
+from typing import Optional
+
+
+CONNECT_TIMEOUT = float(os.getenv("REMOTE_CONNECT_TIMEOUT", "10"))
+AUTH_TIMEOUT = float(os.getenv("REMOTE_AUTH_TIMEOUT", "15"))
+COMMAND_TIMEOUT = float(os.getenv("REMOTE_COMMAND_TIMEOUT", "300"))
+METRICS_TIMEOUT = float(os.getenv("REMOTE_METRICS_TIMEOUT", "30"))
+
+# Upper bound for any configured or requested timeout
+MAX_TIMEOUT = 3600.0
+
+
+class RemoteTimeout(Exception):
+    """A connect, authentication or command phase ran out of time"""
+
+    def __init__(self, phase: str, seconds: float, endpoint: str = ""):
+        what = {
+            "connect": f"Connecting to {endpoint}",
+            "auth": f"Authenticating with {endpoint}",
+        }.get(phase, "Command")
+        super().__init__(f"{what} timed out after {seconds:g}s")
+        self.phase = phase
+        self.seconds = seconds
+
+    def to_dict(self) -> dict:
+        return {"phase": self.phase, "seconds": self.seconds}
+
+
+@dataclass(frozen=True)
+class Timeouts:
+    connect: float = CONNECT_TIMEOUT
+    auth: float = AUTH_TIMEOUT
+    command: float = COMMAND_TIMEOUT
+    metrics: float = METRICS_TIMEOUT
+
+    def with_command(self, seconds: float) -> "Timeouts":
+        """Copy with a different command timeout (also used for metrics collection)"""
+        return replace(self, command=seconds, metrics=seconds)
+
+    def for_metrics(self) -> "Timeouts":
+        """Copy whose command timeout is the metrics budget"""
+        return replace(self, command=min(self.command, self.metrics))
+
+    def to_dict(self) -> dict:
+        return {"connect": self.connect, "auth": self.auth, "command": self.command, "metrics": self.metrics}
+
+
+def parse_timeout(value, field: str = "timeout") -> Optional[float]:
+    """Validate a timeout in seconds from a request (None/empty means "not set")"""
+    if value is None or value == "":
+        return None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a number of seconds")
+    if not 0 < seconds <= MAX_TIMEOUT:
+        raise ValueError(f"{field} must be between 0 and {MAX_TIMEOUT:g} seconds")
+    return seconds
+
+
+def server_timeouts(server) -> Timeouts:
+    """Effective timeouts for a stored server (its own settings, else the global defaults)"""
+    return Timeouts(
+        connect=getattr(server, "connect_timeout", None) or CONNECT_TIMEOUT,
+        auth=getattr(server, "auth_timeout", None) or AUTH_TIMEOUT,
+        command=getattr(server, "command_timeout", None) or COMMAND_TIMEOUT,
+    )
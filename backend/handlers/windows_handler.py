@@ -6,60 +6,112 @@ except ImportError:
     class WinRMTransportError(Exception):
         pass
 from typing import Optional
+import base64
 import time
+from contextlib import contextmanager
 from datetime import datetime
 
+from .breaker import host_breaker
+from .limits import host_limiter
+from .rates import busy_percent, counter_rates, disk_io_rates, network_rates
+from .results import HOST_UNAVAILABLE, CommandResult
+from .timeouts import RemoteTimeout, Timeouts
 
-def run_winrm_command(host: str, username: str, password: str, cmd: str, port: int = 5985, use_ps: bool = False):
-    """Execute WinRM command using either CMD or PowerShell
-    
-    Tries multiple authentication methods and username formats for better compatibility.
-    """
+
+def _wsman_url(host: str, port: int) -> str:
+    """Build the WS-Management endpoint URL for a host"""
     protocol = "https" if port == 5986 else "http"
-    url = f"{protocol}://{host}:{port}/wsman"
-    
-    # Try different authentication methods and username formats
-    # Note: Only try username format variations if username doesn't already contain domain/computer
-    auth_configs = []
-    
+    return f"{protocol}://{host}:{port}/wsman"
+
+
+def _auth_configs(host: str, username: str) -> list:
+    """Authentication methods and username formats to try, in order"""
     # If username already has domain/computer (contains \), just try as-is
     if "\\" in username:
-        auth_configs = [
+        return [
             {"transport": "ntlm", "username": username},
         ]
-    else:
-        # Try different username formats for local accounts
-        auth_configs = [
-            # Try NTLM with original username
-            {"transport": "ntlm", "username": username},
-            # Try NTLM with .\username (local account format)
-            {"transport": "ntlm", "username": f".\\{username}"},
-            # Try NTLM with hostname\username
-            {"transport": "ntlm", "username": f"{host}\\{username}"},
-        ]
+    # Try different username formats for local accounts
+    return [
+        # Try NTLM with original username
+        {"transport": "ntlm", "username": username},
+        # Try NTLM with .\username (local account format)
+        {"transport": "ntlm", "username": f".\\{username}"},
+        # Try NTLM with hostname\username
+        {"transport": "ntlm", "username": f"{host}\\{username}"},
+    ]
+
+
+def _new_session(url: str, auth_config: dict, password: str, timeouts: Timeouts):
+    """Create a winrm.Session whose HTTP requests honour the configured timeouts
+
+    Each Receive request long-polls for up to operation_timeout_sec, so the
+    HTTP read timeout is that plus the connect timeout (WinRM authenticates
+    inside those same requests). A command deadline is therefore enforced
+    with a granularity of one operation timeout.
+    """
+    operation_timeout = max(1, int(min(20, timeouts.command)))
+    return winrm.Session(
+        url,
+        auth=(auth_config["username"], password),
+        transport=auth_config["transport"],
+        operation_timeout_sec=operation_timeout,
+        read_timeout_sec=operation_timeout + max(1, int(timeouts.connect)),
+    )
+
+
+def _is_network_error(exc: Exception) -> bool:
+    """True for the "host unreachable" errors raised by run_winrm/_open_winrm_shell"""
+    return str(exc).startswith("Network error")
+
+
+def _looks_like_powershell(command: str) -> bool:
+    """Guess whether an ad-hoc command is PowerShell rather than CMD"""
+    return command.strip().startswith('$') or 'Get-' in command or 'Set-' in command or 'New-' in command
+
+
+def run_winrm(host: str, username: str, password: str, cmd: str, port: int = 5985, use_ps: bool = False, timeouts: Optional[Timeouts] = None) -> CommandResult:
+    """Execute WinRM command using either CMD or PowerShell and return its structured result
     
+    Tries multiple authentication methods and username formats for better compatibility.
+    Connection and authentication errors raise; a command that runs but fails is
+    reported through CommandResult.exit_code (and is never re-run with another
+    username format). Holds one of the host's session slots while running, and
+    fails fast with CircuitOpenError while the host's circuit is open.
+    """
+    endpoint = f"{host}:{port}"
+    host_breaker.before_call(endpoint)
+    with host_limiter.slot(endpoint):
+        try:
+            result = _run_winrm(host, username, password, cmd, port, use_ps, timeouts=timeouts)
+        except Exception as e:
+            if _is_network_error(e):
+                host_breaker.record_failure(endpoint, e)
+            else:
+                host_breaker.record_success(endpoint)
+            raise
+        host_breaker.record_success(endpoint)
+        return result
+
+
+def _run_winrm(host: str, username: str, password: str, cmd: str, port: int = 5985, use_ps: bool = False, timeouts: Optional[Timeouts] = None) -> CommandResult:
+    timeouts = timeouts or Timeouts()
+    url = _wsman_url(host, port)
+    auth_configs = _auth_configs(host, username)
+
     last_error = None
     for auth_config in auth_configs:
         try:
-            session = winrm.Session(url, auth=(auth_config["username"], password), transport=auth_config["transport"])
-            
-            if use_ps:
-                r = session.run_ps(cmd)
-            else:
-                r = session.run_cmd(cmd)
-            
-            out = r.std_out.decode('utf-8', errors='ignore') if r.std_out else ""
-            err = r.std_err.decode('utf-8', errors='ignore') if r.std_err else ""
-            
-            # Check exit code
-            if r.status_code != 0:
-                error_msg = err if err else f"Command failed with exit code {r.status_code}"
-                raise Exception(f"WinRM command failed: {error_msg}")
+            session = _new_session(url, auth_config, password, timeouts)
             
-            if err and not out:
-                raise Exception(f"WinRM command failed: {err}")
-            
-            return out, err
+            shell_id = session.protocol.open_shell()
+            try:
+                return _run_in_shell(session, shell_id, cmd, use_ps, timeouts.command)
+            finally:
+                try:
+                    session.protocol.close_shell(shell_id)
+                except Exception:
+                    pass
             
         except WinRMTransportError as e:
             error_msg = str(e).lower()
@@ -133,11 +185,204 @@ def run_winrm_command(host: str, username: str, password: str, cmd: str, port: i
         raise Exception("Failed to establish WinRM connection")
 
 
-def test_connection(host: str, username: str, password: str, port: int = 5985) -> tuple[bool, str]:
+def run_winrm_command(host: str, username: str, password: str, cmd: str, port: int = 5985, use_ps: bool = False, timeouts: Optional[Timeouts] = None):
+    """Execute WinRM command using either CMD or PowerShell
+    
+    Returns (stdout, stderr); raises if the command exits with a non-zero status and
+    RemoteTimeout if it runs past the command timeout.
+    """
+    timeouts = timeouts or Timeouts()
+    result = run_winrm(host, username, password, cmd, port, use_ps, timeouts=timeouts)
+    if result.timed_out:
+        raise RemoteTimeout("command", timeouts.command)
+    
+    # Check exit code
+    if not result.ok:
+        raise Exception(f"WinRM command failed: {result.error_message}")
+    
+    if result.stderr and not result.stdout:
+        raise Exception(f"WinRM command failed: {result.stderr}")
+    
+    return result.stdout, result.stderr
+
+
+def _open_winrm_shell(host: str, username: str, password: str, port: int = 5985, timeouts: Optional[Timeouts] = None):
+    """Open one remote shell, trying each authentication config. Returns (session, shell_id)"""
+    timeouts = timeouts or Timeouts()
+    url = _wsman_url(host, port)
+    last_error = None
+    for auth_config in _auth_configs(host, username):
+        session = _new_session(url, auth_config, password, timeouts)
+        try:
+            return session, session.protocol.open_shell()
+        except Exception as e:
+            last_error = e
+            error_msg = str(e).lower()
+            # Network errors won't be fixed by another username format
+            if "connection" in error_msg or "refused" in error_msg or "timeout" in error_msg or "network" in error_msg:
+                raise Exception(
+                    f"Network error: Unable to connect to {host}:{port}.\n"
+                    f"Check WinRM service, firewall, and network connectivity."
+                )
+    raise Exception(f"All authentication methods failed. Last error: {str(last_error)}")
+
+
+@contextmanager
+def _winrm_shell(host: str, username: str, password: str, port: int = 5985, timeouts: Optional[Timeouts] = None):
+    """Open a shell while holding one of the host's session slots (see limits.host_limiter)"""
+    endpoint = f"{host}:{port}"
+    host_breaker.before_call(endpoint)
+    with host_limiter.slot(endpoint):
+        try:
+            session, shell_id = _open_winrm_shell(host, username, password, port, timeouts=timeouts)
+        except Exception as e:
+            if _is_network_error(e):
+                host_breaker.record_failure(endpoint, e)
+            else:
+                host_breaker.record_success(endpoint)
+            raise
+        host_breaker.record_success(endpoint)
+        try:
+            yield session, shell_id
+        finally:
+            try:
+                session.protocol.close_shell(shell_id)
+            except Exception:
+                pass
+
+
+def _start_command(protocol, shell_id: str, command: str, use_ps: bool) -> str:
+    """Start a command in an open shell, returning its command id"""
+    if use_ps:
+        # Same encoding winrm.Session.run_ps uses
+        encoded_ps = base64.b64encode(command.encode('utf_16_le')).decode('ascii')
+        return protocol.run_command(shell_id, f"powershell -encodedcommand {encoded_ps}")
+    return protocol.run_command(shell_id, command)
+
+
+def _iter_command_output(protocol, shell_id: str, command_id: str, max_bytes: Optional[int] = None, cancel_event=None, timeout: Optional[float] = None):
+    """Receive a running command's output, yielding events as each Receive round trip returns
+
+    Yields ("stdout", bytes), ("stderr", bytes) and finally one
+    ("exit", {"exit_code", "bytes", "truncated", "cancelled", "timed_out"}),
+    matching linux_handler.iter_channel_output. The caller cleans up the command.
+    """
+    from winrm.exceptions import WinRMOperationTimeoutError
+
+    total = 0
+    truncated = cancelled = timed_out = False
+    exit_code = None
+    deadline = time.monotonic() + timeout if timeout else None
+
+    command_done = False
+    while not command_done:
+        if cancel_event is not None and cancel_event.is_set():
+            cancelled = True
+            break
+        if deadline is not None and time.monotonic() > deadline:
+            timed_out = True
+            break
+        try:
+            std_out, std_err, return_code, command_done = protocol._raw_get_command_output(shell_id, command_id)
+        except WinRMOperationTimeoutError:
+            # No output within the operation timeout - the command is still running
+            continue
+        if std_out:
+            total += len(std_out)
+            yield "stdout", std_out
+        if std_err:
+            total += len(std_err)
+            yield "stderr", std_err
+        if max_bytes is not None and total > max_bytes:
+            truncated = True
+            break
+        if command_done:
+            exit_code = return_code
+
+    yield "exit", {"exit_code": exit_code, "bytes": total, "truncated": truncated, "cancelled": cancelled, "timed_out": timed_out}
+
+
+def _run_in_shell(session, shell_id: str, command: str, use_ps: bool, timeout: Optional[float] = None) -> CommandResult:
+    """Run one command to completion (or timeout) in an open shell"""
+    protocol = session.protocol
+    started = time.monotonic()
+    command_id = _start_command(protocol, shell_id, command, use_ps)
+    out, err, status = [], [], {}
+    try:
+        for kind, data in _iter_command_output(protocol, shell_id, command_id, timeout=timeout):
+            if kind == "stdout":
+                out.append(data)
+            elif kind == "stderr":
+                err.append(data)
+            else:
+                status = data
+    finally:
+        # Terminating the command also stops it when it timed out
+        try:
+            protocol.cleanup_command(shell_id, command_id)
+        except Exception:
+            pass
+
+    std_out, std_err = b"".join(out), b"".join(err)
+    if use_ps and std_err:
+        # Turn CLIXML error streams into readable text
+        std_err = session._clean_error_msg(std_err)
+    return CommandResult(
+        command=command,
+        exit_code=status.get("exit_code"),
+        stdout=std_out.decode('utf-8', errors='ignore'),
+        stderr=std_err.decode('utf-8', errors='ignore'),
+        duration_ms=round((time.monotonic() - started) * 1000, 1),
+        bytes=status.get("bytes", 0),
+        timed_out=status.get("timed_out", False),
+    )
+
+
+def run_winrm_batch(host: str, username: str, password: str, commands: list, port: int = 5985, timeouts: Optional[Timeouts] = None) -> list:
+    """Run several commands in one WinRM shell, returning per-command output, exit code and timing
+
+    The command timeout applies to each command separately.
+    """
+    timeouts = timeouts or Timeouts()
+    results = []
+
+    with _winrm_shell(host, username, password, port, timeouts=timeouts) as (session, shell_id):
+        for command in commands:
+            started = time.monotonic()
+            try:
+                results.append(_run_in_shell(session, shell_id, command, _looks_like_powershell(command), timeouts.command).to_dict())
+            except Exception as e:
+                results.append(CommandResult(
+                    command=command,
+                    exit_code=None,
+                    stderr=str(e),
+                    duration_ms=round((time.monotonic() - started) * 1000, 1),
+                ).to_dict())
+
+    return results
+
+
+def stream_winrm_command(host: str, username: str, password: str, command: str, port: int = 5985, max_bytes: Optional[int] = None, cancel_event=None, timeouts: Optional[Timeouts] = None):
+    """Run a command and yield its output incrementally (see _iter_command_output)"""
+    timeouts = timeouts or Timeouts()
+    with _winrm_shell(host, username, password, port, timeouts=timeouts) as (session, shell_id):
+        protocol = session.protocol
+        command_id = _start_command(protocol, shell_id, command, _looks_like_powershell(command))
+        try:
+            yield from _iter_command_output(protocol, shell_id, command_id, max_bytes, cancel_event, timeouts.command)
+        finally:
+            # Terminating the command also stops it when we bail out early
+            try:
+                protocol.cleanup_command(shell_id, command_id)
+            except Exception:
+                pass
+
+
+def test_connection(host: str, username: str, password: str, port: int = 5985, timeouts: Optional[Timeouts] = None) -> tuple[bool, str]:
     """Test WinRM connection to server. Returns (success, message)"""
     try:
         # Try a simple PowerShell command to test connection
-        result, err = run_winrm_command(host, username, password, "Write-Output 'connection_test'", port, use_ps=True)
+        result, err = run_winrm_command(host, username, password, "Write-Output 'connection_test'", port, use_ps=True, timeouts=timeouts)
         if "connection_test" in result:
             return True, "Connection successful"
         return False, "Connection test failed: unexpected response"
@@ -148,37 +393,77 @@ def test_connection(host: str, username: str, password: str, port: int = 5985) -
         return False, error_msg
 
 
-def get_basic_metrics(host: str, username: str, password: str, port: int = 5985) -> dict:
+# Raw (cumulative) performance counters; the formatted CPU value is only used
+# until there is a previous sample to diff against
+_PERF_COUNTERS_SCRIPT = """
+$cpuRaw = Get-CimInstance Win32_PerfRawData_PerfOS_Processor -Filter "Name='_Total'"
+$cpuNow = Get-CimInstance Win32_PerfFormattedData_PerfOS_Processor -Filter "Name='_Total'"
+$cores = (Get-CimInstance Win32_Processor | Measure-Object -Property NumberOfLogicalProcessors -Sum).Sum
+$adapters = Get-NetAdapterStatistics -ErrorAction SilentlyContinue
+$rx = ($adapters | Measure-Object -Property ReceivedBytes -Sum).Sum
+$tx = ($adapters | Measure-Object -Property SentBytes -Sum).Sum
+$rxPackets = ($adapters | Measure-Object -Property ReceivedUnicastPackets -Sum).Sum
+$txPackets = ($adapters | Measure-Object -Property SentUnicastPackets -Sum).Sum
+$disk = Get-CimInstance Win32_PerfRawData_PerfDisk_PhysicalDisk -Filter "Name='_Total'"
+$boot = (Get-CimInstance Win32_OperatingSystem).LastBootUpTime.ToString('yyyy-MM-dd HH:mm:ss')
+Write-Output "$($cpuNow.PercentProcessorTime)|$cores|$($cpuRaw.PercentIdleTime)|$($cpuRaw.Timestamp_Sys100NS)|$rx|$tx|$rxPackets|$txPackets|$($disk.DiskReadsPersec)|$($disk.DiskWritesPersec)|$($disk.DiskReadBytesPersec)|$($disk.DiskWriteBytesPersec)|$boot"
+"""
+
+_PERF_COUNTER_FIELDS = (
+    "cpu_idle", "cpu_total",
+    "net_bytes_recv", "net_bytes_sent", "net_packets_recv", "net_packets_sent",
+    "disk_reads", "disk_writes", "disk_read_bytes", "disk_write_bytes",
+)
+
+
+def _parse_perf_counters(output: str) -> dict:
+    """Parse the output of _PERF_COUNTERS_SCRIPT into cumulative counters"""
+    parts = output.strip().split('|')
+    parts += [''] * (2 + len(_PERF_COUNTER_FIELDS) + 1 - len(parts))
+    
+    def number(value: str, cast=int):
+        try:
+            return cast(float(value)) if value else cast(0)
+        except ValueError:
+            return cast(0)
+    
+    return {
+        "cpu_percent": number(parts[0], float),
+        "cores": number(parts[1]) or 1,
+        # PercentIdleTime and Timestamp_Sys100NS are both in 100ns ticks
+        "counters": {name: number(value) for name, value in zip(_PERF_COUNTER_FIELDS, parts[2:])},
+        "boot_id": parts[2 + len(_PERF_COUNTER_FIELDS)].strip() or None,
+    }
+
+
+def get_basic_metrics(host: str, username: str, password: str, port: int = 5985, timeouts: Optional[Timeouts] = None) -> dict:
     """Get basic server metrics via WinRM and return structured data matching Linux format"""
     import re
     
     # Get hostname
     hostname_cmd = "$env:COMPUTERNAME"
     try:
-        hostname_output, _ = run_winrm_command(host, username, password, hostname_cmd, port, use_ps=True)
+        hostname_output, _ = run_winrm_command(host, username, password, hostname_cmd, port, use_ps=True, timeouts=timeouts)
         hostname = hostname_output.strip() if hostname_output.strip() else host
+    except HOST_UNAVAILABLE:
+        raise
     except:
         hostname = host
     
-    # Get CPU usage and cores
-    cpu_cmd = """
-    $cpu = Get-Counter '\\Processor(_Total)\\% Processor Time' -ErrorAction SilentlyContinue
-    if ($cpu) {
-        $cpuUsage = [math]::Round($cpu.CounterSamples.CookedValue, 1)
-    } else {
-        $cpuUsage = 0
-    }
-    $cores = (Get-CimInstance Win32_Processor | Measure-Object -Property NumberOfLogicalProcessors -Sum).Sum
-    Write-Output "$cpuUsage|$cores"
-    """
+    # CPU, network and disk I/O counters in one call; rates come from the previous sample
     try:
-        cpu_output, _ = run_winrm_command(host, username, password, cpu_cmd, port, use_ps=True)
-        cpu_parts = cpu_output.strip().split('|')
-        cpu_usage = float(cpu_parts[0]) if len(cpu_parts) > 0 and cpu_parts[0] else 0.0
-        cpu_cores = int(cpu_parts[1]) if len(cpu_parts) > 1 and cpu_parts[1] else 1
-    except:
-        cpu_usage = 0.0
-        cpu_cores = 1
+        counters_output, _ = run_winrm_command(host, username, password, _PERF_COUNTERS_SCRIPT, port, use_ps=True, timeouts=timeouts)
+        perf = _parse_perf_counters(counters_output)
+    except HOST_UNAVAILABLE:
+        raise
+    except Exception:
+        perf = _parse_perf_counters("")
+    rates, interval = counter_rates.update(f"{host}:{port}", perf["counters"], boot_id=perf["boot_id"]) if perf["boot_id"] else (None, None)
+    
+    cpu_usage = busy_percent(rates)
+    if cpu_usage is None:
+        cpu_usage = perf["cpu_percent"]
+    cpu_cores = perf["cores"]
     
     # Get load average (Windows doesn't have load average, use CPU usage as approximation)
     load_avg = [cpu_usage / 100.0, cpu_usage / 100.0, cpu_usage / 100.0]
@@ -193,12 +478,14 @@ def get_basic_metrics(host: str, username: str, password: str, port: int = 5985)
     Write-Output "$total|$used|$free|$usage"
     """
     try:
-        mem_output, _ = run_winrm_command(host, username, password, mem_cmd, port, use_ps=True)
+        mem_output, _ = run_winrm_command(host, username, password, mem_cmd, port, use_ps=True, timeouts=timeouts)
         mem_parts = mem_output.strip().split('|')
         total_mem_gb = float(mem_parts[0]) if len(mem_parts) > 0 and mem_parts[0] else 0.0
         used_mem_gb = float(mem_parts[1]) if len(mem_parts) > 1 and mem_parts[1] else 0.0
         available_mem_gb = float(mem_parts[2]) if len(mem_parts) > 2 and mem_parts[2] else 0.0
         memory_usage = float(mem_parts[3]) if len(mem_parts) > 3 and mem_parts[3] else 0.0
+    except HOST_UNAVAILABLE:
+        raise
     except:
         total_mem_gb = 0.0
         used_mem_gb = 0.0
@@ -219,12 +506,14 @@ def get_basic_metrics(host: str, username: str, password: str, port: int = 5985)
     }
     """
     try:
-        disk_output, _ = run_winrm_command(host, username, password, disk_cmd, port, use_ps=True)
+        disk_output, _ = run_winrm_command(host, username, password, disk_cmd, port, use_ps=True, timeouts=timeouts)
         disk_parts = disk_output.strip().split('|')
         total_disk_gb = float(disk_parts[0]) if len(disk_parts) > 0 and disk_parts[0] else 0.0
         used_disk_gb = float(disk_parts[1]) if len(disk_parts) > 1 and disk_parts[1] else 0.0
         available_disk_gb = float(disk_parts[2]) if len(disk_parts) > 2 and disk_parts[2] else 0.0
         disk_usage = float(disk_parts[3]) if len(disk_parts) > 3 and disk_parts[3] else 0.0
+    except HOST_UNAVAILABLE:
+        raise
     except:
         total_disk_gb = 0.0
         used_disk_gb = 0.0
@@ -242,33 +531,13 @@ def get_basic_metrics(host: str, username: str, password: str, port: int = 5985)
     Write-Output "up $days days, $hours hours, $minutes minutes"
     """
     try:
-        uptime_output, _ = run_winrm_command(host, username, password, uptime_cmd, port, use_ps=True)
+        uptime_output, _ = run_winrm_command(host, username, password, uptime_cmd, port, use_ps=True, timeouts=timeouts)
         uptime_text = uptime_output.strip() if uptime_output.strip() else "N/A"
+    except HOST_UNAVAILABLE:
+        raise
     except:
         uptime_text = "N/A"
     
-    # Get network stats
-    network_cmd = """
-    $adapters = Get-NetAdapterStatistics | Where-Object { $_.LinkSpeed -gt 0 }
-    $totalRx = ($adapters | Measure-Object -Property ReceivedBytes -Sum).Sum
-    $totalTx = ($adapters | Measure-Object -Property SentBytes -Sum).Sum
-    $totalRxPackets = ($adapters | Measure-Object -Property ReceivedPackets -Sum).Sum
-    $totalTxPackets = ($adapters | Measure-Object -Property SentPackets -Sum).Sum
-    Write-Output "$totalRx|$totalTx|$totalRxPackets|$totalTxPackets"
-    """
-    try:
-        network_output, _ = run_winrm_command(host, username, password, network_cmd, port, use_ps=True)
-        network_parts = network_output.strip().split('|')
-        bytes_recv = int(float(network_parts[0])) if len(network_parts) > 0 and network_parts[0] else 0
-        bytes_sent = int(float(network_parts[1])) if len(network_parts) > 1 and network_parts[1] else 0
-        packets_recv = int(float(network_parts[2])) if len(network_parts) > 2 and network_parts[2] else 0
-        packets_sent = int(float(network_parts[3])) if len(network_parts) > 3 and network_parts[3] else 0
-    except:
-        bytes_recv = 0
-        bytes_sent = 0
-        packets_recv = 0
-        packets_sent = 0
-    
     return {
         "server_id": None,  # Will be set by the route
         "hostname": hostname,
@@ -290,22 +559,25 @@ def get_basic_metrics(host: str, username: str, password: str, port: int = 5985)
             "used_gb": round(used_disk_gb, 2),
             "available_gb": round(available_disk_gb, 2),
             "usage_percent": round(disk_usage, 1),
-            "mount_point": "C:"
+            "mount_point": "C:",
+            "io": disk_io_rates(rates)
         },
         "network": {
-            "bytes_sent": bytes_sent,
-            "bytes_recv": bytes_recv,
-            "packets_sent": packets_sent,
-            "packets_recv": packets_recv,
+            "bytes_sent": perf["counters"]["net_bytes_sent"],
+            "bytes_recv": perf["counters"]["net_bytes_recv"],
+            "packets_sent": perf["counters"]["net_packets_sent"],
+            "packets_recv": perf["counters"]["net_packets_recv"],
+            **network_rates(rates),
             "interfaces": []
         },
+        "rate_interval": round(interval, 1) if interval else None,
         "uptime": {
             "text": uptime_text
         }
     }
 
 
-def get_top_processes(host: str, username: str, password: str, port: int = 5985, limit: int = 10) -> list:
+def get_top_processes(host: str, username: str, password: str, port: int = 5985, limit: int = 10, timeouts: Optional[Timeouts] = None) -> list:
     """Get top processes by CPU and Memory usage"""
     cmd = f"""
     Get-Process | Sort-Object CPU -Descending | Select-Object -First {limit} | ForEach-Object {{
@@ -323,7 +595,7 @@ def get_top_processes(host: str, username: str, password: str, port: int = 5985,
     }} | ConvertTo-Json
     """
     try:
-        output, _ = run_winrm_command(host, username, password, cmd, port, use_ps=True)
+        output, _ = run_winrm_command(host, username, password, cmd, port, use_ps=True, timeouts=timeouts)
         import json
         processes = json.loads(output) if output.strip() else []
         if not isinstance(processes, list):
@@ -339,11 +611,13 @@ def get_top_processes(host: str, username: str, password: str, port: int = 5985,
                 "user": proc.get("User", "unknown")
             })
         return result
+    except HOST_UNAVAILABLE:
+        raise
     except Exception as e:
         # Fallback to simpler command
         try:
             cmd = f"Get-Process | Sort-Object CPU -Descending | Select-Object -First {limit} | Select-Object Id, CPU, @{{Name='MemoryMB';Expression={{[math]::Round($_.WorkingSet64/1MB,2)}}}}, ProcessName | ConvertTo-Json"
-            output, _ = run_winrm_command(host, username, password, cmd, port, use_ps=True)
+            output, _ = run_winrm_command(host, username, password, cmd, port, use_ps=True, timeouts=timeouts)
             import json
             processes = json.loads(output) if output.strip() else []
             if not isinstance(processes, list):
@@ -359,11 +633,13 @@ def get_top_processes(host: str, username: str, password: str, port: int = 5985,
                     "user": "N/A"
                 })
             return result
+        except HOST_UNAVAILABLE:
+            raise
         except:
             return []
 
 
-def get_network_interfaces(host: str, username: str, password: str, port: int = 5985) -> list:
+def get_network_interfaces(host: str, username: str, password: str, port: int = 5985, timeouts: Optional[Timeouts] = None) -> list:
     """Get detailed network interface statistics"""
     cmd = """
     Get-NetAdapterStatistics | Where-Object { $_.LinkSpeed -gt 0 } | ForEach-Object {
@@ -381,7 +657,7 @@ def get_network_interfaces(host: str, username: str, password: str, port: int =
     } | ConvertTo-Json
     """
     try:
-        output, _ = run_winrm_command(host, username, password, cmd, port, use_ps=True)
+        output, _ = run_winrm_command(host, username, password, cmd, port, use_ps=True, timeouts=timeouts)
         import json
         interfaces = json.loads(output) if output.strip() else []
         if not isinstance(interfaces, list):
@@ -398,11 +674,13 @@ def get_network_interfaces(host: str, username: str, password: str, port: int =
                 "tx_packets": int(iface.get("TxPackets", 0))
             })
         return result
+    except HOST_UNAVAILABLE:
+        raise
     except:
         return []
 
 
-def get_disk_partitions(host: str, username: str, password: str, port: int = 5985) -> list:
+def get_disk_partitions(host: str, username: str, password: str, port: int = 5985, timeouts: Optional[Timeouts] = None) -> list:
     """Get all disk partitions and mount points"""
     cmd = """
     Get-CimInstance Win32_LogicalDisk | ForEach-Object {
@@ -422,7 +700,7 @@ def get_disk_partitions(host: str, username: str, password: str, port: int = 598
     } | ConvertTo-Json
     """
     try:
-        output, _ = run_winrm_command(host, username, password, cmd, port, use_ps=True)
+        output, _ = run_winrm_command(host, username, password, cmd, port, use_ps=True, timeouts=timeouts)
         import json
         partitions = json.loads(output) if output.strip() else []
         if not isinstance(partitions, list):
@@ -439,11 +717,23 @@ def get_disk_partitions(host: str, username: str, password: str, port: int = 598
                 "mount": part.get("Mount", part.get("DeviceID", "unknown"))
             })
         return result
+    except HOST_UNAVAILABLE:
+        raise
     except:
         return []
 
 
-def get_system_info(host: str, username: str, password: str, port: int = 5985) -> dict:
+def get_boot_time(host: str, username: str, password: str, port: int = 5985, timeouts: Optional[Timeouts] = None) -> Optional[str]:
+    """Boot time as "yyyy-MM-dd HH:mm:ss" (cheap check used to detect reboots)"""
+    cmd = '(Get-CimInstance Win32_OperatingSystem -Property LastBootUpTime).LastBootUpTime.ToString("yyyy-MM-dd HH:mm:ss")'
+    try:
+        output, _ = run_winrm_command(host, username, password, cmd, port, use_ps=True, timeouts=timeouts)
+    except Exception:
+        return None
+    return output.strip() or None
+
+
+def get_system_info(host: str, username: str, password: str, port: int = 5985, timeouts: Optional[Timeouts] = None) -> dict:
     """Get system information (OS, hostname, uptime, etc.)"""
     cmd = """
     $os = Get-CimInstance Win32_OperatingSystem
@@ -461,7 +751,7 @@ def get_system_info(host: str, username: str, password: str, port: int = 5985) -
     } | ConvertTo-Json
     """
     try:
-        output, _ = run_winrm_command(host, username, password, cmd, port, use_ps=True)
+        output, _ = run_winrm_command(host, username, password, cmd, port, use_ps=True, timeouts=timeouts)
         import json
         info = json.loads(output) if output.strip() else {}
         
@@ -482,227 +772,201 @@ def get_system_info(host: str, username: str, password: str, port: int = 5985) -
         }
 
 
-def get_detailed_metrics(host: str, username: str, password: str, port: int = 5985) -> dict:
-    """Get detailed metrics including top processes, network interfaces, disk partitions, and system info"""
-    return {
-        "top_processes": get_top_processes(host, username, password, port),
-        "network_interfaces": get_network_interfaces(host, username, password, port),
-        "disk_partitions": get_disk_partitions(host, username, password, port),
-        "system_info": get_system_info(host, username, password, port)
+def get_detailed_metrics(host: str, username: str, password: str, port: int = 5985, timeouts: Optional[Timeouts] = None, include_system_info: bool = True) -> dict:
+    """Get detailed metrics including top processes, network interfaces, disk partitions, and system info
+    
+    With include_system_info=False system_info is left out so the caller can
+    serve it from the stored inventory.
+    """
+    metrics = {
+        "top_processes": get_top_processes(host, username, password, port, timeouts=timeouts),
+        "network_interfaces": get_network_interfaces(host, username, password, port, timeouts=timeouts),
+        "disk_partitions": get_disk_partitions(host, username, password, port, timeouts=timeouts),
     }
+    if include_system_info:
+        metrics["system_info"] = get_system_info(host, username, password, port, timeouts=timeouts)
+    return metrics
 
 
-def execute_command(host: str, username: str, password: str, command: str, port: int = 5985) -> dict:
+def execute_command(host: str, username: str, password: str, command: str, port: int = 5985, timeouts: Optional[Timeouts] = None) -> dict:
     """Execute an arbitrary command on the remote server and return output"""
     try:
         # Try PowerShell first, fallback to CMD
-        use_ps = command.strip().startswith('$') or 'Get-' in command or 'Set-' in command or 'New-' in command
-        output, err = run_winrm_command(host, username, password, command, port, use_ps=use_ps)
-        
-        if err and not output:
-            return {"success": False, "output": None, "error": err}
-        
-        return {"success": True, "output": output, "error": err if err else None}
+        use_ps = _looks_like_powershell(command)
+        result = run_winrm(host, username, password, command, port, use_ps=use_ps, timeouts=timeouts)
+    except HOST_UNAVAILABLE:
+        # The route answers 503/504 for these
+        raise
     except Exception as e:
-        return {"success": False, "output": None, "error": str(e)}
+        return {"success": False, "output": None, "error": str(e), "exit_code": None, "timed_out": False}
+    
+    return {
+        "success": result.ok,
+        "output": result.stdout,
+        "error": (result.stderr or None) if result.ok else result.error_message,
+        "exit_code": result.exit_code,
+        "duration_ms": result.duration_ms,
+        "timed_out": result.timed_out,
+    }
 
 
-def restart_service(host: str, username: str, password: str, service_name: str, port: int = 5985) -> dict:
-    """Restart a Windows service"""
+_SERVICE_CMDLETS = {"start": "Start-Service", "stop": "Stop-Service", "restart": "Restart-Service"}
+
+
+def _service_action(host: str, username: str, password: str, service_name: str, action: str, port: int = 5985, timeouts: Optional[Timeouts] = None) -> dict:
+    """Run start/stop/restart for a Windows service and report its resulting state in one call"""
+    # Single quotes are escaped by doubling them inside a PowerShell literal
+    name = service_name.replace("'", "''")
+    cmd = f"{_SERVICE_CMDLETS[action]} -Name '{name}' -ErrorAction Stop; Start-Sleep -Seconds 2; $status = (Get-Service -Name '{name}').Status; Write-Output $status"
+    not_found = {
+        "success": False,
+        "output": None,
+        "status": "unknown",
+        "error": f"Service '{service_name}' not found. Use 'Get-Service' to list available services."
+    }
+    
     try:
-        cmd = f"Restart-Service -Name '{service_name}' -ErrorAction Stop; Start-Sleep -Seconds 2; $status = (Get-Service -Name '{service_name}').Status; Write-Output $status"
-        output, err = run_winrm_command(host, username, password, cmd, port, use_ps=True)
-        
-        if err and "not found" in err.lower():
-            return {
-                "success": False,
-                "output": None,
-                "status": "unknown",
-                "error": f"Service '{service_name}' not found. Use 'Get-Service' to list available services."
-            }
-        
-        status_output = output.strip().lower() if output else ""
-        is_active = "running" in status_output
-        
-        return {"success": True, "output": output, "status": "active" if is_active else "inactive", "error": None}
+        result = run_winrm(host, username, password, cmd, port, use_ps=True, timeouts=timeouts)
+    except HOST_UNAVAILABLE:
+        raise
     except Exception as e:
-        error_msg = str(e)
-        if "not found" in error_msg.lower():
-            return {
-                "success": False,
-                "output": None,
-                "status": "unknown",
-                "error": f"Service '{service_name}' not found. Use 'Get-Service' to list available services."
-            }
+        if "not found" in str(e).lower():
+            return not_found
         return {"success": False, "output": None, "status": "unknown", "error": str(e)}
+    
+    # -ErrorAction Stop turns a failed cmdlet into a non-zero exit code
+    if not result.ok:
+        if "cannot find any service" in result.stderr.lower() or "not found" in result.stderr.lower():
+            return not_found
+        return {"success": False, "output": result.stdout or None, "status": "unknown", "error": result.error_message, "exit_code": result.exit_code}
+    
+    status_output = result.stdout.strip().lower()
+    if "running" in status_output:
+        status = "active"
+    elif "stopped" in status_output:
+        status = "inactive"
+    else:
+        status = "unknown"
+    
+    return {"success": True, "output": result.stdout, "status": status, "error": None, "exit_code": result.exit_code}
+
+
+def restart_service(host: str, username: str, password: str, service_name: str, port: int = 5985, timeouts: Optional[Timeouts] = None) -> dict:
+    """Restart a Windows service"""
+    return _service_action(host, username, password, service_name, "restart", port, timeouts=timeouts)
 
 
-def start_service(host: str, username: str, password: str, service_name: str, port: int = 5985) -> dict:
+def start_service(host: str, username: str, password: str, service_name: str, port: int = 5985, timeouts: Optional[Timeouts] = None) -> dict:
     """Start a Windows service"""
-    try:
-        cmd = f"Start-Service -Name '{service_name}' -ErrorAction Stop; Start-Sleep -Seconds 2; $status = (Get-Service -Name '{service_name}').Status; Write-Output $status"
-        output, err = run_winrm_command(host, username, password, cmd, port, use_ps=True)
-        
-        if err and "not found" in err.lower():
-            return {
-                "success": False,
-                "output": None,
-                "status": "unknown",
-                "error": f"Service '{service_name}' not found. Use 'Get-Service' to list available services."
-            }
-        
-        status_output = output.strip().lower() if output else ""
-        is_active = "running" in status_output
-        
-        return {"success": True, "output": output, "status": "active" if is_active else "inactive", "error": None}
-    except Exception as e:
-        error_msg = str(e)
-        if "not found" in error_msg.lower():
-            return {
-                "success": False,
-                "output": None,
-                "status": "unknown",
-                "error": f"Service '{service_name}' not found. Use 'Get-Service' to list available services."
-            }
-        return {"success": False, "output": None, "status": "unknown", "error": str(e)}
+    return _service_action(host, username, password, service_name, "start", port, timeouts=timeouts)
 
 
-def stop_service(host: str, username: str, password: str, service_name: str, port: int = 5985) -> dict:
+def stop_service(host: str, username: str, password: str, service_name: str, port: int = 5985, timeouts: Optional[Timeouts] = None) -> dict:
     """Stop a Windows service"""
-    try:
-        cmd = f"Stop-Service -Name '{service_name}' -ErrorAction Stop; Start-Sleep -Seconds 2; $status = (Get-Service -Name '{service_name}').Status; Write-Output $status"
-        output, err = run_winrm_command(host, username, password, cmd, port, use_ps=True)
-        
-        if err and "not found" in err.lower():
-            return {
-                "success": False,
-                "output": None,
-                "status": "unknown",
-                "error": f"Service '{service_name}' not found. Use 'Get-Service' to list available services."
-            }
-        
-        status_output = output.strip().lower() if output else ""
-        is_inactive = "stopped" in status_output
-        
-        return {"success": True, "output": output, "status": "inactive" if is_inactive else "active", "error": None}
-    except Exception as e:
-        error_msg = str(e)
-        if "not found" in error_msg.lower():
-            return {
-                "success": False,
-                "output": None,
-                "status": "unknown",
-                "error": f"Service '{service_name}' not found. Use 'Get-Service' to list available services."
-            }
-        return {"success": False, "output": None, "status": "unknown", "error": str(e)}
+    return _service_action(host, username, password, service_name, "stop", port, timeouts=timeouts)
+
+
+# Disk %, memory %, CPU % and logical core count in one PowerShell call
+_HEALTH_CHECK_SCRIPT = """
+$disk = Get-CimInstance Win32_LogicalDisk -Filter "DeviceID='C:'"
+if ($disk) { $diskUsage = [math]::Round((($disk.Size - $disk.FreeSpace) / $disk.Size) * 100, 1) } else { $diskUsage = 0 }
+$os = Get-CimInstance Win32_OperatingSystem
+$memUsage = [math]::Round((($os.TotalVisibleMemorySize - $os.FreePhysicalMemory) / $os.TotalVisibleMemorySize) * 100, 1)
+$cpu = Get-Counter '\\Processor(_Total)\\% Processor Time' -ErrorAction SilentlyContinue
+if ($cpu) { $cpuUsage = [math]::Round($cpu.CounterSamples.CookedValue, 1) } else { $cpuUsage = 0 }
+$cores = (Get-CimInstance Win32_Processor | Measure-Object -Property NumberOfLogicalProcessors -Sum).Sum
+Write-Output "$diskUsage|$memUsage|$cpuUsage|$cores"
+"""
 
 
-def run_health_check(host: str, username: str, password: str, port: int = 5985) -> dict:
-    """Run system health checks"""
+def run_health_check(host: str, username: str, password: str, port: int = 5985, timeouts: Optional[Timeouts] = None) -> dict:
+    """Run system health checks (all values are collected in one command)"""
     checks = {}
     
     try:
-        # Check disk space (C: drive)
-        disk_cmd = """
-        $disk = Get-CimInstance Win32_LogicalDisk -Filter "DeviceID='C:'"
-        if ($disk) {
-            $usage = [math]::Round((($disk.Size - $disk.FreeSpace) / $disk.Size) * 100, 1)
-            Write-Output $usage
-        } else {
-            Write-Output "0"
-        }
-        """
-        disk_output, _ = run_winrm_command(host, username, password, disk_cmd, port, use_ps=True)
-        disk_usage = float(disk_output.strip()) if disk_output.strip() else 0.0
+        result = run_winrm(host, username, password, _HEALTH_CHECK_SCRIPT, port, use_ps=True, timeouts=timeouts)
+        parts = result.stdout.strip().split('|') if result.ok else []
+    except HOST_UNAVAILABLE:
+        raise
+    except Exception:
+        parts = []
+    
+    def value(index: int, cast):
+        try:
+            return cast(parts[index])
+        except (IndexError, ValueError):
+            return None
+    
+    disk_usage = value(0, float)
+    if disk_usage is not None:
         checks["disk"] = {
             "status": "ok" if disk_usage < 80 else "warning" if disk_usage < 90 else "critical",
             "usage_percent": disk_usage,
             "message": f"Disk usage: {disk_usage}%"
         }
-    except:
+    else:
         checks["disk"] = {"status": "unknown", "usage_percent": 0, "message": "Could not check disk"}
     
-    try:
-        # Check memory
-        mem_cmd = """
-        $os = Get-CimInstance Win32_OperatingSystem
-        $usage = [math]::Round((($os.TotalVisibleMemorySize - $os.FreePhysicalMemory) / $os.TotalVisibleMemorySize) * 100, 1)
-        Write-Output $usage
-        """
-        mem_output, _ = run_winrm_command(host, username, password, mem_cmd, port, use_ps=True)
-        mem_usage = float(mem_output.strip()) if mem_output.strip() else 0.0
+    mem_usage = value(1, float)
+    if mem_usage is not None:
         checks["memory"] = {
             "status": "ok" if mem_usage < 80 else "warning" if mem_usage < 90 else "critical",
             "usage_percent": mem_usage,
             "message": f"Memory usage: {mem_usage}%"
         }
-    except:
+    else:
         checks["memory"] = {"status": "unknown", "usage_percent": 0, "message": "Could not check memory"}
     
-    try:
-        # Check CPU load (approximate using CPU usage)
-        cpu_cmd = """
-        $cpu = Get-Counter '\\Processor(_Total)\\% Processor Time' -ErrorAction SilentlyContinue
-        if ($cpu) {
-            $cpuUsage = [math]::Round($cpu.CounterSamples.CookedValue, 1)
-        } else {
-            $cpuUsage = 0
-        }
-        $cores = (Get-CimInstance Win32_Processor | Measure-Object -Property NumberOfLogicalProcessors -Sum).Sum
-        $loadRatio = $cpuUsage / 100.0
-        Write-Output "$cpuUsage|$cores|$loadRatio"
-        """
-        cpu_output, _ = run_winrm_command(host, username, password, cpu_cmd, port, use_ps=True)
-        cpu_parts = cpu_output.strip().split('|')
-        cpu_usage = float(cpu_parts[0]) if len(cpu_parts) > 0 and cpu_parts[0] else 0.0
-        cores = int(cpu_parts[1]) if len(cpu_parts) > 1 and cpu_parts[1] else 1
-        load_ratio = float(cpu_parts[2]) if len(cpu_parts) > 2 and cpu_parts[2] else 0.0
-        
+    # Check CPU load (approximate using CPU usage)
+    cpu_usage = value(2, float)
+    cores = value(3, int)
+    if cpu_usage is not None and cores is not None:
+        load_ratio = cpu_usage / 100.0
         checks["load"] = {
             "status": "ok" if load_ratio < 1.0 else "warning" if load_ratio < 2.0 else "critical",
-            "load_average": cpu_usage / 100.0,
+            "load_average": load_ratio,
             "cores": cores,
             "message": f"CPU usage: {cpu_usage}% (cores: {cores})"
         }
-    except:
+    else:
         checks["load"] = {"status": "unknown", "load_average": 0, "cores": 0, "message": "Could not check CPU load"}
     
     return checks
 
 
 # Legacy functions for backward compatibility
-def create_windows_user(host: str, username: str, password: str, newuser: str, newpass: str, port: int = 5985) -> str:
+def create_windows_user(host: str, username: str, password: str, newuser: str, newpass: str, port: int = 5985, timeouts: Optional[Timeouts] = None) -> str:
     """Create a new user on the remote server"""
     cmd = f"net user {newuser} {newpass} /add"
-    out, err = run_winrm_command(host, username, password, cmd, port, use_ps=False)
+    out, err = run_winrm_command(host, username, password, cmd, port, use_ps=False, timeouts=timeouts)
     if err:
         raise RuntimeError(err)
     return out
 
 
-def list_users(host: str, username: str, password: str, port: int = 5985) -> str:
+def list_users(host: str, username: str, password: str, port: int = 5985, timeouts: Optional[Timeouts] = None) -> str:
     """List users on the remote server"""
     cmd = "Get-LocalUser | Select-Object Name | ConvertTo-Json"
     try:
-        out, err = run_winrm_command(host, username, password, cmd, port, use_ps=True)
+        out, err = run_winrm_command(host, username, password, cmd, port, use_ps=True, timeouts=timeouts)
         if err:
             # Fallback to WMIC
             cmd = "wmic useraccount get name"
-            out, err = run_winrm_command(host, username, password, cmd, port, use_ps=False)
+            out, err = run_winrm_command(host, username, password, cmd, port, use_ps=False, timeouts=timeouts)
         return out
     except:
         # Final fallback
         cmd = "wmic useraccount get name"
-        out, err = run_winrm_command(host, username, password, cmd, port, use_ps=False)
+        out, err = run_winrm_command(host, username, password, cmd, port, use_ps=False, timeouts=timeouts)
         if err:
             raise RuntimeError(err)
         return out
 
 
-def delete_user(host: str, username: str, password: str, target_user: str, port: int = 5985) -> bool:
+def delete_user(host: str, username: str, password: str, target_user: str, port: int = 5985, timeouts: Optional[Timeouts] = None) -> bool:
     """Delete a user from the remote server"""
     cmd = f"net user {target_user} /delete"
-    out, err = run_winrm_command(host, username, password, cmd, port, use_ps=False)
+    out, err = run_winrm_command(host, username, password, cmd, port, use_ps=False, timeouts=timeouts)
     if err:
         raise RuntimeError(err)
     return True
@@ -0,0 +1,8 @@
+"""
+Metrics time series: the sample store shared by pull collection
+(fetch_metrics) and push ingestion (/api/ingest).
+"""
+
+from .store import metrics_store
+
+__all__ = ['metrics_store']
@@ -0,0 +1,161 @@
+"""
+Fleet-wide aggregation over the latest stored sample of each server.
+
+The newest sample of every selected server (from metrics_store - no remote
+calls) is loaded into one float matrix, a row per server and a column per
+field of store.FIELDS with NaN for missing values, and reductions run over
+its columns with NumPy:
+
+    group_by   os_type | status | tag (a server counts once per tag) | none
+    reduce     count, avg, min, max, sum and percentiles p0..p100 (e.g. p95)
+    top        the k servers with the highest (or lowest) value
+
+Percentiles interpolate linearly between the closest ranks, like
+numpy.percentile. Samples older than max_age seconds are left out so an
+unreachable server does not keep its last numbers in the summary.
+"""
+
+import re
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+from .store import FIELD_IDS, FIELDS, MetricsStore
+
+
+GROUP_BY = ("os_type", "status", "tag")
+REDUCTIONS = ("count", "avg", "min", "max", "sum")
+
+_PERCENTILE = re.compile(r"^p(\d{1,3}(?:\.\d+)?)$")
+
+
+@dataclass
+class FleetFrame:
+    """Latest sample per server: servers[i] describes values[i] (taken at timestamps[i])"""
+    servers: list  # dicts with id, name, os_type, status, tags
+    timestamps: np.ndarray
+    values: np.ndarray  # shape (len(servers), len(FIELDS)), NaN = missing
+
+
+def fleet_frame(servers: Sequence[dict], store: MetricsStore, max_age: Optional[float] = None,
+                now: Optional[float] = None) -> FleetFrame:
+    """Frame of the servers' newest stored samples; servers without a (recent enough) sample are left out"""
+    latest = store.latest_rows(server["id"] for server in servers)
+    cutoff = None if max_age is None else (time.time() if now is None else now) - max_age
+    kept = [server for server in servers
+            if server["id"] in latest and (cutoff is None or latest[server["id"]][0] >= cutoff)]
+    # dtype=float turns None into NaN
+    values = np.array([latest[server["id"]][1] for server in kept], dtype=float).reshape(len(kept), len(FIELDS))
+    timestamps = np.array([latest[server["id"]][0] for server in kept], dtype=float)
+    return FleetFrame(kept, timestamps, values)
+
+
+def frame_from_samples(servers: Sequence[dict], samples: Sequence[dict]) -> FleetFrame:
+    """Frame from one sample dict per server (same order), e.g. generated demo metrics"""
+    rows = [[sample.get(name) for name in FIELDS] for sample in samples]
+    values = np.array(rows, dtype=float).reshape(len(rows), len(FIELDS))
+    timestamps = np.array([sample["timestamp"] for sample in samples], dtype=float)
+    return FleetFrame(list(servers), timestamps, values)
+
+
+def parse_reductions(text: Optional[str]) -> list:
+    """"avg,p95,max" -> ["avg", "p95", "max"]; raises ValueError for unknown names"""
+    names = [name.strip().lower() for name in (text or "count,avg,min,max").split(",") if name.strip()]
+    for name in names:
+        match = _PERCENTILE.match(name)
+        if name not in REDUCTIONS and not (match and float(match.group(1)) <= 100):
+            raise ValueError(f"Unknown reduction {name!r}: use {', '.join(REDUCTIONS)} or a percentile like p95")
+    return names
+
+
+def aggregate(frame: FleetFrame, metric: str, group_by: Optional[str] = None,
+              reductions: Iterable[str] = ("count", "avg", "min", "max")) -> list:
+    """Reduce one metric per group; returns [{"group": key, "servers": n, <reduction>: value, ...}]"""
+    column = frame.values[:, FIELD_IDS[metric]]
+    if group_by is None:
+        keys = [None] * len(frame.servers)
+        index = np.arange(len(frame.servers))
+    elif group_by == "tag":
+        pairs = [(tag, i) for i, server in enumerate(frame.servers) for tag in (server["tags"] or [None])]
+        keys = [tag for tag, _ in pairs]
+        index = np.fromiter((i for _, i in pairs), dtype=np.intp, count=len(pairs))
+    else:
+        keys = [server[group_by] for server in frame.servers]
+        index = np.arange(len(frame.servers))
+
+    groups: dict = {}
+    codes = np.fromiter((groups.setdefault(key, len(groups)) for key in keys), dtype=np.intp, count=len(keys))
+    group_count = len(groups)
+    values = column[index]
+    servers = np.bincount(codes, minlength=group_count)
+
+    valid = ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+    count = np.bincount(codes, minlength=group_count)
+    total = np.bincount(codes, weights=values, minlength=group_count)
+    # Values sorted within each group: group g occupies ordered[starts[g]:starts[g] + count[g]]
+    order = np.lexsort((values, codes))
+    ordered = values[order]
+    starts = np.searchsorted(codes[order], np.arange(group_count))
+    has = count > 0
+    last = np.where(has, starts + count - 1, 0)
+    first = np.where(has, starts, 0)
+
+    results = {}
+    for name in reductions:
+        if name == "count":
+            result = count.astype(float)
+        elif name == "sum":
+            result = total
+        elif name == "avg":
+            result = np.divide(total, count, out=np.full(group_count, np.nan), where=has)
+        elif name == "min":
+            result = np.where(has, ordered[first] if len(ordered) else np.nan, np.nan)
+        elif name == "max":
+            result = np.where(has, ordered[last] if len(ordered) else np.nan, np.nan)
+        else:
+            rank = starts + (count - 1) * (float(name[1:]) / 100)
+            low = np.where(has, np.floor(rank), 0).astype(np.intp)
+            high = np.where(has, np.ceil(rank), 0).astype(np.intp)
+            if len(ordered):
+                result = ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+                result = np.where(has, result, np.nan)
+            else:
+                result = np.full(group_count, np.nan)
+        results[name] = result
+
+    rows = []
+    for key, code in groups.items():
+        row = {"group": key, "servers": int(servers[code])}
+        for name, result in results.items():
+            row[name] = int(result[code]) if name == "count" else _number(result[code])
+        rows.append(row)
+    return rows
+
+
+def top_k(frame: FleetFrame, metric: str, k: int = 10, ascending: bool = False) -> list:
+    """The k servers with the highest (lowest if ascending) value of a metric"""
+    column = frame.values[:, FIELD_IDS[metric]]
+    candidates = np.flatnonzero(~np.isnan(column))
+    keys = column[candidates] if ascending else -column[candidates]
+    if len(candidates) > k:
+        # Partial selection first, so only k values are fully sorted
+        picked = np.argpartition(keys, k - 1)[:k]
+        candidates, keys = candidates[picked], keys[picked]
+    ranked = candidates[np.argsort(keys, kind="stable")]
+    return [
+        {
+            "server_id": frame.servers[i]["id"],
+            "name": frame.servers[i]["name"],
+            "value": _number(column[i]),
+            "timestamp": float(frame.timestamps[i]),
+        }
+        for i in ranked
+    ]
+
+
+def _number(value) -> Optional[float]:
+    value = float(value)
+    return None if value != value else round(value, 3)
@@ -0,0 +1,290 @@
+"""
+Threshold alerting, evaluated as samples arrive.
+
+An alert rule (models.AlertRule) compares one sample field with a threshold,
+e.g. "cpu_percent > 90 for 300s", on one server, on every server carrying a
+tag, or on all servers. The engine keeps a small state per (rule, server) and
+moves it on each new sample, so a sample costs one comparison per rule that
+applies to its server no matter how much history is stored:
+
+    ok -> pending       the condition holds (an Alert row is opened)
+    pending -> firing   it has held for the rule's duration
+    firing -> resolved  it no longer holds
+    pending -> ok       it stopped holding before firing (the row is dropped)
+
+Rules of kind "anomaly" compare the metric's z-score against its baseline
+instead of the value (anomaly.py scores every sample first), so "cpu_percent
+anomaly > 4 for 60s" adapts to each server's normal level.
+
+A (rule, server) pair has at most one open alert; while the condition keeps
+holding nothing is written or sent. Samples older than the last one seen for
+a pair (agent retries, backfill) are skipped.
+
+Notifications are sent on firing and on resolve: one line in the alert log
+(stdout, and ALERT_LOG_FILE as JSON lines when set) and a JSON POST to the
+rule's webhook_url or ALERT_WEBHOOK_URL, made from a background thread so a
+slow webhook never holds up ingestion (ALERT_WEBHOOK_TIMEOUT, default 5s).
+"""
+
+import json
+import operator
+import os
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, Optional, Sequence
+
+from ..db import db
+from ..models import Alert, AlertRule
+from .anomaly import anomaly_detector
+from .store import FIELD_IDS, FIELDS
+
+
+WEBHOOK_URL = os.getenv("ALERT_WEBHOOK_URL") or None
+WEBHOOK_TIMEOUT = float(os.getenv("ALERT_WEBHOOK_TIMEOUT", "5"))
+LOG_FILE = os.getenv("ALERT_LOG_FILE") or None
+
+COMPARATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+SEVERITIES = ("warning", "critical")
+
+RULE_KINDS = ("threshold", "anomaly")
+
+_ALL_FIELD_IDS = tuple(range(len(FIELDS)))
+
+
+@dataclass(frozen=True)
+class _Rule:
+    """Detached copy of an enabled AlertRule"""
+    id: int
+    name: str
+    metric: str
+    field_id: int
+    kind: str
+    comparator: str
+    threshold: float
+    duration: float
+    severity: str
+    server_id: Optional[int]
+    tag: Optional[str]
+    webhook_url: Optional[str]
+
+    def applies_to(self, server_id: int, tags: Sequence[str]) -> bool:
+        if self.server_id is not None and self.server_id != server_id:
+            return False
+        return self.tag is None or self.tag in tags
+
+
+class _State:
+    __slots__ = ("status", "since", "last_ts")
+
+    def __init__(self, status: str = "ok", since: Optional[float] = None, last_ts: float = float("-inf")):
+        self.status = status  # ok | pending | firing
+        self.since = since  # timestamp of the first breaching sample
+        self.last_ts = last_ts
+
+
+def _utc(ts: float) -> datetime:
+    return datetime.utcfromtimestamp(ts)
+
+
+def _epoch(dt: datetime) -> float:
+    return (dt - datetime(1970, 1, 1)).total_seconds()
+
+
+class AlertNotifier:
+    """Writes alert events to the alert log and posts them to webhooks"""
+
+    def __init__(self, webhook_url: Optional[str] = WEBHOOK_URL, log_file: Optional[str] = LOG_FILE,
+                 timeout: float = WEBHOOK_TIMEOUT):
+        self.webhook_url = webhook_url
+        self.log_file = log_file
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="alert-webhook")
+
+    def notify(self, event: dict, webhook_url: Optional[str] = None) -> None:
+        body = json.dumps(event)
+        tested = f"{event['metric']} z-score" if event.get("kind") == "anomaly" else event["metric"]
+        print(f"ALERT {event['state'].upper()} [{event['severity']}] {event['rule']} on {event['hostname']}: "
+              f"{tested} {event['comparator']} {event['threshold']:g} (value {event['value']:g})")
+        if self.log_file:
+            with self._lock:
+                try:
+                    with open(self.log_file, "a") as f:
+                        f.write(body + "\n")
+                except OSError as e:
+                    print(f"Failed to write alert log {self.log_file}: {e}")
+        url = webhook_url or self.webhook_url
+        if url:
+            self._executor.submit(self._post, url, body)
+
+    def _post(self, url: str, body: str) -> None:
+        request = urllib.request.Request(url, data=body.encode(), headers={"Content-Type": "application/json"}, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            print(f"Alert webhook {url} failed: {e}")
+
+
+class AlertEngine:
+    """Incremental evaluation of the enabled alert rules"""
+
+    def __init__(self, notifier: Optional[AlertNotifier] = None):
+        self.notifier = notifier or AlertNotifier()
+        self._lock = threading.Lock()
+        self._rules: Optional[list] = None  # loaded from the database on first use
+        self._states: dict = {}
+
+    def reload(self) -> None:
+        """Re-read the rules on the next evaluation (call after changing AlertRule rows)"""
+        with self._lock:
+            self._rules = None
+
+    def forget_server(self, server_id: int) -> None:
+        """Drop the states of a deleted server"""
+        with self._lock:
+            for key in [key for key in self._states if key[1] == server_id]:
+                del self._states[key]
+
+    def observe_samples(self, server, samples: Iterable[dict]) -> list:
+        """observe() for samples given as dicts with a "timestamp" (see store.sample_from_metrics)"""
+        rows = [(sample["timestamp"], *(sample.get(name) for name in FIELDS)) for sample in samples]
+        return self.observe(server, _ALL_FIELD_IDS, rows)
+
+    def observe(self, server, field_ids: Sequence[int], rows: Sequence[Sequence]) -> list:
+        """Score a server's new rows of (timestamp, value, ...) and evaluate its rules; returns the events sent
+
+        Alert rows are added to the database session - the caller commits.
+        """
+        if not rows:
+            return []
+        rows = sorted(rows, key=operator.itemgetter(0))
+        scores = anomaly_detector.observe(server.id, field_ids, rows)
+        rules = self._load_rules()
+        tags = server.tag_list()
+        positions = {field_id: position for position, field_id in enumerate(field_ids, start=1)}
+        checks = [(rule, positions[rule.field_id]) for rule in rules
+                  if rule.field_id in positions and rule.applies_to(server.id, tags)]
+        if not checks:
+            return []
+
+        transitions = []
+        with self._lock:
+            for rule, position in checks:
+                compare = COMPARATORS[rule.comparator]
+                anomaly = rule.kind == "anomaly"
+                state = self._states.get((rule.id, server.id))
+                if state is None:
+                    state = self._states[(rule.id, server.id)] = _State()
+                for row, score in zip(rows, scores):
+                    ts, value = row[0], row[position]
+                    tested = score[position] if anomaly else value
+                    # None or NaN: the field was not collected (or its baseline is still warming up)
+                    if tested is None or tested != tested or ts <= state.last_ts:
+                        continue
+                    state.last_ts = ts
+                    if compare(tested, rule.threshold):
+                        if state.status == "ok":
+                            state.status, state.since = "pending", ts
+                            transitions.append(("pending", rule, ts, value, score[position], ts))
+                        if state.status == "pending" and ts - state.since >= rule.duration:
+                            state.status = "firing"
+                            transitions.append(("firing", rule, ts, value, score[position], state.since))
+                    elif state.status != "ok":
+                        change = "resolved" if state.status == "firing" else "cleared"
+                        transitions.append((change, rule, ts, value, score[position], state.since))
+                        state.status, state.since = "ok", None
+
+        events = []
+        for change, rule, ts, value, zscore, since in transitions:
+            self._record(change, rule, server.id, ts, value, since)
+            if change in ("firing", "resolved"):
+                event = {
+                    "state": change,
+                    "rule_id": rule.id,
+                    "rule": rule.name,
+                    "kind": rule.kind,
+                    "severity": rule.severity,
+                    "server_id": server.id,
+                    "hostname": server.name or server.hostname,
+                    "metric": rule.metric,
+                    "comparator": rule.comparator,
+                    "threshold": rule.threshold,
+                    "value": value,
+                    "zscore": round(zscore, 2) if zscore is not None else None,
+                    "started_at": since,
+                    "timestamp": ts,
+                }
+                self.notifier.notify(event, rule.webhook_url)
+                events.append(event)
+        return events
+
+    def states(self) -> list:
+        """Pending and firing (rule, server) pairs as the engine currently sees them"""
+        with self._lock:
+            return [
+                {"rule_id": rule_id, "server_id": server_id, "state": state.status, "since": state.since, "last_sample": state.last_ts}
+                for (rule_id, server_id), state in self._states.items() if state.status != "ok"
+            ]
+
+    def _load_rules(self) -> list:
+        with self._lock:
+            if self._rules is not None:
+                return self._rules
+        rules = [
+            _Rule(r.id, r.name, r.metric, FIELD_IDS[r.metric], r.kind or "threshold", r.comparator, r.threshold,
+                  r.duration or 0.0, r.severity, r.server_id, r.tag, r.webhook_url)
+            for r in AlertRule.query.filter_by(enabled=True).all()
+            if r.metric in FIELD_IDS and r.comparator in COMPARATORS
+        ]
+        rule_ids = {rule.id for rule in rules}
+        open_alerts = Alert.query.filter(Alert.state.in_(("pending", "firing"))).all()
+        with self._lock:
+            if self._rules is None:
+                # Keep states of rules that are still enabled; pick up open alerts after a restart
+                self._states = {key: state for key, state in self._states.items() if key[0] in rule_ids}
+                for alert in open_alerts:
+                    key = (alert.rule_id, alert.server_id)
+                    if alert.rule_id in rule_ids and key not in self._states:
+                        self._states[key] = _State(alert.state, _epoch(alert.started_at))
+                self._rules = rules
+            return self._rules
+
+    @staticmethod
+    def _record(change: str, rule: _Rule, server_id: int, ts: float, value: float, since: float) -> None:
+        """Apply one transition to the alerts table"""
+        alert = Alert.query.filter(
+            Alert.rule_id == rule.id,
+            Alert.server_id == server_id,
+            Alert.state.in_(("pending", "firing")),
+        ).first()
+        if change == "cleared":
+            if alert is not None:
+                db.session.delete(alert)
+            return
+        if alert is None:
+            if change == "resolved":
+                return
+            alert = Alert(rule_id=rule.id, server_id=server_id, started_at=_utc(since))
+            db.session.add(alert)
+        alert.state = change
+        alert.value = value
+        if change == "firing":
+            alert.fired_at = _utc(ts)
+        elif change == "resolved":
+            alert.resolved_at = _utc(ts)
+
+
+alert_engine = AlertEngine()
@@ -0,0 +1,277 @@
+"""
+Streaming anomaly detection per server and metric.
+
+Every new sample updates, in O(1) time and constant memory per series:
+
+- an exponentially weighted mean and variance (weight ANOMALY_ALPHA, default
+  0.05 - roughly the last 40 samples), which give the sample's z-score
+  against the baseline *before* it is folded in;
+- P² quantile estimates (p50, p95, p99; Jain & Chlamtac 1985), five markers
+  each, kept over windows of ANOMALY_WINDOW samples (default 720): answers
+  come from the last complete window, so the quantiles follow a changing
+  baseline instead of averaging over the whole uptime.
+
+A sample is anomalous when |z| >= ANOMALY_Z (default 4) once the series has
+seen ANOMALY_WARMUP samples (default 30). The standard deviation used for z
+is at least 1% of the mean, so a metric that never moves (disk usage) is not
+flagged for a rounding-level change. Each server keeps its last
+ANOMALY_RECENT anomalies (default 20). Alert rules of kind "anomaly" compare
+these z-scores with their threshold (see alerts.py).
+"""
+
+import math
+import os
+import threading
+from collections import deque
+from typing import Optional, Sequence
+
+from .store import FIELD_IDS, FIELDS
+
+
+ALPHA = float(os.getenv("ANOMALY_ALPHA", "0.05"))
+Z_THRESHOLD = float(os.getenv("ANOMALY_Z", "4"))
+WARMUP = int(os.getenv("ANOMALY_WARMUP", "30"))
+WINDOW = int(os.getenv("ANOMALY_WINDOW", "720"))
+RECENT = int(os.getenv("ANOMALY_RECENT", "20"))
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Fields that describe load; totals, counters and uptime are not scored
+SCORED_FIELDS = (
+    "cpu_percent",
+    "load_1",
+    "mem_percent",
+    "disk_percent",
+    "disk_read_bytes_per_sec",
+    "disk_write_bytes_per_sec",
+    "net_bytes_sent_per_sec",
+    "net_bytes_recv_per_sec",
+)
+
+_SCORED_IDS = frozenset(FIELD_IDS[name] for name in SCORED_FIELDS)
+
+_MIN_STD_RATIO = 0.01
+
+
+class P2Quantile:
+    """P² estimate of one quantile: five markers, no stored samples"""
+    __slots__ = ("p", "heights", "positions", "desired", "increments", "count")
+
+    def __init__(self, p: float):
+        self.p = p
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0.0, 2 * p, 4 * p, 2 + 2 * p, 4.0]
+        self.increments = (0.0, p / 2, p, (1 + p) / 2, 1.0)
+        self.count = 0
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        q = self.heights
+        if self.count <= 5:
+            q.append(x)
+            if self.count == 5:
+                q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        desired = self.desired
+        for i in range(5):
+            desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                # Piecewise-parabolic prediction, falling back to linear if it leaves the bracket
+                height = q[i] + step / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+                q[i] = height
+                n[i] += step
+
+    def value(self) -> Optional[float]:
+        if self.count == 0:
+            return None
+        if self.count < 5:
+            ordered = sorted(self.heights)
+            return ordered[min(len(ordered) - 1, int(self.p * len(ordered)))]
+        return self.heights[2]
+
+
+class _Series:
+    __slots__ = ("count", "mean", "var", "last_ts", "last_value", "last_z", "last_expected", "last_std", "window", "previous")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.last_ts = float("-inf")
+        self.last_value = None
+        self.last_z = None
+        self.last_expected = None  # baseline the last sample was scored against
+        self.last_std = None
+        self.window = [P2Quantile(p) for p in QUANTILES]
+        self.previous = None  # quantile values of the last complete window
+
+    def std(self) -> float:
+        return max(math.sqrt(self.var), _MIN_STD_RATIO * abs(self.mean), 1e-9)
+
+    def quantiles(self) -> dict:
+        values = self.previous if self.previous is not None else [q.value() for q in self.window]
+        return {f"p{round(p * 100)}": value for p, value in zip(QUANTILES, values)}
+
+
+class AnomalyDetector:
+    """Per (server, metric) streaming baselines and z-scores"""
+
+    def __init__(self, alpha: float = ALPHA, z_threshold: float = Z_THRESHOLD, warmup: int = WARMUP,
+                 window: int = WINDOW, recent: int = RECENT):
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.warmup = max(2, warmup)
+        self.window = max(5, window)
+        self.recent = recent
+        self._lock = threading.Lock()
+        self._series: dict = {}
+        self._recent: dict = {}
+
+    def observe(self, server_id: int, field_ids: Sequence[int], rows: Sequence[Sequence]) -> list:
+        """Fold new rows of (timestamp, value, ...) into the baselines; returns matching rows of z-scores
+
+        A z-score is None while a series warms up, for missing values and for
+        samples older than the series' latest.
+        """
+        scored = [(position, field_id) for position, field_id in enumerate(field_ids, start=1) if field_id in _SCORED_IDS]
+        if not scored:
+            return [(row[0],) + (None,) * len(field_ids) for row in rows]
+        alpha = self.alpha
+        results = []
+        with self._lock:
+            series_by_position = []
+            for position, field_id in scored:
+                series = self._series.get((server_id, field_id))
+                if series is None:
+                    series = self._series[(server_id, field_id)] = _Series()
+                series_by_position.append((position, field_id, series))
+            for row in rows:
+                ts = row[0]
+                scores = [None] * len(field_ids)
+                for position, field_id, series in series_by_position:
+                    value = row[position]
+                    if value is None or value != value or ts <= series.last_ts:
+                        continue
+                    z = None
+                    if series.count >= self.warmup:
+                        series.last_expected, series.last_std = series.mean, series.std()
+                        z = (value - series.last_expected) / series.last_std
+                        if abs(z) >= self.z_threshold:
+                            self._flag(server_id, field_id, ts, value, z, series)
+                    # Incremental EWMA mean/variance (Finch 2009)
+                    if series.count == 0:
+                        series.mean = float(value)
+                    else:
+                        diff = value - series.mean
+                        increment = alpha * diff
+                        series.mean += increment
+                        series.var = (1 - alpha) * (series.var + diff * increment)
+                    series.count += 1
+                    series.last_ts = ts
+                    series.last_value = value
+                    series.last_z = z
+                    for quantile in series.window:
+                        quantile.add(value)
+                    if series.window[0].count >= self.window:
+                        series.previous = [q.value() for q in series.window]
+                        series.window = [P2Quantile(p) for p in QUANTILES]
+                    scores[position - 1] = z
+                results.append((ts, *scores))
+        return results
+
+    def _flag(self, server_id: int, field_id: int, ts: float, value: float, z: float, series: _Series) -> None:
+        """Remember an anomaly (caller holds the lock)"""
+        recent = self._recent.get(server_id)
+        if recent is None:
+            recent = self._recent[server_id] = deque(maxlen=self.recent)
+        recent.append({
+            "timestamp": ts,
+            "metric": FIELDS[field_id],
+            "value": value,
+            "zscore": round(z, 2),
+            "expected": round(series.last_expected, 3),
+            "stddev": round(series.last_std, 3),
+        })
+
+    def server_report(self, server_id: int) -> dict:
+        """Baseline, latest z-score and recent anomalies for each scored metric of a server"""
+        with self._lock:
+            metrics = {}
+            for name in SCORED_FIELDS:
+                series = self._series.get((server_id, FIELD_IDS[name]))
+                if series is None or series.count == 0:
+                    continue
+                metrics[name] = {
+                    "samples": series.count,
+                    "mean": round(series.mean, 3),
+                    "stddev": round(series.std(), 3),
+                    **series.quantiles(),
+                    "last_value": series.last_value,
+                    "last_timestamp": series.last_ts,
+                    "zscore": round(series.last_z, 2) if series.last_z is not None else None,
+                    "anomalous": series.last_z is not None and abs(series.last_z) >= self.z_threshold,
+                }
+            return {
+                "metrics": metrics,
+                "recent": list(self._recent.get(server_id, ())),
+            }
+
+    def current(self) -> list:
+        """Series whose latest sample is anomalous, across all servers"""
+        with self._lock:
+            return [
+                {
+                    "server_id": server_id,
+                    "metric": FIELDS[field_id],
+                    "value": series.last_value,
+                    "timestamp": series.last_ts,
+                    "zscore": round(series.last_z, 2),
+                    "expected": round(series.last_expected, 3),
+                    "stddev": round(series.last_std, 3),
+                }
+                for (server_id, field_id), series in self._series.items()
+                if series.last_z is not None and abs(series.last_z) >= self.z_threshold
+            ]
+
+    def forget(self, server_id: int) -> None:
+        """Drop a server's baselines"""
+        with self._lock:
+            for key in [key for key in self._series if key[0] == server_id]:
+                del self._series[key]
+            self._recent.pop(server_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "series": len(self._series),
+                "z_threshold": self.z_threshold,
+                "alpha": self.alpha,
+                "window": self.window,
+            }
+
+
+anomaly_detector = AnomalyDetector()
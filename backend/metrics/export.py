@@ -0,0 +1,178 @@
+"""
+Bulk export of stored metrics history, streamed.
+
+The exporters are generators over the history of many servers: samples are
+read one stored chunk at a time (a segment file, see segments.py, then the
+in-memory tail) and each chunk is encoded and handed out before the next is
+read, so a month of fleet history never sits in memory at once.
+
+    raw          server_id, server, timestamp, source, <fields>
+    resolution   server_id, server, timestamp, then <field>_<stat> for count,
+                 avg, min, max and each quantile (rollup sketches, rollup.py)
+
+Timestamps are unix seconds in CSV and UTC millisecond timestamps in
+Parquet; missing values are empty (CSV) or null (Parquet). Parquet needs
+pyarrow, which is optional (pip install pyarrow); it is written in row
+groups of EXPORT_ROW_GROUP rows (default 65536).
+"""
+
+import csv
+import io
+import os
+from typing import Iterable, Iterator, Optional, Sequence
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only needed for Parquet exports
+    pa = pq = None
+
+from .fields import FIELDS
+from .rollup import ROLLUP_FIELDS
+from .segments import SOURCES
+from .store import MetricsStore
+
+
+FORMATS = ("csv", "parquet")
+ROW_GROUP = int(os.getenv("EXPORT_ROW_GROUP", "65536"))
+
+_SUMMARY_STATS = ("count", "avg", "min", "max")
+
+
+def parquet_available() -> bool:
+    return pa is not None
+
+
+class ExportQuery:
+    """What to export: servers (dicts with id and name), time range, fields and optional resolution"""
+
+    def __init__(self, servers: Sequence[dict], since: Optional[float] = None, until: Optional[float] = None,
+                 fields: Optional[Iterable[str]] = None, resolution: Optional[float] = None,
+                 quantiles: Sequence[float] = (0.5, 0.95, 0.99)):
+        self.servers = list(servers)
+        self.since = since
+        self.until = until
+        self.resolution = resolution
+        self.quantiles = tuple(quantiles)
+        if resolution is None:
+            self.fields = FIELDS if fields is None else tuple(fields)
+            self.stats = ()
+            self.columns = self.fields
+        else:
+            self.fields = ROLLUP_FIELDS if fields is None else tuple(name for name in fields if name in ROLLUP_FIELDS)
+            self.stats = _SUMMARY_STATS + tuple(f"p{q * 100:g}" for q in self.quantiles)
+            self.columns = tuple(f"{name}_{stat}" for name in self.fields for stat in self.stats)
+
+    def chunks(self, store: MetricsStore) -> Iterator[tuple]:
+        """(server, timestamps, source codes or None, values) per stored chunk, server by server"""
+        for server in self.servers:
+            if self.resolution is None:
+                for timestamps, sources, values in store.iter_history(server["id"], self.since, self.until, self.fields):
+                    yield server, timestamps, sources, values
+                continue
+            # A server's rollups are a few hundred windows at most
+            points = store.rollup_history(server["id"], self.resolution, self.since, self.until,
+                                          self.fields, self.quantiles)["points"]
+            if not points:
+                continue
+            values = np.array([
+                [point.get(name, {}).get(stat) for name in self.fields for stat in self.stats]
+                for point in points
+            ], dtype=float).reshape(len(points), len(self.columns))
+            yield server, np.array([point["timestamp"] for point in points], dtype=float), None, values
+
+
+def export_csv(store: MetricsStore, query: ExportQuery) -> Iterator[str]:
+    """CSV text, a header then one piece per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    raw = query.resolution is None
+    writer.writerow(("server_id", "server", "timestamp") + (("source",) if raw else ()) + tuple(query.columns))
+    yield _drain(buffer)
+    for server, timestamps, sources, values in query.chunks(store):
+        prefix = (server["id"], server["name"])
+        # Missing values (NaN) become empty cells
+        cells = np.where(np.isnan(values), None, values).tolist()
+        if raw:
+            names = [SOURCES[code] if code < len(SOURCES) else "" for code in sources.tolist()]
+            writer.writerows(prefix + (ts, source, *row) for ts, source, row in zip(timestamps.tolist(), names, cells))
+        else:
+            writer.writerows(prefix + (ts, *row) for ts, row in zip(timestamps.tolist(), cells))
+        yield _drain(buffer)
+
+
+def _drain(buffer: io.StringIO) -> str:
+    text = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return text
+
+
+class _Sink:
+    """Write-only file for pyarrow that hands written bytes back instead of keeping them"""
+
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def export_parquet(store: MetricsStore, query: ExportQuery, row_group: int = ROW_GROUP) -> Iterator[bytes]:
+    """Parquet file bytes, handed out a row group at a time; raises RuntimeError without pyarrow"""
+    if pa is None:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+    raw = query.resolution is None
+    schema = pa.schema(
+        [("server_id", pa.int64()), ("server", pa.string()), ("timestamp", pa.timestamp("ms", tz="UTC"))]
+        + ([("source", pa.dictionary(pa.int8(), pa.string()))] if raw else [])
+        + [(column, pa.float64()) for column in query.columns]
+    )
+    sink = _Sink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    pending, pending_rows = [], 0
+    for chunk in query.chunks(store):
+        pending.append(chunk)
+        pending_rows += len(chunk[1])
+        if pending_rows >= row_group:
+            writer.write_table(_table(schema, pending, raw, len(query.columns)))
+            pending, pending_rows = [], 0
+            yield sink.drain()
+    if pending:
+        writer.write_table(_table(schema, pending, raw, len(query.columns)))
+    writer.close()
+    yield sink.drain()
+
+
+def _table(schema, chunks: list, raw: bool, width: int):
+    """One Arrow table (a row group) from buffered chunks"""
+    timestamps = np.concatenate([chunk[1] for chunk in chunks])
+    values = np.concatenate([chunk[3] for chunk in chunks]).reshape(len(timestamps), width)
+    server_ids = np.concatenate([np.full(len(chunk[1]), chunk[0]["id"], dtype=np.int64) for chunk in chunks])
+    names = pa.array([chunk[0]["name"] for chunk in chunks for _ in range(len(chunk[1]))], type=pa.string())
+    arrays = [
+        pa.array(server_ids),
+        names,
+        pa.array((timestamps * 1000).astype(np.int64), type=pa.timestamp("ms", tz="UTC")),
+    ]
+    if raw:
+        codes = np.concatenate([chunk[2] for chunk in chunks]).astype(np.int8)
+        arrays.append(pa.DictionaryArray.from_arrays(pa.array(codes), pa.array(SOURCES)))
+    # from_pandas=True stores NaN as null
+    arrays.extend(pa.array(values[:, column], from_pandas=True) for column in range(width))
+    return pa.Table.from_arrays(arrays, schema=schema)
@@ -0,0 +1,30 @@
+"""
+The numeric fields of a metrics sample.
+"""
+
+# Numeric fields a sample may carry; anything else is dropped on ingest
+FIELDS = (
+    "cpu_percent",
+    "cpu_cores",
+    "load_1",
+    "load_5",
+    "load_15",
+    "mem_total_gb",
+    "mem_used_gb",
+    "mem_available_gb",
+    "mem_percent",
+    "disk_total_gb",
+    "disk_used_gb",
+    "disk_available_gb",
+    "disk_percent",
+    "disk_read_bytes_per_sec",
+    "disk_write_bytes_per_sec",
+    "net_bytes_sent",
+    "net_bytes_recv",
+    "net_bytes_sent_per_sec",
+    "net_bytes_recv_per_sec",
+    "uptime_seconds",
+)
+
+# Position in FIELDS is the field id used by the binary ingest format - only ever append
+FIELD_IDS = {name: index for index, name in enumerate(FIELDS)}
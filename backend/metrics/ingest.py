@@ -0,0 +1,174 @@
+"""
+Push ingestion: per-server tokens and the batch format agents post to /api/ingest.
+
+Each server can be issued one ingest token (POST /api/servers/<id>/ingest-token);
+only its SHA-256 is stored, so a lost token is replaced rather than recovered.
+An agent authenticates with "Authorization: Bearer <token>" and posts batches
+that name the fields once and send each sample as a row:
+
+    {
+        "fields": ["cpu_percent", "mem_percent", "load_1"],
+        "samples": [[1718000000.0, 12.5, 40.1, 0.3], [1718000030.0, 14.0, 40.2, 0.4]],
+        "host": {"hostname": "web-1", "boot_time": "2024-06-01 08:00:00"}
+    }
+
+The first value of a row is the unix timestamp, the rest follow "fields".
+Unknown field names are ignored so newer agents keep working; values must be
+numbers or null.
+
+High-volume agents can post the same batch as BINARY_CONTENT_TYPE instead,
+which skips JSON parsing entirely (all little-endian):
+
+    header   4s H I      magic b"SMB1", field count F, sample count N
+    fields   F x H       field ids (positions in store.FIELDS)
+    samples  N x (F+1)d  timestamp followed by F values, NaN for missing
+
+Values must be finite (NaN aside): rows with an infinite value, or a JSON
+integer too large for a float, are rejected.
+
+Either way, a batch holds at most INGEST_MAX_SAMPLES rows (default 1000)
+and timestamps more than INGEST_MAX_AGE seconds old (default a week) or more
+than five minutes in the future are rejected.
+"""
+
+import hashlib
+import math
+import operator
+import os
+import secrets
+import struct
+import time
+from typing import Optional, Sequence
+
+import numpy as np
+
+from .store import FIELD_IDS, FIELDS
+
+
+MAX_SAMPLES = int(os.getenv("INGEST_MAX_SAMPLES", "1000"))
+MAX_AGE = float(os.getenv("INGEST_MAX_AGE", str(7 * 86400)))
+MAX_CLOCK_SKEW = 300
+
+# fetch_metrics serves a pushed sample instead of probing the host while it is this recent
+FRESH_FOR = float(os.getenv("INGEST_FRESH_FOR", "120"))
+
+BINARY_CONTENT_TYPE = "application/vnd.server-monitoring.samples"
+BINARY_MAGIC = b"SMB1"
+
+# magic, field count, sample count
+_BINARY_HEADER = struct.Struct("<4sHI")
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_token(server) -> str:
+    """Give a server a new ingest token (replacing any previous one); returns the plaintext token"""
+    token = secrets.token_urlsafe(32)
+    server.ingest_token_hash = hash_token(token)
+    return token
+
+
+def bearer_token(authorization: Optional[str]) -> Optional[str]:
+    """Token from an "Authorization: Bearer ..." header"""
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
+
+
+def parse_batch(payload, now: Optional[float] = None) -> tuple[tuple, list, int]:
+    """Decode a JSON batch; returns (field ids, rows of (timestamp, value, ...), rejected rows)
+
+    Raises ValueError when the batch itself is malformed.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Batch must be a JSON object")
+    fields = payload.get("fields")
+    rows = payload.get("samples")
+    if not isinstance(fields, list) or not all(isinstance(f, str) for f in fields):
+        raise ValueError("fields must be a list of field names")
+    if not isinstance(rows, list):
+        raise ValueError("samples must be a list of rows")
+    if len(rows) > MAX_SAMPLES:
+        raise ValueError(f"At most {MAX_SAMPLES} samples per batch")
+
+    low, high = _timestamp_window(now)
+    positions = [position for position, name in enumerate(fields, start=1) if name in FIELD_IDS]
+    field_ids = tuple(FIELD_IDS[fields[position - 1]] for position in positions)
+    accepted = []
+    rejected = 0
+    for row in rows:
+        if not isinstance(row, list) or len(row) != len(fields) + 1 or not _is_number(row[0]):
+            rejected += 1
+            continue
+        if not low <= row[0] <= high:
+            rejected += 1
+            continue
+        values = [row[position] for position in positions]
+        if not all(value is None or _is_number(value) for value in values):
+            rejected += 1
+            continue
+        accepted.append((float(row[0]), *values))
+    return field_ids, accepted, rejected
+
+
+def parse_binary_batch(data: bytes, now: Optional[float] = None) -> tuple[tuple, list, int]:
+    """Decode a binary batch (BINARY_CONTENT_TYPE); same return value as parse_batch
+
+    Rows are unpacked straight into tuples with struct and handed to the
+    store as they are; NaN values stay NaN until they are read back.
+    """
+    if len(data) < _BINARY_HEADER.size:
+        raise ValueError("Batch is too short")
+    magic, field_count, sample_count = _BINARY_HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC:
+        raise ValueError("Not a binary metrics batch")
+    if sample_count > MAX_SAMPLES:
+        raise ValueError(f"At most {MAX_SAMPLES} samples per batch")
+    ids_end = _BINARY_HEADER.size + 2 * field_count
+    row = struct.Struct(f"<{field_count + 1}d")
+    if len(data) != ids_end + sample_count * row.size:
+        raise ValueError("Batch length does not match its header")
+
+    ids = struct.unpack_from(f"<{field_count}H", data, _BINARY_HEADER.size)
+    positions = [position for position, field_id in enumerate(ids, start=1) if field_id < len(FIELDS)]
+    rows = row.iter_unpack(memoryview(data)[ids_end:])
+    if len(positions) < field_count:
+        # Drop columns from a newer agent that this backend does not know
+        pick = operator.itemgetter(0, *positions)
+        rows = map(pick, rows)
+
+    # NaN marks a missing value; a row with an infinite one is rejected like in JSON batches
+    columns = np.frombuffer(data, dtype="<f8", offset=ids_end).reshape(sample_count, field_count + 1)
+    finite = (~np.isinf(columns[:, positions]).any(axis=1)).tolist()
+
+    low, high = _timestamp_window(now)
+    accepted = [r for r, ok in zip(rows, finite) if ok and low <= r[0] <= high]
+    return tuple(ids[position - 1] for position in positions), accepted, sample_count - len(accepted)
+
+
+def encode_binary_batch(fields: Sequence[str], rows: Sequence[Sequence]) -> bytes:
+    """Encode rows of (timestamp, value, ...) for the given fields; None becomes NaN"""
+    ids = [FIELD_IDS[name] for name in fields]
+    row = struct.Struct(f"<{len(ids) + 1}d")
+    parts = [_BINARY_HEADER.pack(BINARY_MAGIC, len(ids), len(rows)), struct.pack(f"<{len(ids)}H", *ids)]
+    for values in rows:
+        parts.append(row.pack(*(math.nan if value is None else value for value in values)))
+    return b"".join(parts)
+
+
+def _timestamp_window(now: Optional[float]) -> tuple[float, float]:
+    now = time.time() if now is None else now
+    return now - MAX_AGE, now + MAX_CLOCK_SKEW
+
+
+def _is_number(value) -> bool:
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return False
+    try:
+        return math.isfinite(value)
+    except OverflowError:
+        # A JSON integer too large for a float
+        return False
@@ -0,0 +1,80 @@
+"""
+Prometheus text exposition format (version 0.0.4).
+
+Exposition collects metric families - one HELP and TYPE line each, then a
+line per labelled sample - and renders them in the order they were first
+added:
+
+    # HELP server_cpu_percent cpu_percent in the latest stored sample
+    # TYPE server_cpu_percent gauge
+    server_cpu_percent{server_id="3",server="web-1"} 12.5
+
+Rendering is linear in the number of samples; nothing here does I/O.
+"""
+
+import math
+from typing import Optional
+
+from .fields import FIELDS
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Cumulative fields are counters; every other sample field is a gauge
+_COUNTER_FIELDS = {
+    "net_bytes_sent": "server_net_sent_bytes_total",
+    "net_bytes_recv": "server_net_received_bytes_total",
+}
+
+# (metric name, type, help) for each sample field
+SAMPLE_METRICS = {
+    name: (_COUNTER_FIELDS[name], "counter", f"{name} as last reported by the host")
+    if name in _COUNTER_FIELDS else (f"server_{name}", "gauge", f"{name} in the latest stored sample")
+    for name in FIELDS
+}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _label(value) -> str:
+    return _escape(value).replace('"', '\\"')
+
+
+def _number(value) -> str:
+    if value is True or value is False:
+        return "1" if value else "0"
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(int(value)) if value.is_integer() and abs(value) < 1e15 else repr(value)
+
+
+class Exposition:
+    """Metric families in insertion order, rendered as exposition text"""
+
+    def __init__(self):
+        self._families: dict = {}  # name -> (type, help, lines)
+
+    def add(self, name: str, kind: str, help_text: str, value, labels: Optional[dict] = None) -> None:
+        """One sample of a family; None values are skipped"""
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (kind, help_text, [])
+        if value is None:
+            return
+        label_text = ""
+        if labels:
+            label_text = "{" + ",".join(f'{key}="{_label(val)}"' for key, val in labels.items()) + "}"
+        family[2].append(f"{name}{label_text} {_number(value)}")
+
+    def render(self) -> str:
+        parts = []
+        for name, (kind, help_text, lines) in self._families.items():
+            parts.append(f"# HELP {name} {_escape(help_text)}")
+            parts.append(f"# TYPE {name} {kind}")
+            parts.extend(lines)
+        return "\n".join(parts) + "\n"
@@ -0,0 +1,185 @@
+"""
+Daily per-server summaries for reports.
+
+Once a UTC day is over, each server's samples of that day are read back from
+the metrics store (segment files plus the in-memory tail) once and reduced
+to a models.DailySummary row:
+
+    samples, uptime_percent, cpu_avg / cpu_max, mem_avg / mem_max (percent),
+    disk_used_start_gb / disk_used_end_gb, outage_seconds and outages
+
+Days are summarised when a server's first sample of a later day arrives (the
+rollover), so a report over months reads one row per server and day instead
+of history. Servers that stopped reporting have no rollover: run
+`python -m backend.metrics.reports` once a day (e.g. from cron) to summarise
+their days too.
+
+Uptime is the share of the day covered by samples: a gap longer than
+REPORT_OUTAGE_GAP seconds (default 300) between consecutive samples - or
+between midnight and the first or last sample - is an outage. That is exact
+for hosts with a push agent; for hosts that are only polled it also counts
+the time nobody had the dashboard open. Time before the server was
+registered or before its oldest stored sample (not collected yet, or
+dropped by retention) is left out, and catching up never goes back more
+than REPORT_BACKFILL_DAYS (default 35).
+"""
+
+import json
+import math
+import os
+import threading
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+from ..db import db
+from ..models import DailySummary
+from .store import MetricsStore, metrics_store
+
+
+OUTAGE_GAP = float(os.getenv("REPORT_OUTAGE_GAP", "300"))
+BACKFILL_DAYS = int(os.getenv("REPORT_BACKFILL_DAYS", "35"))
+
+_FIELDS = ("cpu_percent", "mem_percent", "disk_used_gb")
+_DAY = 86400
+
+
+def day_start(day: date) -> float:
+    return datetime.combine(day, dt_time(), tzinfo=timezone.utc).timestamp()
+
+
+def utc_day(ts: float) -> date:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).date()
+
+
+def summarize_day(store: MetricsStore, server_id: int, day: date, not_before: Optional[float] = None) -> dict:
+    """DailySummary column values for one server and day, from stored samples"""
+    start = day_start(day)
+    end = start + _DAY
+    if not_before is not None:
+        start = min(max(start, not_before), end)
+    chunks = list(store.iter_history(server_id, start, math.nextafter(end, -math.inf), _FIELDS))
+    if chunks:
+        timestamps = np.concatenate([chunk[0] for chunk in chunks])
+        values = np.concatenate([chunk[2] for chunk in chunks])
+    else:
+        timestamps, values = np.empty(0), np.empty((0, len(_FIELDS)))
+
+    bounds = np.concatenate(([start], timestamps, [end]))
+    gaps = np.diff(bounds)
+    down = gaps > OUTAGE_GAP
+    outages = np.column_stack((bounds[:-1][down], bounds[1:][down]))
+    outage_seconds = float(gaps[down].sum())
+    span = end - start
+
+    summary = {
+        "samples": len(timestamps),
+        "uptime_percent": round(100 * (1 - outage_seconds / span), 3) if span > 0 else 0.0,
+        "outage_seconds": round(outage_seconds, 1),
+        "outages": json.dumps([[round(a, 1), round(b, 1)] for a, b in outages.tolist()]),
+    }
+    for name, column in (("cpu", values[:, 0]), ("mem", values[:, 1])):
+        column = column[~np.isnan(column)]
+        summary[f"{name}_avg"] = round(float(column.mean()), 3) if len(column) else None
+        summary[f"{name}_max"] = round(float(column.max()), 3) if len(column) else None
+    disk = values[:, 2][~np.isnan(values[:, 2])]
+    summary["disk_used_start_gb"] = round(float(disk[0]), 3) if len(disk) else None
+    summary["disk_used_end_gb"] = round(float(disk[-1]), 3) if len(disk) else None
+    return summary
+
+
+class DailyReports:
+    """Writes DailySummary rows for finished days"""
+
+    def __init__(self, store: MetricsStore = metrics_store, backfill_days: int = BACKFILL_DAYS):
+        self.store = store
+        self.backfill_days = backfill_days
+        self._lock = threading.Lock()
+        self._done: dict = {}  # server_id -> last summarised day
+
+    def observe(self, server, ts: float) -> int:
+        """Note a sample at ts; on the server's first sample of a new day, summarise the days before it"""
+        day = min(utc_day(ts), datetime.utcnow().date())
+        done = self._done.get(server.id)
+        if done is not None and done >= day - timedelta(days=1):
+            return 0
+        return self.catch_up(server, day - timedelta(days=1))
+
+    def catch_up(self, server, until: Optional[date] = None) -> int:
+        """Summarise the server's unsummarised days up to `until` (default yesterday)
+
+        Days before the server's oldest stored sample are skipped: there is
+        nothing to summarise them from. Rows are added to the database
+        session - the caller commits.
+        """
+        until = until or datetime.utcnow().date() - timedelta(days=1)
+        oldest = self.store.first_timestamp(server.id)
+        if oldest is None:
+            return 0
+        registered = server.created_at.replace(tzinfo=timezone.utc).timestamp() if server.created_at else None
+        not_before = oldest if registered is None else max(oldest, registered)
+        first = max(datetime.utcnow().date() - timedelta(days=self.backfill_days), utc_day(not_before))
+        with self._lock:
+            done = self._done.get(server.id)
+            if done is not None and done >= until:
+                return 0
+            existing = {
+                row.day for row in DailySummary.query.with_entities(DailySummary.day)
+                .filter(DailySummary.server_id == server.id, DailySummary.day >= first, DailySummary.day <= until)
+            }
+            added = 0
+            day = first
+            while day <= until:
+                if day not in existing:
+                    db.session.add(DailySummary(server_id=server.id, day=day,
+                                                **summarize_day(self.store, server.id, day, not_before)))
+                    added += 1
+                day += timedelta(days=1)
+            self._done[server.id] = until
+            return added
+
+    def forget(self, server_id: int) -> None:
+        with self._lock:
+            self._done.pop(server_id, None)
+
+
+def combine(rows: Sequence[DailySummary]) -> dict:
+    """Totals over a server's daily rows (oldest first) for a report period"""
+    sampled = [row for row in rows if row.samples]
+    weights = sum(row.samples for row in sampled if row.cpu_avg is not None)
+    mem_weights = sum(row.samples for row in sampled if row.mem_avg is not None)
+    disks = [row for row in rows if row.disk_used_end_gb is not None]
+    growth = [row.disk_growth_gb() for row in rows if row.disk_growth_gb() is not None]
+    return {
+        "days": len(rows),
+        "samples": sum(row.samples for row in rows),
+        "uptime_percent": round(sum(row.uptime_percent for row in rows) / len(rows), 3) if rows else None,
+        "cpu_avg": round(sum(row.cpu_avg * row.samples for row in sampled if row.cpu_avg is not None) / weights, 3) if weights else None,
+        "cpu_max": _max(row.cpu_max for row in rows),
+        "mem_avg": round(sum(row.mem_avg * row.samples for row in sampled if row.mem_avg is not None) / mem_weights, 3) if mem_weights else None,
+        "mem_max": _max(row.mem_max for row in rows),
+        "disk_used_gb": disks[-1].disk_used_end_gb if disks else None,
+        # Summed day by day, so a gap in the data does not count as growth
+        "disk_growth_gb_per_day": round(sum(growth) / len(growth), 3) if growth else None,
+        "outage_seconds": round(sum(row.outage_seconds for row in rows), 1),
+        "outages": sum(len(json.loads(row.outages)) if row.outages else 0 for row in rows),
+    }
+
+
+def _max(values: Iterable[Optional[float]]) -> Optional[float]:
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+daily_reports = DailyReports()
+
+
+if __name__ == "__main__":
+    from ..app import app
+    from ..models import Server
+
+    with app.app_context():
+        added = sum(daily_reports.catch_up(server) for server in Server.query.filter_by(is_demo=False).all())
+        db.session.commit()
+        print(f"Added {added} daily summaries")
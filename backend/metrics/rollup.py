@@ -0,0 +1,315 @@
+"""
+Downsampled history that keeps its tails: mergeable quantile sketches per window.
+
+Every sample accepted by the metrics store is also folded into fixed time
+windows per server - by default 5-minute windows for a day and 1-hour windows
+for a week (METRICS_ROLLUP_TIERS, "width:count,...") - where each rolled-up
+field keeps count, sum, min, max and a DDSketch-style histogram: values fall
+into logarithmic buckets of relative width ROLLUP_ACCURACY (default 1%), so
+any quantile read back is within that relative error of a real sample.
+Unlike averages, these sketches merge exactly: the p99 of an hour is
+computed from the merged buckets of its twelve 5-minute windows, so history
+can be served at any resolution (a multiple of a tier's width) without
+reading raw samples and without hiding spikes.
+
+Values <= 0 are counted in a separate zero bucket.
+"""
+
+import bisect
+import math
+import os
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+from .fields import FIELD_IDS
+
+
+ACCURACY = float(os.getenv("ROLLUP_ACCURACY", "0.01"))
+
+
+def _parse_tiers(text: str) -> tuple:
+    tiers = []
+    for part in text.split(","):
+        width, _, count = part.partition(":")
+        tiers.append((int(width), int(count)))
+    return tuple(sorted(tiers))
+
+
+TIERS = _parse_tiers(os.getenv("METRICS_ROLLUP_TIERS", "300:288,3600:168"))
+
+# Gauges worth a percentile; totals, counters and uptime are not rolled up
+ROLLUP_FIELDS = (
+    "cpu_percent",
+    "load_1",
+    "mem_used_gb",
+    "mem_percent",
+    "disk_used_gb",
+    "disk_percent",
+    "disk_read_bytes_per_sec",
+    "disk_write_bytes_per_sec",
+    "net_bytes_sent_per_sec",
+    "net_bytes_recv_per_sec",
+)
+
+_ROLLUP_IDS = frozenset(FIELD_IDS[name] for name in ROLLUP_FIELDS)
+
+_GAMMA = (1 + ACCURACY) / (1 - ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+
+class Sketch:
+    """Count, sum, min, max and log-bucket histogram of a set of values; mergeable"""
+    __slots__ = ("count", "total", "low", "high", "zeros", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.low = math.inf
+        self.high = -math.inf
+        self.zeros = 0
+        self.buckets: dict = {}
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value < self.low:
+            self.low = value
+        if value > self.high:
+            self.high = value
+        if value <= 0:
+            self.zeros += 1
+        else:
+            index = math.ceil(math.log(value) / _LOG_GAMMA)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other: "Sketch") -> None:
+        self.count += other.count
+        self.total += other.total
+        self.low = min(self.low, other.low)
+        self.high = max(self.high, other.high)
+        self.zeros += other.zeros
+        buckets = self.buckets
+        for index, count in other.buckets.items():
+            buckets[index] = buckets.get(index, 0) + count
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return min(max(0.0, self.low), self.high)
+        seen = self.zeros
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # Midpoint of the bucket (gamma^(i-1), gamma^i], clamped to what was seen
+                value = 2 * _GAMMA ** index / (_GAMMA + 1)
+                return min(max(value, self.low), self.high)
+        return self.high
+
+    def summary(self, quantiles: Sequence[float]) -> dict:
+        result = {
+            "count": self.count,
+            "avg": round(self.total / self.count, 3) if self.count else None,
+            "min": round(self.low, 3) if self.count else None,
+            "max": round(self.high, 3) if self.count else None,
+        }
+        for q in quantiles:
+            value = self.quantile(q)
+            result[f"p{q * 100:g}"] = round(value, 3) if value is not None else None
+        return result
+
+
+class _Tier:
+    """Windows of one width for one server, oldest first"""
+    __slots__ = ("width", "keep", "starts", "windows")
+
+    def __init__(self, width: int, keep: int):
+        self.width = width
+        self.keep = keep
+        self.starts = []
+        self.windows = []  # {field_id: Sketch} per window
+
+    def window(self, ts: float) -> Optional[dict]:
+        """Sketches of the window holding ts (created if needed); None if ts is older than the tier keeps"""
+        start = ts - ts % self.width
+        starts = self.starts
+        if starts and start == starts[-1]:
+            return self.windows[-1]
+        if not starts or start > starts[-1]:
+            starts.append(start)
+            self.windows.append({})
+            expired = bisect.bisect_right(starts, start - self.keep * self.width)
+            if expired:
+                del starts[:expired]
+                del self.windows[:expired]
+            return self.windows[-1]
+        if start <= starts[-1] - self.keep * self.width:
+            return None
+        index = bisect.bisect_left(starts, start)
+        if index < len(starts) and starts[index] == start:
+            return self.windows[index]
+        starts.insert(index, start)
+        self.windows.insert(index, {})
+        return self.windows[index]
+
+
+class Rollups:
+    """Windowed sketches per server for every tier. Not locked: MetricsStore calls it under its own lock"""
+
+    def __init__(self, tiers: Sequence[tuple] = TIERS):
+        self.tiers = tuple(tiers)
+        self._servers: dict = {}
+
+    def add_row(self, server_id: int, field_ids: Sequence[int], row: Sequence) -> None:
+        """Fold one sample row of (timestamp, value, ...) into every tier"""
+        tiers = self._servers.get(server_id)
+        if tiers is None:
+            tiers = self._servers[server_id] = [_Tier(width, keep) for width, keep in self.tiers]
+        ts = row[0]
+        values = [(field_id, row[position]) for position, field_id in enumerate(field_ids, start=1)
+                  if field_id in _ROLLUP_IDS and row[position] is not None and row[position] == row[position]]
+        if not values:
+            return
+        for tier in tiers:
+            window = tier.window(ts)
+            if window is None:
+                continue
+            for field_id, value in values:
+                sketch = window.get(field_id)
+                if sketch is None:
+                    sketch = window[field_id] = Sketch()
+                sketch.add(value)
+
+    def add_columns(self, server_id: int, timestamps: np.ndarray, field_ids: Sequence[int], values: np.ndarray) -> None:
+        """Fold many samples at once, as add_row would one by one; values has a column per field id (NaN = missing)
+
+        Used to rebuild the rollups from segment files, where a week of a
+        server's samples would take seconds row by row.
+        """
+        if not len(timestamps):
+            return
+        tiers = self._servers.get(server_id)
+        if tiers is None:
+            tiers = self._servers[server_id] = [_Tier(width, keep) for width, keep in self.tiers]
+        for tier in tiers:
+            window_starts = timestamps - timestamps % tier.width
+            # Skip what the tier would expire straight away (most of a week for the 5-minute tier)
+            newest = max(window_starts.max(), tier.starts[-1] if tier.starts else -np.inf)
+            recent = window_starts > newest - tier.keep * tier.width
+            starts, slots = np.unique(window_starts[recent], return_inverse=True)
+            slots = slots.reshape(-1)
+            tier_values = values[recent]
+            windows = [{} for _ in range(len(starts))]  # field_id -> Sketch, per window start
+            for column, field_id in enumerate(field_ids):
+                if field_id not in _ROLLUP_IDS:
+                    continue
+                valid = ~np.isnan(tier_values[:, column])
+                value, slot = tier_values[valid, column], slots[valid]
+                counts = np.bincount(slot, minlength=len(starts))
+                totals = np.bincount(slot, weights=value, minlength=len(starts))
+                lows = np.full(len(starts), np.inf)
+                np.minimum.at(lows, slot, value)
+                highs = np.full(len(starts), -np.inf)
+                np.maximum.at(highs, slot, value)
+                zeros = np.bincount(slot[value <= 0], minlength=len(starts))
+                for index in np.flatnonzero(counts).tolist():
+                    sketch = windows[index][field_id] = Sketch()
+                    sketch.count, sketch.total = int(counts[index]), float(totals[index])
+                    sketch.low, sketch.high, sketch.zeros = float(lows[index]), float(highs[index]), int(zeros[index])
+                positive = value > 0
+                buckets = np.ceil(np.log(value[positive]) / _LOG_GAMMA).astype(np.int64)
+                if not len(buckets):
+                    continue
+                # One integer key per (window, bucket) pair, counted in one pass
+                low_bucket = int(buckets.min())
+                spread = int(buckets.max()) - low_bucket + 1
+                keys, key_counts = np.unique(slot[positive] * spread + (buckets - low_bucket), return_counts=True)
+                for key, count in zip(keys.tolist(), key_counts.tolist()):
+                    index, bucket = divmod(key, spread)
+                    windows[index][field_id].buckets[bucket + low_bucket] = count
+            for start, sketches in zip(starts.tolist(), windows):
+                if not sketches:
+                    continue
+                window = tier.window(start)
+                if window is None:
+                    continue
+                for field_id, sketch in sketches.items():
+                    target = window.get(field_id)
+                    if target is None:
+                        window[field_id] = sketch
+                    else:
+                        target.merge(sketch)
+
+    def span(self) -> float:
+        """Seconds of history the longest tier keeps"""
+        return max((width * keep for width, keep in self.tiers), default=0)
+
+    def query(self, server_id: int, resolution: float, since: Optional[float] = None, until: Optional[float] = None,
+              fields: Iterable[str] = ROLLUP_FIELDS, quantiles: Sequence[float] = (0.5, 0.95, 0.99)) -> dict:
+        """Merged summaries per resolution-wide bucket, oldest first
+
+        Uses the coarsest tier whose windows fit the resolution (and still
+        reach back to `since`); the resolution is rounded up to a multiple of
+        that tier's width.
+        """
+        if not math.isfinite(resolution) or resolution <= 0:
+            raise ValueError(f"resolution must be a positive number of seconds, not {resolution!r}")
+        tiers = self._servers.get(server_id)
+        tier = self._pick_tier(tiers, resolution, since)
+        if tier is None:
+            return {"resolution": None, "points": []}
+        width = tier.width
+        step = max(width, math.ceil(resolution / width) * width)
+        field_ids = [FIELD_IDS[name] for name in fields if name in FIELD_IDS and FIELD_IDS[name] in _ROLLUP_IDS]
+
+        first = bisect.bisect_left(tier.starts, since - since % step) if since is not None else 0
+        last = bisect.bisect_right(tier.starts, until) if until is not None else len(tier.starts)
+        points = []
+        bucket_start, merged = None, None
+        for index in range(first, last):
+            start = tier.starts[index]
+            bucket = start - start % step
+            if bucket != bucket_start:
+                if merged is not None:
+                    points.append(self._point(bucket_start, merged, quantiles))
+                bucket_start, merged = bucket, {}
+            for field_id in field_ids:
+                sketch = tier.windows[index].get(field_id)
+                if sketch is None:
+                    continue
+                target = merged.get(field_id)
+                if target is None:
+                    target = merged[field_id] = Sketch()
+                target.merge(sketch)
+        if merged is not None:
+            points.append(self._point(bucket_start, merged, quantiles))
+        return {"resolution": step, "points": points}
+
+    def _pick_tier(self, tiers: Optional[list], resolution: float, since: Optional[float]) -> Optional[_Tier]:
+        if not tiers:
+            return None
+        fitting = [tier for tier in tiers if tier.width <= resolution] or [tiers[0]]
+        for tier in reversed(fitting):
+            if since is None or not tier.starts or tier.starts[0] <= since:
+                return tier
+        # Nothing reaches back far enough: use the tier with the longest history
+        return min(tiers, key=lambda tier: tier.starts[0] if tier.starts else math.inf)
+
+    @staticmethod
+    def _point(start: float, merged: dict, quantiles: Sequence[float]) -> dict:
+        point = {"timestamp": start}
+        for field_id, sketch in merged.items():
+            point[_FIELD_NAMES[field_id]] = sketch.summary(quantiles)
+        return point
+
+    def forget(self, server_id: int) -> None:
+        self._servers.pop(server_id, None)
+
+    def stats(self) -> dict:
+        windows = sum(len(tier.starts) for tiers in self._servers.values() for tier in tiers)
+        return {"tiers": [{"width": width, "windows": keep} for width, keep in self.tiers], "windows": windows}
+
+
+_FIELD_NAMES = {field_id: name for name, field_id in FIELD_IDS.items()}
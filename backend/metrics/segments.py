@@ -0,0 +1,431 @@
+"""
+Persistent metrics history: append-only segment files of fixed-width records.
+
+Each server's samples are appended to segment files under
+METRICS_SEGMENT_DIR (default instance/metrics), one directory per server
+and one file per SEGMENT_RECORDS samples (default 8640, a day at 10s),
+named after the first sample's timestamp:
+
+    header   4s B B H 8x   magic b"SMS1", version, flags (1 = sorted), field count
+    records  <f8 timestamp, <u1 source (0 pull, 1 push), field count x <f8 values (NaN = missing)
+
+Reads memory-map the files and slice the timestamp and value columns as
+NumPy views, so a query over months of history only copies the rows it
+returns. A crash can leave at most a partial record at the end of the
+active segment; readers ignore it and the next append truncates it away.
+
+When a segment is full it is sealed: compacted (sorted by timestamp,
+duplicates dropped, rewritten through a temporary file and an atomic
+rename) and merged with the previous sealed segment if both are small.
+Segments whose newest sample is older than METRICS_RETENTION_DAYS (default
+90) are deleted at the same time, and by a pass over every server each
+METRICS_COMPACT_INTERVAL seconds (see writer.py). `python -m
+backend.metrics.segments` compacts and applies retention to every server.
+
+Set METRICS_SEGMENTS=0 to keep history in memory only.
+"""
+
+import os
+import shutil
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Sequence
+
+import numpy as np
+
+from .fields import FIELD_IDS, FIELDS
+
+
+ENABLED = os.getenv("METRICS_SEGMENTS", "1").lower() not in ("0", "false", "no")
+SEGMENT_DIR = Path(os.getenv("METRICS_SEGMENT_DIR") or Path(__file__).resolve().parents[2] / "instance" / "metrics")
+SEGMENT_RECORDS = int(os.getenv("SEGMENT_RECORDS", "8640"))
+RETENTION = float(os.getenv("METRICS_RETENTION_DAYS", "90")) * 86400
+
+MAGIC = b"SMS1"
+VERSION = 1
+FLAG_SORTED = 1
+
+# magic, version, flags, field count, reserved
+_HEADER = struct.Struct("<4sBBH8x")
+
+SOURCES = ("pull", "push")
+_SOURCE_CODES = {name: code for code, name in enumerate(SOURCES)}
+
+
+def record_dtype(field_count: int = len(FIELDS)) -> np.dtype:
+    """Fixed-width record layout for segments written with field_count fields"""
+    return np.dtype([("timestamp", "<f8"), ("source", "u1"), ("values", "<f8", (field_count,))])
+
+
+class _Segment:
+    """A segment file and what is known about it without reading it"""
+    __slots__ = ("path", "start", "field_count", "count", "flags", "last_ts")
+
+    def __init__(self, path: Path, start: float, field_count: int, count: int, flags: int, last_ts: Optional[float] = None):
+        self.path = path
+        self.start = start
+        self.field_count = field_count
+        self.count = count
+        self.flags = flags
+        self.last_ts = last_ts
+
+    @classmethod
+    def open(cls, path: Path) -> Optional["_Segment"]:
+        try:
+            with open(path, "rb") as f:
+                header = f.read(_HEADER.size)
+            size = path.stat().st_size
+        except OSError:
+            return None
+        if len(header) < _HEADER.size:
+            return None
+        magic, _version, flags, field_count = _HEADER.unpack(header)
+        if magic != MAGIC:
+            return None
+        count = (size - _HEADER.size) // record_dtype(field_count).itemsize
+        return cls(path, float(path.stem), field_count, count, flags)
+
+    def records(self) -> np.ndarray:
+        """Memory-mapped records (read-only); trailing partial records are ignored"""
+        if self.count == 0:
+            return np.empty(0, dtype=record_dtype(self.field_count))
+        return np.memmap(self.path, dtype=record_dtype(self.field_count), mode="r", offset=_HEADER.size, shape=(self.count,))
+
+
+def _write_segment(path: Path, records: np.ndarray, flags: int) -> None:
+    """Write a complete segment through a temporary file and rename it into place"""
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, flags, records.dtype["values"].shape[0]))
+        f.write(records.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class SegmentStore:
+    """Append-only on-disk history per server"""
+
+    def __init__(self, root: Path = SEGMENT_DIR, segment_records: int = SEGMENT_RECORDS, retention: float = RETENTION):
+        self.root = Path(root)
+        self.segment_records = max(1, segment_records)
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._active: dict = {}  # server_id -> _Segment being appended to
+        self._dirty: set = set()  # paths appended to since the last sync()
+
+    def _server_dir(self, server_id: int) -> Path:
+        return self.root / str(int(server_id))
+
+    def _segments(self, server_id: int) -> list:
+        directory = self._server_dir(server_id)
+        if not directory.is_dir():
+            return []
+        segments = [_Segment.open(path) for path in directory.glob("*.seg")]
+        return sorted((s for s in segments if s is not None), key=lambda s: s.start)
+
+    def append(self, server_id: int, rows: Sequence[Sequence], source: str = "pull") -> int:
+        """Append rows of (timestamp, value, ...) in FIELDS order; returns how many were written"""
+        if not rows:
+            return 0
+        records = np.empty(len(rows), dtype=record_dtype())
+        records["timestamp"] = [row[0] for row in rows]
+        records["source"] = _SOURCE_CODES.get(source, 0)
+        # dtype=float turns None into NaN
+        records["values"] = np.array([row[1:] for row in rows], dtype=float).reshape(len(rows), len(FIELDS))
+        with self._lock:
+            written = 0
+            while written < len(records):
+                segment = self._writable(server_id, float(records["timestamp"][written]))
+                chunk = records[written:written + self.segment_records - segment.count]
+                self._append_records(segment, chunk)
+                written += len(chunk)
+                if segment.count >= self.segment_records:
+                    self._seal(server_id)
+            return written
+
+    def sync(self) -> int:
+        """fsync every segment appended to since the last call; returns how many files were synced"""
+        with self._lock:
+            paths, self._dirty = self._dirty, set()
+        synced = 0
+        try:
+            for path in list(paths):
+                try:
+                    fd = os.open(path, os.O_RDONLY)
+                except FileNotFoundError:
+                    # Merged away (and written durably) by a compaction
+                    paths.discard(path)
+                    continue
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                paths.discard(path)
+                synced += 1
+        finally:
+            if paths:
+                with self._lock:
+                    self._dirty |= paths
+        return synced
+
+    def _writable(self, server_id: int, first_ts: float) -> _Segment:
+        """The server's active segment, resumed from disk or started at first_ts (caller holds the lock)"""
+        segment = self._active.get(server_id)
+        if segment is not None and segment.count < self.segment_records:
+            return segment
+        if segment is None:
+            existing = self._segments(server_id)
+            last = existing[-1] if existing else None
+            if last is not None and last.field_count == len(FIELDS) and last.count < self.segment_records:
+                # Resume after a restart, dropping a record cut short by a crash
+                with open(last.path, "r+b") as f:
+                    f.truncate(_HEADER.size + last.count * record_dtype().itemsize)
+                records = last.records()
+                last.last_ts = float(records["timestamp"].max()) if len(records) else None
+                self._active[server_id] = last
+                return last
+        directory = self._server_dir(server_id)
+        directory.mkdir(parents=True, exist_ok=True)
+        start = int(first_ts)
+        path = directory / f"{start}.seg"
+        while path.exists():
+            start += 1
+            path = directory / f"{start}.seg"
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, FLAG_SORTED, len(FIELDS)))
+        segment = self._active[server_id] = _Segment(path, float(start), len(FIELDS), 0, FLAG_SORTED)
+        return segment
+
+    def _append_records(self, segment: _Segment, records: np.ndarray) -> None:
+        timestamps = records["timestamp"]
+        in_order = bool(np.all(timestamps[1:] > timestamps[:-1])) and (segment.last_ts is None or timestamps[0] > segment.last_ts)
+        if not in_order and segment.flags & FLAG_SORTED:
+            # Cleared before the records land, so a crash never leaves unsorted data marked sorted
+            segment.flags &= ~FLAG_SORTED
+            with open(segment.path, "r+b") as f:
+                f.seek(5)
+                f.write(bytes([segment.flags]))
+        self._dirty.add(segment.path)
+        with open(segment.path, "ab") as f:
+            f.write(records.tobytes())
+        segment.count += len(records)
+        segment.last_ts = float(timestamps.max()) if segment.last_ts is None else max(segment.last_ts, float(timestamps.max()))
+
+    def _seal(self, server_id: int) -> None:
+        """Compact a full segment, merge small neighbours and apply retention (caller holds the lock)"""
+        self._active.pop(server_id, None)
+        self._compact(server_id)
+
+    def _compact(self, server_id: int, now: Optional[float] = None) -> None:
+        """Sort/dedup unsorted sealed segments, merge small neighbours, delete expired ones (caller holds the lock)"""
+        active = self._active.get(server_id)
+        cutoff = (time.time() if now is None else now) - self.retention
+        sealed = [s for s in self._segments(server_id) if active is None or s.path != active.path]
+        kept = []
+        for segment in sealed:
+            records = segment.records()
+            if len(records) == 0 or float(records["timestamp"].max()) < cutoff:
+                del records
+                segment.path.unlink(missing_ok=True)
+                continue
+            if not segment.flags & FLAG_SORTED or segment.field_count != len(FIELDS):
+                records = _normalise(records)
+                _write_segment(segment.path, records, FLAG_SORTED)
+                segment.count, segment.flags, segment.field_count = len(records), FLAG_SORTED, len(FIELDS)
+            kept.append(segment)
+
+        # Merge runs of small segments (left by restarts or early rotation) up to one segment's size
+        small = self.segment_records // 4
+        index = 0
+        while index + 1 < len(kept):
+            first, second = kept[index], kept[index + 1]
+            if first.count < small and first.count + second.count <= self.segment_records:
+                merged = _normalise(np.concatenate([np.array(first.records()), np.array(second.records())]))
+                _write_segment(first.path, merged, FLAG_SORTED)
+                second.path.unlink(missing_ok=True)
+                first.count = len(merged)
+                del kept[index + 1]
+            else:
+                index += 1
+
+    def server_ids(self) -> list:
+        """Servers with a segment directory"""
+        if not self.root.is_dir():
+            return []
+        return sorted(int(directory.name) for directory in self.root.iterdir()
+                      if directory.is_dir() and directory.name.isdigit())
+
+    def compact(self, server_id: Optional[int] = None) -> None:
+        """Compact and apply retention to one server's segments (or every server's)"""
+        if server_id is None:
+            # One server at a time, so reads and appends are not held up for the whole pass
+            for server_id in self.server_ids():
+                self.compact(server_id)
+            return
+        with self._lock:
+            self._compact(server_id)
+
+    def _candidates(self, server_id: int, low: float, high: float) -> list:
+        """Segments that may hold samples between low and high, oldest first"""
+        with self._lock:
+            segments = self._segments(server_id)
+        # A segment holds samples from its start up to the next one's start, plus the odd late arrival
+        # in the following segment - so read one segment past `high`
+        candidates = []
+        for index, segment in enumerate(segments):
+            following = segments[index + 1].start if index + 1 < len(segments) else np.inf
+            if following < low:
+                continue
+            candidates.append(segment)
+            if segment.start > high:
+                break
+        return candidates
+
+    @staticmethod
+    def _select(segment: _Segment, low: float, high: float, field_ids: Sequence[int]) -> Optional[tuple]:
+        """(timestamps, sources, values) of a segment between low and high, or None if there are none"""
+        records = segment.records()
+        timestamps = records["timestamp"]
+        if segment.flags & FLAG_SORTED:
+            # Sorted: the range is a contiguous slice, i.e. a view of the mapped file
+            start = np.searchsorted(timestamps, low, side="left")
+            end = np.searchsorted(timestamps, high, side="right")
+            selected = records[start:end]
+        else:
+            selected = records[(timestamps >= low) & (timestamps <= high)]
+            # Sorted and without repeats (a batch retried after a restart) until the segment is compacted
+            _, first = np.unique(selected["timestamp"], return_index=True)
+            selected = selected[first]
+        if len(selected) == 0:
+            return None
+        values = selected["values"]
+        columns = np.full((len(selected), len(field_ids)), np.nan)
+        for column, field_id in enumerate(field_ids):
+            if field_id < segment.field_count:
+                columns[:, column] = values[:, field_id]
+        return np.array(selected["timestamp"]), np.array(selected["source"]), columns
+
+    def read(self, server_id: int, since: Optional[float] = None, until: Optional[float] = None,
+             fields: Optional[Iterable[str]] = None, limit: Optional[int] = None) -> tuple:
+        """Samples with since <= timestamp <= until, oldest first (the newest `limit` if set)
+
+        Returns (timestamps, sources, values) arrays; values has one column per field.
+        """
+        fields = FIELDS if fields is None else tuple(fields)
+        field_ids = [FIELD_IDS[name] for name in fields]
+        low = -np.inf if since is None else since
+        high = np.inf if until is None else until
+
+        parts = []
+        collected = 0
+        for segment in reversed(self._candidates(server_id, low, high)):
+            part = self._select(segment, low, high, field_ids)
+            if part is None:
+                continue
+            parts.append(part)
+            collected += len(part[0])
+            if limit is not None and collected >= limit:
+                break
+
+        if not parts:
+            return np.empty(0), np.empty(0, dtype="u1"), np.empty((0, len(field_ids)))
+        parts.reverse()
+        timestamps = np.concatenate([p[0] for p in parts])
+        sources = np.concatenate([p[1] for p in parts])
+        values = np.concatenate([p[2] for p in parts])
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, sources, values = timestamps[order], sources[order], values[order]
+        if limit is not None:
+            timestamps, sources, values = timestamps[-limit:], sources[-limit:], values[-limit:]
+        return timestamps, sources, values
+
+    def first_timestamp(self, server_id: int) -> Optional[float]:
+        """Timestamp of the server's oldest sample on disk, or None"""
+        for segment in self._candidates(server_id, -np.inf, np.inf):
+            try:
+                timestamps = segment.records()["timestamp"]
+                if len(timestamps):
+                    return float(timestamps[0] if segment.flags & FLAG_SORTED else timestamps.min())
+            except FileNotFoundError:
+                continue
+        return None
+
+    def chunks(self, server_id: int, since: Optional[float] = None, until: Optional[float] = None,
+               fields: Optional[Iterable[str]] = None) -> Iterator[tuple]:
+        """Like read(), one segment at a time: yields (timestamps, sources, values) per segment, oldest first
+
+        Only one segment's rows are copied at a time, however long the range.
+        """
+        fields = FIELDS if fields is None else tuple(fields)
+        field_ids = [FIELD_IDS[name] for name in fields]
+        low = -np.inf if since is None else since
+        high = np.inf if until is None else until
+        for segment in self._candidates(server_id, low, high):
+            try:
+                part = self._select(segment, low, high, field_ids)
+            except FileNotFoundError:
+                # Merged into its (already read) predecessor by a compaction meanwhile
+                continue
+            if part is not None:
+                yield part
+
+    def samples(self, server_id: int, since: Optional[float] = None, until: Optional[float] = None,
+                fields: Optional[Iterable[str]] = None, limit: Optional[int] = None) -> list:
+        """read() as sample dicts, in the shape MetricsStore.history returns"""
+        fields = FIELDS if fields is None else tuple(fields)
+        timestamps, sources, values = self.read(server_id, since, until, fields, limit)
+        samples = []
+        for ts, source, row in zip(timestamps.tolist(), sources.tolist(), values.tolist()):
+            sample = {"timestamp": ts, "source": SOURCES[source] if source < len(SOURCES) else None}
+            for name, value in zip(fields, row):
+                sample[name] = None if value != value else value
+            samples.append(sample)
+        return samples
+
+    def forget(self, server_id: int) -> None:
+        """Delete a server's history from disk"""
+        with self._lock:
+            self._active.pop(server_id, None)
+            shutil.rmtree(self._server_dir(server_id), ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            files = list(self.root.glob("*/*.seg")) if self.root.is_dir() else []
+            return {
+                "dir": str(self.root),
+                "servers": len({path.parent.name for path in files}),
+                "segments": len(files),
+                "bytes": sum(path.stat().st_size for path in files),
+                "retention_days": self.retention / 86400,
+            }
+
+
+def _normalise(records: np.ndarray) -> np.ndarray:
+    """Records in the current layout, sorted by timestamp with duplicate timestamps dropped (first kept)"""
+    field_count = records.dtype["values"].shape[0]
+    if field_count != len(FIELDS):
+        upgraded = np.empty(len(records), dtype=record_dtype())
+        upgraded["timestamp"] = records["timestamp"]
+        upgraded["source"] = records["source"]
+        upgraded["values"] = np.nan
+        upgraded["values"][:, :field_count] = records["values"]
+        records = upgraded
+    order = np.argsort(records["timestamp"], kind="stable")
+    records = records[order]
+    keep = np.ones(len(records), dtype=bool)
+    keep[1:] = records["timestamp"][1:] != records["timestamp"][:-1]
+    return np.ascontiguousarray(records[keep])
+
+
+segment_store = SegmentStore() if ENABLED else None
+
+
+if __name__ == "__main__":
+    if segment_store is None:
+        print("METRICS_SEGMENTS is disabled")
+    else:
+        segment_store.compact()
+        print(f"Compacted {segment_store.root}: {segment_store.stats()}")
@@ -0,0 +1,364 @@
+"""
+Time series of metrics samples per server, held in memory and (see
+segments.py) appended to on-disk segments.
+
+A sample is a flat dict of numbers keyed by FIELDS plus a unix "timestamp"
+and a "source": "pull" when fetch_metrics probed the host over SSH/WinRM,
+"push" when an agent posted it to /api/ingest. Each server keeps its last
+METRICS_HISTORY_SIZE samples (default 2880, i.e. a day at 30s intervals);
+samples arriving out of order are slotted in by timestamp and a repeated
+timestamp (an agent retrying a batch) is ignored. Every new sample is also
+folded into the longer-lived percentile rollups of rollup.py and queued for
+the segment files (writer.py writes them in batches).
+"""
+
+import bisect
+import math
+import os
+import threading
+import time
+from typing import Iterable, Iterator, Optional, Sequence
+
+import numpy as np
+
+from .fields import FIELD_IDS, FIELDS
+from .rollup import ROLLUP_FIELDS, Rollups
+from .segments import SOURCES, SegmentStore, segment_store
+from .writer import WriteBuffer, WriteBufferFull, buffered
+
+
+MAX_SAMPLES = int(os.getenv("METRICS_HISTORY_SIZE", "2880"))
+
+_ALL_FIELD_IDS = tuple(range(len(FIELDS)))
+
+
+class _Series:
+    """Parallel lists, oldest first: timestamps, value rows in FIELDS order, and sources"""
+    __slots__ = ("timestamps", "rows", "sources")
+
+    def __init__(self):
+        self.timestamps = []
+        self.rows = []
+        self.sources = []
+
+
+def _value(value):
+    # Binary batches mark missing values with NaN; they are only converted on the way out
+    return None if value is None or value != value else value
+
+
+class MetricsStore:
+    """Bounded, timestamp-ordered sample history per server"""
+
+    def __init__(self, max_samples: int = MAX_SAMPLES, rollups: Optional[Rollups] = None,
+                 segments: Optional[SegmentStore] = None, writer: Optional[WriteBuffer] = None):
+        self.max_samples = max(1, max_samples)
+        self.rollups = rollups if rollups is not None else Rollups()
+        self.segments = segments
+        self.writer = writer
+        self._lock = threading.Lock()
+        self._series: dict = {}
+
+    def add(self, server_id: int, samples: Iterable[dict], source: str = "pull") -> int:
+        """Store samples given as dicts with a "timestamp"; returns how many were new"""
+        rows = ((sample["timestamp"], *(sample.get(name) for name in FIELDS)) for sample in samples)
+        return self.add_rows(server_id, _ALL_FIELD_IDS, rows, source)
+
+    def add_rows(self, server_id: int, field_ids: Sequence[int], rows: Iterable[Sequence], source: str = "pull",
+                 durable: bool = False) -> int:
+        """Store rows of (timestamp, value, ...) whose values follow field_ids; returns how many were new
+        
+        Rows that already carry every field in FIELDS order (what the agent
+        sends) are stored as they are, without building a dict per sample.
+        Raises WriteBufferFull before storing anything while the segment
+        writer is too far behind. With `durable` it is also raised when the
+        new rows are not on disk within the writer's timeout; they are then
+        already stored and queued, and the agent's retry of the batch adds
+        nothing because repeated timestamps are ignored.
+        """
+        if self.writer is not None:
+            self.writer.reserve()
+        field_ids = tuple(field_ids)
+        complete = field_ids == _ALL_FIELD_IDS
+        added = []
+        with self._lock:
+            series = self._series.get(server_id)
+            if series is None:
+                series = self._series[server_id] = _Series()
+            timestamps = series.timestamps
+            for row in rows:
+                ts = row[0]
+                if complete:
+                    values = tuple(row[1:])
+                else:
+                    values = [None] * len(FIELDS)
+                    for position, field_id in enumerate(field_ids, start=1):
+                        values[field_id] = row[position]
+                    values = tuple(values)
+                if not timestamps or ts > timestamps[-1]:
+                    timestamps.append(ts)
+                    series.rows.append(values)
+                    series.sources.append(source)
+                elif ts < timestamps[0] and len(timestamps) >= self.max_samples:
+                    # Older than anything kept (and would be trimmed straight away), possibly a retry
+                    continue
+                else:
+                    index = bisect.bisect_left(timestamps, ts)
+                    if index < len(timestamps) and timestamps[index] == ts:
+                        continue
+                    timestamps.insert(index, ts)
+                    series.rows.insert(index, values)
+                    series.sources.insert(index, source)
+                row = (ts, *values)
+                self.rollups.add_row(server_id, _ALL_FIELD_IDS, row)
+                added.append(row)
+            overflow = len(timestamps) - self.max_samples
+            if overflow > 0:
+                del timestamps[:overflow]
+                del series.rows[:overflow]
+                del series.sources[:overflow]
+        if self.writer is not None and added:
+            ticket = self.writer.submit(server_id, added, source)
+            if durable and not self.writer.wait(ticket):
+                raise WriteBufferFull(self.writer.stats()["queued_rows"], self.writer.timeout)
+        return len(added)
+
+    def latest(self, server_id: int, source: Optional[str] = None) -> Optional[dict]:
+        """Most recent sample for a server (optionally only from one source)"""
+        with self._lock:
+            series = self._series.get(server_id)
+            if series is None:
+                return None
+            for index in range(len(series.timestamps) - 1, -1, -1):
+                if source is None or series.sources[index] == source:
+                    return self._sample(series, index, FIELDS)
+        return None
+
+    def latest_rows(self, server_ids: Iterable[int]) -> dict:
+        """Newest (timestamp, row in FIELDS order) per server, for the servers that have samples"""
+        latest = {}
+        with self._lock:
+            for server_id in server_ids:
+                series = self._series.get(server_id)
+                if series is not None and series.timestamps:
+                    latest[server_id] = (series.timestamps[-1], series.rows[-1])
+        return latest
+
+    def history(self, server_id: int, since: Optional[float] = None, until: Optional[float] = None,
+                fields: Optional[Iterable[str]] = None, limit: Optional[int] = None) -> list:
+        """Samples with since <= timestamp <= until, oldest first (the newest `limit` if set)
+
+        Ranges reaching back past what is held in memory (or any range after
+        a restart) are read from the on-disk segments; the part still in
+        memory (which may not be written yet) comes from memory.
+        """
+        fields = FIELDS if fields is None else tuple(fields)
+        recent, older_until = [], until
+        with self._lock:
+            series = self._series.get(server_id)
+            if series is not None and series.timestamps:
+                start = bisect.bisect_left(series.timestamps, since) if since is not None else 0
+                end = bisect.bisect_right(series.timestamps, until) if until is not None else len(series.timestamps)
+                if limit is not None:
+                    start = max(start, end - limit)
+                recent = [self._sample(series, index, fields) for index in range(start, end)]
+                covered = since >= series.timestamps[0] if since is not None else limit is not None and end - start >= limit
+                if covered or self.segments is None:
+                    return recent
+                oldest = math.nextafter(series.timestamps[0], -math.inf)
+                older_until = oldest if until is None else min(until, oldest)
+            elif self.segments is None:
+                return []
+        limit = None if limit is None else limit - len(recent)
+        return self.segments.samples(server_id, since, older_until, fields, limit) + recent
+
+    def iter_history(self, server_id: int, since: Optional[float] = None, until: Optional[float] = None,
+                     fields: Optional[Iterable[str]] = None) -> Iterator[tuple]:
+        """All samples with since <= timestamp <= until in chunks, oldest first, for exports
+
+        Yields (timestamps, source codes, values) arrays like SegmentStore.read:
+        a chunk per on-disk segment, then what is held in memory.
+        """
+        fields = FIELDS if fields is None else tuple(fields)
+        field_ids = [FIELD_IDS[name] for name in fields]
+        older_until = until
+        with self._lock:
+            series = self._series.get(server_id)
+            recent = None
+            if series is not None and series.timestamps:
+                start = bisect.bisect_left(series.timestamps, since) if since is not None else 0
+                end = bisect.bisect_right(series.timestamps, until) if until is not None else len(series.timestamps)
+                recent = (
+                    np.array(series.timestamps[start:end], dtype=float),
+                    np.array([SOURCES.index(source) for source in series.sources[start:end]], dtype="u1"),
+                    np.array([[row[field_id] for field_id in field_ids] for row in series.rows[start:end]],
+                             dtype=float).reshape(end - start, len(field_ids)),
+                )
+                oldest = math.nextafter(series.timestamps[0], -math.inf)
+                older_until = oldest if until is None else min(until, oldest)
+        if self.segments is not None and (since is None or older_until is None or since <= older_until):
+            yield from self.segments.chunks(server_id, since, older_until, fields)
+        if recent is not None and len(recent[0]):
+            yield recent
+
+    def first_timestamp(self, server_id: int) -> Optional[float]:
+        """Timestamp of the server's oldest stored sample (on disk or in memory), or None"""
+        with self._lock:
+            series = self._series.get(server_id)
+            first = series.timestamps[0] if series is not None and series.timestamps else None
+        if self.segments is not None:
+            on_disk = self.segments.first_timestamp(server_id)
+            if on_disk is not None and (first is None or on_disk < first):
+                first = on_disk
+        return first
+
+    def rollup_history(self, server_id: int, resolution: float, since: Optional[float] = None, until: Optional[float] = None,
+                       fields: Optional[Iterable[str]] = None, quantiles: Sequence[float] = (0.5, 0.95, 0.99)) -> dict:
+        """Count/avg/min/max and quantiles per resolution-wide bucket, from the rollups (see rollup.py)"""
+        with self._lock:
+            return self.rollups.query(server_id, resolution, since, until,
+                                      ROLLUP_FIELDS if fields is None else fields, quantiles)
+
+    @staticmethod
+    def _sample(series: _Series, index: int, fields: Sequence[str]) -> dict:
+        row = series.rows[index]
+        sample = {"timestamp": series.timestamps[index], "source": series.sources[index]}
+        for name in fields:
+            sample[name] = _value(row[FIELD_IDS[name]])
+        return sample
+
+    def forget(self, server_id: int) -> None:
+        """Drop all history for a server"""
+        with self._lock:
+            self._series.pop(server_id, None)
+            self.rollups.forget(server_id)
+        if self.writer is not None:
+            self.writer.forget(server_id)
+        if self.segments is not None:
+            self.segments.forget(server_id)
+
+    def load_rollups(self) -> None:
+        """Rebuild the rollups (held in memory only) from the segment files, e.g. after a restart"""
+        if self.segments is None:
+            return
+        since = time.time() - self.rollups.span()
+        field_ids = [FIELD_IDS[name] for name in ROLLUP_FIELDS]
+        for server_id in self.segments.server_ids():
+            timestamps, _sources, values = self.segments.read(server_id, since, None, ROLLUP_FIELDS)
+            with self._lock:
+                self.rollups.add_columns(server_id, timestamps, field_ids, values)
+
+    def memory_stats(self) -> dict:
+        """Servers and samples held in memory (no file I/O, cheap enough for every scrape)"""
+        with self._lock:
+            return {
+                "servers": len(self._series),
+                "samples": sum(len(series.timestamps) for series in self._series.values()),
+                "max_samples_per_server": self.max_samples,
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            rollups = self.rollups.stats()
+        # Segment stats walk the segment directory - outside the store lock, so ingest is not held up
+        return {
+            **self.memory_stats(),
+            "rollups": rollups,
+            "segments": self.segments.stats() if self.segments is not None else None,
+            "writer": self.writer.stats() if self.writer is not None else None,
+        }
+
+
+metrics_store = MetricsStore(segments=segment_store, writer=buffered(segment_store))
+# Before anything is added, so no sample is counted twice
+metrics_store.load_rollups()
+
+
+def sample_from_metrics(metrics: dict) -> dict:
+    """Flatten a basic metrics payload (see linux_handler.get_basic_metrics) into a sample"""
+    cpu = metrics.get("cpu") or {}
+    memory = metrics.get("memory") or {}
+    disk = metrics.get("disk") or {}
+    io = disk.get("io") or {}
+    network = metrics.get("network") or {}
+    load_avg = list(cpu.get("load_avg") or []) + [None, None, None]
+    return {
+        "timestamp": metrics.get("timestamp") or time.time(),
+        "cpu_percent": cpu.get("usage_percent"),
+        "cpu_cores": cpu.get("cores"),
+        "load_1": load_avg[0],
+        "load_5": load_avg[1],
+        "load_15": load_avg[2],
+        "mem_total_gb": memory.get("total_gb"),
+        "mem_used_gb": memory.get("used_gb"),
+        "mem_available_gb": memory.get("available_gb"),
+        "mem_percent": memory.get("usage_percent"),
+        "disk_total_gb": disk.get("total_gb"),
+        "disk_used_gb": disk.get("used_gb"),
+        "disk_available_gb": disk.get("available_gb"),
+        "disk_percent": disk.get("usage_percent"),
+        "disk_read_bytes_per_sec": io.get("read_bytes_per_sec"),
+        "disk_write_bytes_per_sec": io.get("write_bytes_per_sec"),
+        "net_bytes_sent": network.get("bytes_sent"),
+        "net_bytes_recv": network.get("bytes_recv"),
+        "net_bytes_sent_per_sec": network.get("bytes_sent_per_sec"),
+        "net_bytes_recv_per_sec": network.get("bytes_recv_per_sec"),
+        "uptime_seconds": None,
+    }
+
+
+def _uptime_text(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "N/A"
+    minutes = int(seconds) // 60
+    days, minutes = divmod(minutes, 1440)
+    hours, minutes = divmod(minutes, 60)
+    return f"up {days} days, {hours} hours, {minutes} minutes"
+
+
+def metrics_from_sample(sample: dict, server) -> dict:
+    """Render a stored sample in the basic metrics shape fetch_metrics returns"""
+    def value(name: str, default=0.0):
+        return default if sample.get(name) is None else sample[name]
+    
+    return {
+        "server_id": server.id,
+        "hostname": server.system_hostname or server.hostname,
+        "status": "online",
+        "timestamp": sample["timestamp"],
+        "source": sample.get("source"),
+        "cpu": {
+            "usage_percent": value("cpu_percent"),
+            "cores": int(value("cpu_cores", 1)),
+            "load_avg": [value("load_1"), value("load_5"), value("load_15")],
+        },
+        "memory": {
+            "total_gb": value("mem_total_gb"),
+            "used_gb": value("mem_used_gb"),
+            "available_gb": value("mem_available_gb"),
+            "usage_percent": value("mem_percent"),
+        },
+        "disk": {
+            "total_gb": value("disk_total_gb"),
+            "used_gb": value("disk_used_gb"),
+            "available_gb": value("disk_available_gb"),
+            "usage_percent": value("disk_percent"),
+            "mount_point": "C:" if server.os_type == "windows" else "/",
+            "io": {
+                "read_bytes_per_sec": sample.get("disk_read_bytes_per_sec"),
+                "write_bytes_per_sec": sample.get("disk_write_bytes_per_sec"),
+            },
+        },
+        "network": {
+            "bytes_sent": int(value("net_bytes_sent", 0)),
+            "bytes_recv": int(value("net_bytes_recv", 0)),
+            "bytes_sent_per_sec": sample.get("net_bytes_sent_per_sec"),
+            "bytes_recv_per_sec": sample.get("net_bytes_recv_per_sec"),
+            "packets_sent": 0,
+            "packets_recv": 0,
+            "interfaces": [],
+        },
+        "uptime": {
+            "text": _uptime_text(sample.get("uptime_seconds")),
+        },
+    }
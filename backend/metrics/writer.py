@@ -0,0 +1,241 @@
+"""
+Write buffer between the metrics store and its on-disk segments.
+
+New samples from every host are queued in memory and written by one
+background thread in group commits: each flush appends all queued rows of a
+server in one write per segment, then fsyncs every segment it touched once
+(METRICS_FSYNC=0 leaves that to the OS). A flush starts every
+METRICS_FLUSH_INTERVAL seconds (default 1) or as soon as METRICS_FLUSH_ROWS
+rows are queued (default 5000), so the cost of a write is shared by all the
+hosts that polled in the meantime instead of paid per sample.
+
+Durability: a crash loses at most the rows of the current flush interval.
+With METRICS_DURABLE_INGEST=1 /api/ingest only answers once the batch is on
+disk (and fsynced); concurrent requests wait for the same flush, so this
+costs latency rather than throughput. Agents keep and resend batches that
+were not acknowledged.
+
+Backpressure: at most METRICS_BUFFER_ROWS rows (default 200000) may be
+queued or being written. When the disk falls behind, writers wait up to
+METRICS_BUFFER_TIMEOUT seconds (default 5) for room and then get
+WriteBufferFull - /api/ingest answers 503 so agents back off and retry.
+Writes that fail with an I/O error are retried on the next flush; rows
+that cannot be encoded at all are dropped (and counted) so they do not stop
+the writer thread.
+
+The writer thread also compacts the segments and applies retention to every
+server every METRICS_COMPACT_INTERVAL seconds (default 3600, 0 = never),
+starting right after the first write - retention otherwise only runs when a
+segment fills up.
+"""
+
+import atexit
+import os
+import threading
+import time
+from typing import Optional, Sequence
+
+from .segments import SegmentStore
+
+
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
+FLUSH_ROWS = int(os.getenv("METRICS_FLUSH_ROWS", "5000"))
+MAX_ROWS = int(os.getenv("METRICS_BUFFER_ROWS", "200000"))
+BUFFER_TIMEOUT = float(os.getenv("METRICS_BUFFER_TIMEOUT", "5"))
+FSYNC = os.getenv("METRICS_FSYNC", "1").lower() not in ("0", "false", "no")
+DURABLE_INGEST = os.getenv("METRICS_DURABLE_INGEST", "").lower() in ("1", "true", "yes")
+COMPACT_INTERVAL = float(os.getenv("METRICS_COMPACT_INTERVAL", "3600"))
+
+
+class WriteBufferFull(Exception):
+    """The segment writer is too far behind to accept more rows"""
+
+    def __init__(self, queued: int, timeout: float):
+        self.queued = queued
+        self.retry_after = max(1.0, timeout)
+        super().__init__(f"Metrics storage is behind ({queued} rows waiting to be written)")
+
+
+class WriteBuffer:
+    """Queues rows per (server, source) and appends them to segments in group commits"""
+
+    def __init__(self, segments: SegmentStore, flush_interval: float = FLUSH_INTERVAL, flush_rows: int = FLUSH_ROWS,
+                 max_rows: int = MAX_ROWS, timeout: float = BUFFER_TIMEOUT, fsync: bool = FSYNC,
+                 compact_interval: float = COMPACT_INTERVAL):
+        self.segments = segments
+        self.flush_interval = flush_interval
+        self.flush_rows = max(1, flush_rows)
+        self.max_rows = max(self.flush_rows, max_rows)
+        self.timeout = timeout
+        self.fsync = fsync
+        self.compact_interval = compact_interval
+        self._cond = threading.Condition()
+        self._pending: dict = {}  # (server_id, source) -> rows
+        self._pending_rows = 0
+        self._queued = 0  # rows pending or being written
+        self._submitted = 0  # ticket of the last submit
+        self._durable = 0  # every submit up to this ticket is on disk
+        self._urgent = False  # someone is waiting for the next flush
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._flushes = 0
+        self._rows_written = 0
+        self._last_flush_ms = None
+        self._errors = 0
+        self._dropped = 0
+        self._compactions = 0
+
+    def reserve(self, timeout: Optional[float] = None) -> None:
+        """Wait until the buffer is below its limit; raises WriteBufferFull after the timeout"""
+        timeout = self.timeout if timeout is None else timeout
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._queued < self.max_rows, timeout):
+                raise WriteBufferFull(self._queued, timeout)
+
+    def submit(self, server_id: int, rows: Sequence[Sequence], source: str = "pull") -> int:
+        """Queue rows of (timestamp, value, ...) in FIELDS order; returns a ticket for wait()"""
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+                self._thread.start()
+            self._pending.setdefault((server_id, source), []).extend(rows)
+            self._pending_rows += len(rows)
+            self._queued += len(rows)
+            self._submitted += 1
+            self._cond.notify_all()
+            return self._submitted
+
+    def wait(self, ticket: int, timeout: Optional[float] = None) -> bool:
+        """Wait until the submit with this ticket is on disk; False on timeout"""
+        timeout = self.timeout if timeout is None else timeout
+        with self._cond:
+            if self._durable < ticket:
+                # Flush now rather than at the end of the interval; requests
+                # arriving meanwhile share the flush after this one
+                self._urgent = True
+                self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._durable >= ticket, timeout)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Write everything queued so far"""
+        with self._cond:
+            ticket = self._submitted
+        return self.wait(ticket, timeout)
+
+    def forget(self, server_id: int) -> None:
+        """Drop a server's queued rows and let a write in progress finish"""
+        with self._cond:
+            for key in [key for key in self._pending if key[0] == server_id]:
+                rows = self._pending.pop(key)
+                self._pending_rows -= len(rows)
+                self._queued -= len(rows)
+            ticket = self._submitted
+        self.wait(ticket)
+
+    def _run(self) -> None:
+        next_compact = time.monotonic() + self.flush_interval
+        while True:
+            with self._cond:
+                idle = None if self.compact_interval <= 0 else max(0.0, next_compact - time.monotonic())
+                if self._cond.wait_for(lambda: self._pending or self._closed, idle):
+                    # Give other hosts the rest of the interval to join this flush
+                    self._cond.wait_for(
+                        lambda: self._closed or self._urgent or self._pending_rows >= self.flush_rows,
+                        self.flush_interval,
+                    )
+                    if not self._pending and self._closed:
+                        return
+                    batch, self._pending = self._pending, {}
+                    self._pending_rows = 0
+                    self._urgent = False
+                    ticket = self._submitted
+                else:
+                    batch = None
+            if batch is not None:
+                self._write(batch, ticket)
+            if self.compact_interval > 0 and time.monotonic() >= next_compact:
+                self._compact()
+                next_compact = time.monotonic() + self.compact_interval
+
+    def _compact(self) -> None:
+        """Retention and compaction pass over every server's segments"""
+        try:
+            self.segments.compact()
+        except Exception as e:
+            print(f"Failed to compact metrics segments: {e}")
+            return
+        with self._cond:
+            self._compactions += 1
+
+    def _write(self, batch: dict, ticket: int) -> None:
+        started = time.monotonic()
+        written = dropped = 0
+        try:
+            for key in list(batch):
+                server_id, source = key
+                try:
+                    written += self.segments.append(server_id, batch[key], source)
+                except OSError:
+                    raise
+                except Exception as e:
+                    # Not the disk but the rows themselves: they would fail the same way on every retry
+                    print(f"Dropping {len(batch[key])} metrics rows of server {server_id} that cannot be written: {e!r}")
+                    dropped += len(batch[key])
+                del batch[key]
+            if self.fsync:
+                self.segments.sync()
+        except Exception as e:
+            print(f"Failed to write metrics segments, retrying: {e!r}")
+            with self._cond:
+                self._errors += 1
+                self._dropped += dropped
+                self._queued -= written + dropped
+                # Unwritten rows go back in front of anything queued since
+                for key, rows in self._pending.items():
+                    batch.setdefault(key, []).extend(rows)
+                self._pending = batch
+                self._pending_rows = sum(len(rows) for rows in batch.values())
+                self._cond.notify_all()
+            time.sleep(min(self.flush_interval, 1.0))
+            return
+        with self._cond:
+            self._queued -= written + dropped
+            self._dropped += dropped
+            self._durable = max(self._durable, ticket)
+            self._flushes += 1
+            self._rows_written += written
+            self._last_flush_ms = round((time.monotonic() - started) * 1000, 1)
+            self._cond.notify_all()
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Write what is queued and stop the writer thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queued_rows": self._queued,
+                "max_rows": self.max_rows,
+                "flush_interval": self.flush_interval,
+                "flushes": self._flushes,
+                "rows_written": self._rows_written,
+                "last_flush_ms": self._last_flush_ms,
+                "write_errors": self._errors,
+                "rows_dropped": self._dropped,
+                "compactions": self._compactions,
+                "fsync": self.fsync,
+            }
+
+
+def buffered(segments: Optional[SegmentStore]) -> Optional[WriteBuffer]:
+    """Write buffer for a segment store (written out at interpreter exit)"""
+    if segments is None:
+        return None
+    buffer = WriteBuffer(segments)
+    atexit.register(buffer.close)
+    return buffer
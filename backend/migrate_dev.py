@@ -50,6 +50,33 @@ def run():
         # Add ssh_port column for Linux servers
         add_column_if_missing(engine, "servers", "ssh_port", "INTEGER DEFAULT 22")
         
+        # Add encrypted_key_passphrase column for passphrase-protected SSH keys
+        add_column_if_missing(engine, "servers", "encrypted_key_passphrase", "TEXT")
+        
+        # Add per-server remote call timeouts (seconds, NULL = global default)
+        add_column_if_missing(engine, "servers", "connect_timeout", "FLOAT")
+        add_column_if_missing(engine, "servers", "auth_timeout", "FLOAT")
+        add_column_if_missing(engine, "servers", "command_timeout", "FLOAT")
+        
+        # Add stored system inventory columns
+        add_column_if_missing(engine, "servers", "os_name", "VARCHAR(255)")
+        add_column_if_missing(engine, "servers", "kernel", "VARCHAR(255)")
+        add_column_if_missing(engine, "servers", "system_hostname", "VARCHAR(255)")
+        add_column_if_missing(engine, "servers", "boot_time", "VARCHAR(32)")
+        add_column_if_missing(engine, "servers", "inventory_updated_at", "DATETIME")
+        
+        # Add push-agent ingest token hash (looked up on every ingest request)
+        add_column_if_missing(engine, "servers", "ingest_token_hash", "VARCHAR(64)")
+        with engine.connect() as conn:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_servers_ingest_token_hash ON servers (ingest_token_hash)"))
+            conn.commit()
+        
+        # Add server tags (comma-separated, used to scope alert rules)
+        add_column_if_missing(engine, "servers", "tags", "VARCHAR(512)")
+        
+        # Add alert rule kind (threshold on the value, or anomaly on its z-score)
+        add_column_if_missing(engine, "alert_rules", "kind", "VARCHAR(16) NOT NULL DEFAULT 'threshold'")
+        
         print("Migration completed (or already up-to-date).")
 
 
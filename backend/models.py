@@ -1,7 +1,9 @@
 from datetime import datetime
+import json
 import os
 import base64
 from cryptography.fernet import Fernet
+from sqlalchemy import event, inspect
 from .db import db
 
 
@@ -60,10 +62,26 @@ class Server(db.Model):
     key_path = db.Column(db.String(1024), nullable=True)
     # Encrypted password storage (for Windows and Linux password auth)
     encrypted_password = db.Column(db.Text, nullable=True)
+    # Encrypted passphrase for an encrypted private key file
+    encrypted_key_passphrase = db.Column(db.Text, nullable=True)
     # WinRM port for Windows servers
     winrm_port = db.Column(db.Integer, nullable=True, default=5985)
     # SSH port for Linux servers
     ssh_port = db.Column(db.Integer, nullable=True, default=22)
+    # Remote call timeouts in seconds (NULL = global default, see handlers/timeouts.py)
+    connect_timeout = db.Column(db.Float, nullable=True)
+    auth_timeout = db.Column(db.Float, nullable=True)
+    command_timeout = db.Column(db.Float, nullable=True)
+    # System inventory (refreshed by handlers/inventory.py, not on every poll)
+    os_name = db.Column(db.String(255), nullable=True)
+    kernel = db.Column(db.String(255), nullable=True)
+    system_hostname = db.Column(db.String(255), nullable=True)
+    boot_time = db.Column(db.String(32), nullable=True)
+    inventory_updated_at = db.Column(db.DateTime, nullable=True)
+    # SHA-256 of the push agent's ingest token (see metrics/ingest.py)
+    ingest_token_hash = db.Column(db.String(64), nullable=True, index=True)
+    # Comma-separated labels, used to scope alert rules
+    tags = db.Column(db.String(512), nullable=True)
     # Status
     status = db.Column(db.String(64), nullable=True)
     last_seen = db.Column(db.DateTime, nullable=True)
@@ -84,6 +102,30 @@ class Server(db.Model):
         else:
             self.encrypted_password = None
 
+    def get_key_passphrase(self) -> str:
+        """Get decrypted private key passphrase"""
+        if self.encrypted_key_passphrase:
+            return decrypt_password(self.encrypted_key_passphrase)
+        return ""
+
+    def set_key_passphrase(self, passphrase: str):
+        """Set encrypted private key passphrase"""
+        if passphrase:
+            self.encrypted_key_passphrase = encrypt_password(passphrase)
+        else:
+            self.encrypted_key_passphrase = None
+
+    def tag_list(self) -> list:
+        """Tags as a list (stored comma-separated)"""
+        return [t.strip() for t in (self.tags or "").split(",") if t.strip()]
+
+    def set_tags(self, tags):
+        """Set tags from a list or a comma-separated string"""
+        if isinstance(tags, str):
+            tags = tags.split(",")
+        cleaned = sorted({str(t).strip() for t in tags or [] if str(t).strip()})
+        self.tags = ",".join(cleaned) or None
+
     def to_dict(self) -> dict:
         return {
             "id": self.id,
@@ -95,8 +137,21 @@ class Server(db.Model):
             "auth_type": self.auth_type,
             "key_path": self.key_path,
             "has_password": bool(self.encrypted_password),  # Don't expose actual password
+            "has_key_passphrase": bool(self.encrypted_key_passphrase),
             "winrm_port": self.winrm_port if hasattr(self, 'winrm_port') else None,
             "ssh_port": self.ssh_port if hasattr(self, 'ssh_port') else None,
+            "connect_timeout": self.connect_timeout,
+            "auth_timeout": self.auth_timeout,
+            "command_timeout": self.command_timeout,
+            "inventory": {
+                "os": self.os_name,
+                "kernel": self.kernel,
+                "hostname": self.system_hostname,
+                "boot_time": self.boot_time,
+                "updated_at": self.inventory_updated_at.isoformat() + "Z",
+            } if self.inventory_updated_at else None,
+            "has_ingest_token": bool(self.ingest_token_hash),
+            "tags": self.tag_list(),
             "status": self.status,
             "last_seen": self.last_seen.isoformat() + "Z" if self.last_seen else None,
             "notes": self.notes,
@@ -105,3 +160,132 @@ class Server(db.Model):
         }
 
 
+class AlertRule(db.Model):
+    __tablename__ = "alert_rules"
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+    # A field of metrics/store.py FIELDS, e.g. cpu_percent
+    metric = db.Column(db.String(64), nullable=False)
+    # threshold: compare the metric's value; anomaly: compare its z-score (metrics/anomaly.py)
+    kind = db.Column(db.String(16), nullable=False, default="threshold")
+    comparator = db.Column(db.String(2), nullable=False)  # > >= < <= == !=
+    threshold = db.Column(db.Float, nullable=False)
+    # Seconds the condition must hold before the alert fires (0 = on the first sample)
+    duration = db.Column(db.Float, nullable=False, default=0)
+    severity = db.Column(db.String(16), nullable=False, default="warning")  # warning | critical
+    # Scope: one server, servers with a tag, or (both NULL) every server
+    server_id = db.Column(db.Integer, db.ForeignKey("servers.id", ondelete="CASCADE"), nullable=True)
+    tag = db.Column(db.String(64), nullable=True)
+    # Notifications go to this webhook (else ALERT_WEBHOOK_URL) and the local alert log
+    webhook_url = db.Column(db.String(1024), nullable=True)
+    enabled = db.Column(db.Boolean, default=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "metric": self.metric,
+            "kind": self.kind or "threshold",
+            "comparator": self.comparator,
+            "threshold": self.threshold,
+            "duration": self.duration,
+            "severity": self.severity,
+            "server_id": self.server_id,
+            "tag": self.tag,
+            "webhook_url": self.webhook_url,
+            "enabled": self.enabled,
+            "created_at": self.created_at.isoformat() + "Z",
+        }
+
+
+class Alert(db.Model):
+    __tablename__ = "alerts"
+
+    id = db.Column(db.Integer, primary_key=True)
+    rule_id = db.Column(db.Integer, db.ForeignKey("alert_rules.id", ondelete="CASCADE"), nullable=False, index=True)
+    server_id = db.Column(db.Integer, db.ForeignKey("servers.id", ondelete="CASCADE"), nullable=False, index=True)
+    state = db.Column(db.String(16), nullable=False)  # pending | firing | resolved
+    value = db.Column(db.Float, nullable=True)  # value that caused the last state change
+    started_at = db.Column(db.DateTime, nullable=False)  # first breaching sample
+    fired_at = db.Column(db.DateTime, nullable=True)
+    resolved_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self) -> dict:
+        iso = lambda dt: dt.isoformat() + "Z" if dt else None  # noqa: E731
+        return {
+            "id": self.id,
+            "rule_id": self.rule_id,
+            "server_id": self.server_id,
+            "state": self.state,
+            "value": self.value,
+            "started_at": iso(self.started_at),
+            "fired_at": iso(self.fired_at),
+            "resolved_at": iso(self.resolved_at),
+        }
+
+
+class DailySummary(db.Model):
+    """One server's metrics for one UTC day, computed once the day is over (see metrics/reports.py)"""
+    __tablename__ = "daily_summaries"
+    __table_args__ = (db.UniqueConstraint("server_id", "day", name="uq_daily_summaries_server_day"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    server_id = db.Column(db.Integer, db.ForeignKey("servers.id", ondelete="CASCADE"), nullable=False, index=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    samples = db.Column(db.Integer, nullable=False, default=0)
+    uptime_percent = db.Column(db.Float, nullable=False, default=0.0)
+    cpu_avg = db.Column(db.Float, nullable=True)
+    cpu_max = db.Column(db.Float, nullable=True)
+    mem_avg = db.Column(db.Float, nullable=True)
+    mem_max = db.Column(db.Float, nullable=True)
+    disk_used_start_gb = db.Column(db.Float, nullable=True)
+    disk_used_end_gb = db.Column(db.Float, nullable=True)
+    outage_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    # JSON list of [start, end] unix timestamps
+    outages = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def disk_growth_gb(self):
+        if self.disk_used_start_gb is None or self.disk_used_end_gb is None:
+            return None
+        return round(self.disk_used_end_gb - self.disk_used_start_gb, 3)
+
+    def to_dict(self) -> dict:
+        return {
+            "server_id": self.server_id,
+            "day": self.day.isoformat(),
+            "samples": self.samples,
+            "uptime_percent": self.uptime_percent,
+            "cpu_avg": self.cpu_avg,
+            "cpu_max": self.cpu_max,
+            "mem_avg": self.mem_avg,
+            "mem_max": self.mem_max,
+            "disk_used_start_gb": self.disk_used_start_gb,
+            "disk_used_end_gb": self.disk_used_end_gb,
+            "disk_growth_gb": self.disk_growth_gb(),
+            "outage_seconds": self.outage_seconds,
+            "outages": json.loads(self.outages) if self.outages else [],
+        }
+
+
+@event.listens_for(Server, "after_update")
+def _invalidate_changed_credentials(mapper, connection, target):
+    """Drop cached decrypted secrets and parsed keys when a server's credentials change
+
+    Polls and ingest batches update status and last_seen all the time; those
+    updates leave the cache alone.
+    """
+    attrs = inspect(target).attrs
+    if not any(attrs[name].history.has_changes() for name in ("encrypted_password", "encrypted_key_passphrase", "key_path")):
+        return
+    from .handlers.credentials import invalidate_server
+    invalidate_server(target.id, target.key_path)
+
+
+@event.listens_for(Server, "after_delete")
+def _invalidate_cached_credentials(mapper, connection, target):
+    """Drop cached decrypted secrets and parsed keys of a deleted server"""
+    from .handlers.credentials import invalidate_server
+    invalidate_server(target.id, target.key_path)